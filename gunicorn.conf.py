@@ -0,0 +1,36 @@
+# Gunicorn picks this file up automatically from the working directory.
+import os
+
+# Threaded workers so long-lived /admin/api/events streams each hold a thread,
+# not a whole sync worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 16)
+
+# GUNICORN_PRELOAD=1 loads the app once in the master; workers then share its
+# memory-mapped security models instead of each loading their own
+preload_app = os.environ.get('GUNICORN_PRELOAD') == '1'
+
+
+def when_ready(server):
+    """Map the persisted security models in the master before any worker forks"""
+    if not server.cfg.preload_app:
+        return
+    app = server.app.wsgi()
+    security_models = getattr(app, 'extensions', {}).get('security_models')
+    if security_models is not None:
+        security_models.preload()
+
+
+def worker_exit(server, worker):
+    """Flush write-behind buffers before the worker process goes away"""
+    app = getattr(worker, 'wsgi', None)
+    extensions = getattr(app, 'extensions', {})
+    view_ingest = extensions.get('view_ingest')
+    if view_ingest is not None:
+        view_ingest.shutdown()
+    metrics = extensions.get('metrics')
+    if metrics is not None:
+        metrics.flush()
+    profiler = extensions.get('profiler')
+    if profiler is not None:
+        profiler.flush()
@@ -7,6 +7,18 @@ from flask_caching import Cache
 from flask_wtf.csrf import CSRFProtect
 import os
 from dotenv import load_dotenv
+from app.view_ingest import ViewIngestor
+from app.stats_snapshot import StatsSnapshotService
+from app.event_stream import EventStream
+from app.jobs import JobRunner
+from app.image_pipeline import ImagePipeline
+from app.ip_blocklist import IPBlocklist
+from app.threat_scoring import ThreatScoring
+from app.security_models import SecurityModels
+from app.explanations import ExplanationService
+from app.health_probes import HealthProbes
+from app.metrics import RequestMetrics
+from app.profiler import SamplingProfiler
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +30,18 @@ migrate = Migrate()
 mail = Mail()
 cache = Cache()
 csrf = CSRFProtect()
+view_ingest = ViewIngestor()
+stats_snapshot = StatsSnapshotService()
+event_stream = EventStream()
+jobs = JobRunner()
+image_pipeline = ImagePipeline()
+ip_blocklist = IPBlocklist()
+threat_scoring = ThreatScoring()
+security_models = SecurityModels()
+explanations = ExplanationService()
+health_probes = HealthProbes()
+metrics = RequestMetrics()
+profiler = SamplingProfiler()
 
 def create_app():
     app = Flask(__name__)
@@ -28,10 +52,88 @@ def create_app():
         'sqlite:///umbrella_movies.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.getcwd(), 'uploads')
+    app.config['MOVIES_DIRECTORY'] = os.environ.get('MOVIES_DIRECTORY') or os.path.join(os.getcwd(), 'movies')
     
-    # Cache configuration
-    app.config['CACHE_TYPE'] = 'simple'
+    # Storage ledger
+    app.config['STORAGE_QUOTA_BYTES'] = 5 * 1024 * 1024 * 1024  # 5GB limit
+    app.config['STORAGE_RECONCILE_INTERVAL'] = int(os.environ.get('STORAGE_RECONCILE_INTERVAL') or 3600)
+    
+    # Cache configuration: worker-local LRU in front of Redis when available
+    app.config['CACHE_REDIS_URL'] = os.environ.get('REDIS_URL')
+    app.config['CACHE_TYPE'] = 'app.two_tier_cache.TwoTierCache' if app.config['CACHE_REDIS_URL'] else 'simple'
     app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+    app.config['CACHE_LOCAL_SIZE'] = int(os.environ.get('CACHE_LOCAL_SIZE') or 1024)
+    app.config['CACHE_LOCAL_TIMEOUT'] = 5
+    app.config['CACHE_EARLY_REFRESH_BETA'] = 1.0
+    app.config['USER_CACHE_TIMEOUT'] = 60  # seconds a user_loader snapshot may be reused
+    # Seconds to coalesce invalidations per tag (or tag prefix) into one bump
+    app.config['CACHE_TAG_DEBOUNCE'] = {'views': 1.0}
+    
+    # Buffered MovieView ingestion
+    app.config['VIEW_BUFFER_BACKEND'] = os.environ.get('VIEW_BUFFER_BACKEND', 'memory')
+    app.config['VIEW_BUFFER_MAX_SIZE'] = int(os.environ.get('VIEW_BUFFER_MAX_SIZE') or 500)
+    app.config['VIEW_BUFFER_FLUSH_INTERVAL'] = float(os.environ.get('VIEW_BUFFER_FLUSH_INTERVAL') or 5)
+    app.config['VIEW_BUFFER_MAX_PENDING'] = int(os.environ.get('VIEW_BUFFER_MAX_PENDING') or 100000)
+    app.config['VIEW_FLUSH_MAX_ATTEMPTS'] = 3  # failed flushes before a batch is bisected
+    
+    # Precomputed admin dashboard stats
+    app.config['STATS_SNAPSHOT_INTERVAL'] = int(os.environ.get('STATS_SNAPSHOT_INTERVAL') or 60)
+    
+    # Server-sent events for the admin dashboard
+    app.config['EVENT_STREAM_HEARTBEAT'] = 15  # seconds between keepalive comments
+    app.config['EVENT_STREAM_MAX_PENDING'] = 200  # queued keys per client before it is resynced
+    app.config['EVENT_STREAM_MAX_AGE'] = 300  # seconds before a client is asked to reconnect
+    
+    # Poster/thumbnail variants; 0 workers encodes inline in the request
+    app.config['IMAGE_VARIANT_WIDTHS'] = (160, 320, 640)
+    app.config['IMAGE_PIPELINE_WORKERS'] = int(os.environ.get('IMAGE_PIPELINE_WORKERS') or 2)
+    
+    # Media serving; MEDIA_SENDFILE is 'x-accel' (nginx), 'x-sendfile' (Apache) or unset
+    app.config['MEDIA_SENDFILE'] = os.environ.get('MEDIA_SENDFILE')
+    app.config['MEDIA_ACCEL_PREFIXES'] = {'uploads': '/_protected/uploads/', 'movies': '/_protected/movies/'}
+    app.config['MEDIA_IMMUTABLE_MAX_AGE'] = 365 * 24 * 3600  # content-addressed files never change
+    app.config['MEDIA_HASH_MAX_BYTES'] = 64 * 1024 * 1024  # larger files get a size/mtime ETag
+    app.config['MEDIA_MAX_RANGES'] = 16
+    
+    # Compiled IP blocklist, checked before every request
+    app.config['IP_BLOCKLIST_ENABLED'] = os.environ.get('IP_BLOCKLIST_ENABLED', '1') != '0'
+    app.config['IP_BLOCKLIST_POLL'] = 1.0  # seconds between generation checks per worker
+    app.config['IP_BLOCKLIST_MAX_AGE'] = 60  # seconds before a worker recompiles regardless
+    
+    # Admin threat scoring: fast path inline, full model in micro-batches
+    app.config['THREAT_BATCH_SIZE'] = 64
+    app.config['THREAT_BATCH_WAIT'] = 0.02  # seconds a batch waits to fill
+    app.config['THREAT_FAST_PATH_MIN_SAMPLES'] = 256  # full-model scores before the surrogate is trusted
+    app.config['THREAT_FAST_PATH_POLL'] = 30.0  # seconds between checks for another worker's newer fit
+    app.config['EXPLANATION_QUANTUM'] = 0.05  # feature rounding step for reusing explanations
+    app.config['EXPLANATION_MAX_ATTEMPTS'] = 3  # tries before waiting rows get an explanation_error
+    
+    # Memory-mapped security model dumps ('flask security-models persist' writes them)
+    app.config['SECURITY_MODEL_DIR'] = os.environ.get('SECURITY_MODEL_DIR') or \
+        os.path.join(app.instance_path, 'security_models')
+    
+    # Background health probes; HEALTH_PROBE_HISTORY samples are kept per probe
+    app.config['HEALTH_PROBE_HISTORY'] = 360
+    app.config['HEALTH_PROBE_ENDPOINT'] = '/'  # target of the synthetic API probe
+    
+    # Per-endpoint request metrics, merged across workers for /admin/metrics
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+    app.config['METRICS_FLUSH_INTERVAL'] = 5  # seconds between per-worker snapshots
+    
+    # On-demand sampling profiler; sessions are started from the admin panel
+    app.config['PROFILER_DIR'] = os.environ.get('PROFILER_DIR') or os.path.join(app.instance_path, 'profiles')
+    app.config['PROFILER_INTERVAL'] = 0.005  # seconds between stack samples
+    app.config['PROFILER_TOKEN_MAX_AGE'] = 300  # lifetime of signed single-request tokens
+    
+    # Background admin jobs (bulk deletes) and their chunk sizes
+    app.config['JOB_WORKERS'] = 2
+    app.config['PURGE_CHUNK_SIZE'] = 500  # users per set-based delete
+    app.config['PURGE_BATCH_SIZE'] = 5000  # dependent rows per DELETE ... WHERE id IN (...)
+    
+    # Cold storage for MovieView history older than the horizon
+    app.config['VIEW_ARCHIVE_DIR'] = os.environ.get('VIEW_ARCHIVE_DIR')
+    app.config['VIEW_ARCHIVE_HORIZON_DAYS'] = int(os.environ.get('VIEW_ARCHIVE_HORIZON_DAYS') or 90)
     
     # Mail configuration
     app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
@@ -49,6 +151,27 @@ def create_app():
     mail.init_app(app)
     cache.init_app(app)
     csrf.init_app(app)
+    view_ingest.init_app(app)
+    stats_snapshot.init_app(app)
+    event_stream.init_app(app)
+    jobs.init_app(app)
+    image_pipeline.init_app(app)
+    ip_blocklist.init_app(app)
+    threat_scoring.init_app(app)
+    security_models.init_app(app)
+    explanations.init_app(app)
+    health_probes.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    
+    from app.rollups import init_rollups
+    init_rollups(view_ingest)
+    
+    from app.storage_ledger import init_storage_ledger
+    init_storage_ledger(app)
+    
+    # Register background job handlers
+    from app import purge
     
     # Register blueprints
     from app.main import bp as main_bp
@@ -60,6 +183,19 @@ def create_app():
     from app.admin import bp as admin_bp
     app.register_blueprint(admin_bp, url_prefix='/admin')
     
+    from app.media import bp as media_bp
+    app.register_blueprint(media_bp)
+    
+    # Navigation dropdown reads the cached category list
+    @app.context_processor
+    def inject_nav_categories():
+        from app.models import get_categories_data
+        return {'categories': [category for category, _ in get_categories_data()]}
+    
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
+    
     # Create database tables
     with app.app_context():
         db.create_all()
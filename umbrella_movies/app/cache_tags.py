@@ -0,0 +1,223 @@
+"""Tag-based, generation-versioned invalidation on top of the Flask-Caching cache.
+
+Functions decorated with @tagged_memoize declare the tags their result depends
+on, e.g. 'movies', 'movie:<id>', 'category:<id>' or 'views:day'. Every tag has
+a generation counter stored in the cache and the counters are part of the
+memoized key, so invalidating a tag is a single counter bump: entries built
+on the old generation are simply never read again and expire on their own.
+
+Per-tag debounce windows (CACHE_TAG_DEBOUNCE, seconds keyed by tag or tag
+prefix) coalesce bursts of invalidations into one bump per window.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app import cache
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'early_refreshes': 0,
+                              'invalidations': 0, 'coalesced': 0})
+
+_pending_lock = threading.Lock()
+_pending = {}
+
+_invalidation_listeners = []
+
+def _generation_key(tag):
+    return f'tag-gen:{tag}'
+
+def _new_generation():
+    # Time-based so a counter evicted from the cache never restarts at a
+    # value that older entries were keyed on
+    return int(time.time() * 1000)
+
+def _generations(tags):
+    keys = [_generation_key(tag) for tag in tags]
+    values = cache.get_many(*keys) if keys else []
+    generations = []
+    for key, value in zip(keys, values):
+        if value is None:
+            value = _new_generation()
+            if not cache.add(key, value, timeout=0):
+                value = cache.get(key) or value
+        generations.append(value)
+    return generations
+
+def tag_generation(tag):
+    """Current generation of a tag; changes whenever the tag is invalidated"""
+    return _generations([tag])[0]
+
+def _record(tags, field, amount=1):
+    with _stats_lock:
+        for tag in tags:
+            _stats[tag][field] += amount
+
+def _resolve_tags(tags, args, kwargs):
+    return [tag(*args, **kwargs) if callable(tag) else tag for tag in tags]
+
+def _lock_key(key):
+    return f'lock:{key}'
+
+def _config(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+def _acquire_lock(key):
+    return cache.add(_lock_key(key), 1, timeout=_config('CACHE_LOCK_TIMEOUT', 30))
+
+def _wait_for(key):
+    deadline = time.monotonic() + _config('CACHE_LOCK_WAIT', 5)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        if not cache.has(_lock_key(key)):
+            break
+    return None
+
+def _should_refresh_early(delta, expires_at):
+    """Probabilistic early expiration (XFetch): recompute slightly before expiry.
+
+    The closer an entry is to expiring and the longer it took to compute, the
+    more likely a reader refreshes it, so workers do not all miss at once.
+    """
+    if not expires_at:
+        return False
+    beta = _config('CACHE_EARLY_REFRESH_BETA', 1.0)
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+def _compute_and_store(key, f, args, kwargs, timeout):
+    started = time.time()
+    value = f(*args, **kwargs)
+    delta = time.time() - started
+    effective_timeout = _config('CACHE_DEFAULT_TIMEOUT', 300) if timeout is None else timeout
+    expires_at = time.time() + effective_timeout if effective_timeout else 0
+    cache.set(key, (value, delta, expires_at), timeout=timeout)
+    return value
+
+def tagged_memoize(*tags, timeout=None):
+    """Memoize a function under the current generation of each tag.
+
+    Tags may be strings or callables taking the function's arguments, e.g.
+    tagged_memoize('movies', lambda movie_id: f'movie:{movie_id}').
+
+    Misses are single-flight: one caller computes while the others wait for
+    its result, and hits may trigger an early refresh near expiry.
+    """
+    def decorator(f):
+        name = f'{f.__module__}.{f.__qualname__}'
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            resolved = _resolve_tags(tags, args, kwargs)
+            generations = _generations(resolved)
+            arg_hash = hashlib.md5(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+            key = f'tagged:{name}:{arg_hash}:' + '.'.join(str(g) for g in generations)
+
+            cached = cache.get(key)
+            if cached is not None:
+                value, delta, expires_at = cached
+                if not _should_refresh_early(delta, expires_at) or not _acquire_lock(key):
+                    _record(resolved, 'hits')
+                    return value
+                _record(resolved, 'early_refreshes')
+                owns_lock = True
+            else:
+                _record(resolved, 'misses')
+                owns_lock = _acquire_lock(key)
+                if not owns_lock:
+                    # Another worker is computing this key; wait for its result
+                    # and only compute ourselves if it does not arrive in time
+                    cached = _wait_for(key)
+                    if cached is not None:
+                        return cached[0]
+
+            try:
+                return _compute_and_store(key, f, args, kwargs, timeout)
+            finally:
+                if owns_lock:
+                    cache.delete(_lock_key(key))
+
+        decorated_function.cache_tags = tags
+        return decorated_function
+    return decorator
+
+def _debounce_window(tag):
+    if not has_app_context():
+        return 0
+    windows = current_app.config.get('CACHE_TAG_DEBOUNCE') or {}
+    if tag in windows:
+        return windows[tag]
+    return windows.get(tag.split(':', 1)[0], 0)
+
+def _bump(tag):
+    key = _generation_key(tag)
+    if cache.get(key) is None:
+        cache.set(key, _new_generation(), timeout=0)
+    else:
+        cache.cache.inc(key)
+    _record([tag], 'invalidations')
+    for listener in _invalidation_listeners:
+        listener(tag)
+
+def on_invalidate(f):
+    """Register f(tag) to be called whenever a tag's generation is bumped"""
+    _invalidation_listeners.append(f)
+    return f
+
+def _flush_pending(app, tag):
+    with _pending_lock:
+        _pending.pop(tag, None)
+    with app.app_context():
+        _bump(tag)
+
+def invalidate_tags(*tags):
+    """Bump each tag's generation, honouring its debounce window"""
+    for tag in tags:
+        window = _debounce_window(tag)
+        if not window:
+            _bump(tag)
+            continue
+        with _pending_lock:
+            if tag in _pending:
+                _record([tag], 'coalesced')
+                continue
+            timer = threading.Timer(window, _flush_pending,
+                                    args=(current_app._get_current_object(), tag))
+            timer.daemon = True
+            _pending[tag] = timer
+        timer.start()
+
+def invalidate_on_commit(target, *tags):
+    """Queue tag invalidation until the target's session commits.
+
+    Meant for mapper event listeners: bumping a generation mid-flush would let
+    a concurrent reader cache pre-commit data under the new generation.
+    """
+    session = object_session(target)
+    if session is None:
+        invalidate_tags(*tags)
+        return
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate_tags(*sorted(tags))
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back_tags(session):
+    session.info.pop('cache_tags', None)
+
+def tag_stats():
+    """Return per-tag hit/miss/refresh/invalidation counters for this worker"""
+    with _stats_lock:
+        return {tag: dict(counts) for tag, counts in sorted(_stats.items())}
@@ -0,0 +1,345 @@
+import click
+import os
+from datetime import datetime
+from flask import current_app
+from flask.cli import AppGroup
+from app import db
+
+ratings_cli = AppGroup('ratings', help='Maintain denormalized movie rating aggregates.')
+
+@ratings_cli.command('rebuild')
+@click.option('--movie-id', 'movie_ids', type=int, multiple=True,
+              help='Only rebuild these movies (repeatable). Defaults to all movies.')
+def rebuild_ratings(movie_ids):
+    """Rebuild Movie rating sums, counts and histograms from Rating rows"""
+    from app.models import rebuild_rating_aggregates
+    drifted = rebuild_rating_aggregates(movie_ids or None)
+    db.session.commit()
+    click.echo(f'Rebuilt rating aggregates, {drifted} movies corrected')
+
+categories_cli = AppGroup('categories', help='Maintain materialized category movie counts.')
+
+@categories_cli.command('rebuild')
+def rebuild_categories():
+    """Recompute Category.movie_count from Movie rows"""
+    from app.models import rebuild_category_counts
+    corrected = rebuild_category_counts()
+    db.session.commit()
+    click.echo(f'Rebuilt category counts, {corrected} categories corrected')
+
+views_cli = AppGroup('views', help='Maintain hourly/daily MovieView rollups.')
+
+@views_cli.command('backfill')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First UTC day to rebuild. Defaults to the oldest raw view.')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last UTC day to rebuild. Defaults to today.')
+def backfill_views(start, end):
+    """Rebuild view rollups from raw MovieView rows"""
+    from app.rollups import backfill_view_rollups
+    days = backfill_view_rollups(start.date() if start else None, end.date() if end else None)
+    click.echo(f'Rebuilt view rollups for {days} days')
+
+@views_cli.command('check')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), required=True)
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+@click.option('--fix', is_flag=True, help='Rebuild every day that has a mismatch.')
+def check_views(start, end, fix):
+    """Compare daily rollups against raw MovieView counts"""
+    from app.rollups import check_view_rollups, backfill_view_rollups
+    mismatches = check_view_rollups(start.date(), end.date() if end else None)
+    for mismatch in mismatches:
+        click.echo(f"movie {mismatch['movie_id']} on {mismatch['day']}: "
+                   f"raw={mismatch['raw']} rollup={mismatch['rollup']}")
+    click.echo(f'{len(mismatches)} mismatched (movie, day) buckets')
+    if fix:
+        for day in sorted({m['day'] for m in mismatches}):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+            backfill_view_rollups(day, day)
+        click.echo('Mismatched days rebuilt')
+
+@views_cli.command('archive')
+@click.option('--horizon-days', type=int, default=None,
+              help='Archive views older than this many days. Defaults to VIEW_ARCHIVE_HORIZON_DAYS.')
+@click.option('--compact', is_flag=True, help='VACUUM the movie_view table afterwards.')
+def archive_views_command(horizon_days, compact):
+    """Move old raw views into compressed per-day partitions"""
+    from app.view_archive import archive_views, compact_hot_table
+    archived = archive_views(horizon_days)
+    for day, count in sorted(archived.items()):
+        click.echo(f'{day.isoformat()}: {count} views archived')
+    click.echo(f'Archived {sum(archived.values())} views from {len(archived)} days')
+    if compact and archived:
+        compact_hot_table()
+        click.echo('movie_view table compacted')
+
+storage_cli = AppGroup('storage', help='Maintain the upload storage ledger.')
+
+@storage_cli.command('reconcile')
+def reconcile_storage_command():
+    """Rescan upload and movie directories and correct ledger drift"""
+    from app.storage_ledger import reconcile_storage
+    result = reconcile_storage()
+    click.echo(f"Storage reconciled: {result['added']} added, {result['removed']} removed, "
+               f"{result['resized']} resized, {result['unlinked']} released files deleted")
+
+@storage_cli.command('stats')
+def storage_stats_command():
+    """Show stored bytes per category and the deduplication ratio"""
+    from app.storage_ledger import storage_totals, dedup_stats
+    for category, totals in storage_totals().items():
+        click.echo(f"{category:>10}: {totals['files']} files, {totals['bytes']} bytes "
+                   f"({totals['logical_bytes']} referenced)")
+    stats = dedup_stats()
+    click.echo(f"Dedup ratio {stats['dedup_ratio']}: {stats['logical_bytes']} bytes referenced, "
+               f"{stats['physical_bytes']} stored")
+
+images_cli = AppGroup('images', help='Generate and measure poster image variants.')
+
+@images_cli.command('rebuild')
+@click.option('--movie-id', 'movie_ids', type=int, multiple=True,
+              help='Only rebuild these movies (repeatable). Defaults to movies without variants.')
+def rebuild_images(movie_ids):
+    """Generate size/WebP variants for existing movie posters"""
+    from app import image_pipeline
+    from app.image_pipeline import generate_variants
+    from app.models import Movie
+    query = Movie.query.filter(Movie.poster_url.isnot(None))
+    query = query.filter(Movie.id.in_(movie_ids)) if movie_ids else query.filter(Movie.image_variants.is_(None))
+    count = 0
+    for movie in query.all():
+        source = os.path.join(current_app.config['UPLOAD_FOLDER'], movie.poster_url)
+        if not os.path.exists(source):
+            click.echo(f'movie {movie.id}: {movie.poster_url} missing, skipped')
+            continue
+        result = generate_variants(source, tuple(current_app.config['IMAGE_VARIANT_WIDTHS']),
+                                   current_app.config['IMAGE_VARIANT_QUALITY'])
+        # record() releases the movie's previous variants once the new ones are referenced
+        if image_pipeline.record(movie.poster_url, (Movie, movie.id), result) is not None:
+            count += 1
+    click.echo(f'Generated variants for {count} movies')
+
+@images_cli.command('benchmark')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--runs', type=int, default=3, help='Encode each variant this many times.')
+def benchmark_images(source, runs):
+    """Report output size and encode time per variant for one image"""
+    import shutil
+    import tempfile
+    from app.image_pipeline import generate_variants
+    widths = tuple(current_app.config['IMAGE_VARIANT_WIDTHS'])
+    source_size = os.path.getsize(source)
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        copy = shutil.copy(source, directory)
+        for _ in range(runs):
+            result = generate_variants(copy, widths, current_app.config['IMAGE_VARIANT_QUALITY'],
+                                       reuse_existing=False)
+            for variant in result['variants']:
+                timings.setdefault((variant['width'], variant['format']), []).append(variant['encode_ms'])
+    click.echo(f"source: {result['width']}x{result['height']}, {source_size} bytes")
+    click.echo(f"{'width':>6} {'format':>6} {'bytes':>10} {'% of source':>12} {'encode ms (best/mean)':>22}")
+    for variant in result['variants']:
+        samples = timings[(variant['width'], variant['format'])]
+        click.echo(f"{variant['width']:>6} {variant['format']:>6} {variant['size']:>10} "
+                   f"{variant['size'] / source_size * 100:>11.1f}% "
+                   f"{min(samples):>10.2f}/{sum(samples) / len(samples):<10.2f}")
+    click.echo(f"placeholder data URI: {len(result['placeholder'])} bytes")
+
+jobs_cli = AppGroup('jobs', help='Inspect and resume background admin jobs.')
+
+@jobs_cli.command('list')
+@click.option('--status', default=None, help='Only show jobs with this status.')
+def list_jobs(status):
+    """Show recent background jobs and their progress"""
+    from app.models import BackgroundJob
+    query = BackgroundJob.query.order_by(BackgroundJob.created_at.desc())
+    if status:
+        query = query.filter_by(status=status)
+    for job in query.limit(50):
+        click.echo(f'{job.id} {job.kind} {job.status} {job.processed}/{job.total}'
+                   + (f' error: {job.error}' if job.error else ''))
+
+@jobs_cli.command('resume')
+@click.argument('job_ids', nargs=-1)
+@click.option('--force', is_flag=True,
+              help='Also take over queued or running jobs whose heartbeat is still fresh.')
+def resume_jobs(job_ids, force):
+    """Run failed or abandoned jobs to completion in the foreground"""
+    from app import jobs
+    from app.models import BackgroundJob
+    query = BackgroundJob.query.filter(BackgroundJob.status.in_(['queued', 'running', 'failed']))
+    if job_ids:
+        query = query.filter(BackgroundJob.id.in_(job_ids))
+    for job in query.order_by(BackgroundJob.created_at).all():
+        if job.status != 'failed' and not force and not jobs.is_stale(job):
+            click.echo(f'Skipping {job.id} ({job.kind}): {job.status} with a live heartbeat; use --force')
+            continue
+        click.echo(f'Resuming {job.id} ({job.kind}) at {job.processed}/{job.total}')
+        if not jobs.run(job.id, force=force):
+            click.echo(f'{job.id}: taken by another process, skipped')
+            continue
+        click.echo(f'{job.id}: {BackgroundJob.query.get(job.id).status}')
+
+media_cli = AppGroup('media', help='Measure the media file endpoint.')
+
+@media_cli.command('benchmark')
+@click.option('--size-mb', type=int, default=64, help='Size of the generated test file.')
+@click.option('--requests', 'count', type=int, default=20, help='Requests per scenario.')
+def benchmark_media(size_mb, count):
+    """Compare validator-less send_from_directory with send_media for full, revalidated and ranged GETs"""
+    import hashlib
+    import tempfile
+    import time
+    from flask import send_from_directory
+    from app.media_server import send_media
+    app = current_app._get_current_object()
+
+    def run(view, headers):
+        started = time.perf_counter()
+        sent = 0
+        for _ in range(count):
+            with app.test_request_context('/', headers=headers):
+                response = view()
+                sent += sum(len(chunk) for chunk in response.iter_encoded())
+                response.close()
+        return time.perf_counter() - started, sent, response.status_code
+
+    with tempfile.TemporaryDirectory() as directory:
+        data = os.urandom(size_mb * 1024 * 1024)
+        name = hashlib.sha256(data).hexdigest() + '.bin'
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        del data
+        size = size_mb * 1024 * 1024
+        middle = size // 2
+        scenarios = [
+            ('full GET', {}),
+            ('revalidation', {'If-None-Match': f'"{name}"'}),
+            ('single range 1MB', {'Range': f'bytes={middle}-{middle + 1024 * 1024 - 1}'}),
+            ('3 ranges x 64KB', {'Range': f'bytes=0-65535,{middle}-{middle + 65535},-65536'}),
+        ]
+        previous = (app.config['UPLOAD_FOLDER'], app.config.get('MEDIA_SENDFILE'))
+        app.config['UPLOAD_FOLDER'], app.config['MEDIA_SENDFILE'] = directory, None
+        try:
+            click.echo(f"{'scenario':<18} {'path':<20} {'status':>6} {'req/s':>9} {'MB/s':>9} {'bytes/req':>12}")
+            for label, headers in scenarios:
+                for path, view in (('send_from_directory', lambda: send_from_directory(directory, name, conditional=False, etag=False)),
+                                   ('send_media', lambda: send_media('uploads', name))):
+                    elapsed, sent, status = run(view, headers)
+                    click.echo(f"{label:<18} {path:<20} {status:>6} {count / elapsed:>9.1f} "
+                               f"{sent / elapsed / 1024 / 1024:>9.1f} {sent // count:>12}")
+        finally:
+            app.config['UPLOAD_FOLDER'], app.config['MEDIA_SENDFILE'] = previous
+
+blocklist_cli = AppGroup('blocklist', help='Manage the compiled IP blocklist.')
+
+@blocklist_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--reason', default=None, help='Reason stored on every imported entry.')
+@click.option('--expires-at', type=click.DateTime(), default=None, help='Expiry for every imported entry.')
+def import_blocklist(source, reason, expires_at):
+    """Bulk-add addresses and CIDR ranges from a file, one per line"""
+    from app.ip_blocklist import import_networks
+    added, skipped, invalid = import_networks(source, reason=reason, expires_at=expires_at)
+    click.echo(f'Imported {added} entries, {skipped} already present, {len(invalid)} invalid')
+    for value in invalid[:20]:
+        click.echo(f'  invalid: {value}')
+
+@blocklist_cli.command('check')
+@click.argument('addresses', nargs=-1, required=True)
+@click.option('--runs', type=int, default=100000, help='Lookups to time per address.')
+def check_blocklist(addresses, runs):
+    """Report whether addresses are blocked and how long a lookup takes"""
+    import time
+    from app import ip_blocklist
+    compiled = ip_blocklist.current()
+    click.echo(f'{compiled.size} active entries')
+    for address in addresses:
+        started = time.perf_counter()
+        for _ in range(runs):
+            blocked = ip_blocklist.is_blocked(address)
+        elapsed = time.perf_counter() - started
+        click.echo(f"{address}: {'blocked' if blocked else 'allowed'}, {elapsed / runs * 1e6:.2f} us per lookup")
+
+security_models_cli = AppGroup('security-models', help='Persist and measure the lazily loaded security ML models.')
+
+@security_models_cli.command('persist')
+def persist_security_models():
+    """Write memory-mappable dumps of the security models to SECURITY_MODEL_DIR"""
+    from app import security_models
+    for path in security_models.persist():
+        click.echo(f'Wrote {path} ({os.path.getsize(path)} bytes)')
+
+@security_models_cli.command('status')
+def security_models_status():
+    """Show which security models this process has loaded and how"""
+    from app import security_models
+    for model in security_models.status():
+        click.echo(f"{model['name']:<24} {'loaded' if model['loaded'] else 'lazy':<7} "
+                   f"{model.get('source', '-'):<7} {model.get('seconds', '')}")
+
+@security_models_cli.command('benchmark')
+@click.option('--workers', type=int, default=4, help='Forked workers per mode.')
+def benchmark_security_models(workers):
+    """Compare model load time and per-worker RSS/PSS: eager import vs mmap vs preloaded mmap"""
+    from app import security_models
+    if any(model['loaded'] for model in security_models.status()):
+        raise click.ClickException('Models are already loaded in this process; run the benchmark first.')
+    for result in security_models.benchmark(workers):
+        if 'error' in result:
+            click.echo(f"{result.get('mode', '?')}: failed: {result['error']}")
+            continue
+        reports = result['workers']
+        mean = lambda key: sum(report.get(key, 0) for report in reports) / len(reports)
+        click.echo(f"{result['mode']}: master {result['master_before'].get('rss')} -> "
+                   f"{result['master_after'].get('rss')} MB RSS"
+                   + (f", preload {result['master_load_seconds']}s" if 'master_load_seconds' in result else ''))
+        click.echo(f"  per worker: load {mean('load_seconds'):.3f}s, RSS {mean('rss'):.1f} MB, "
+                   f"PSS {mean('pss'):.1f} MB (via {', '.join(reports[0]['sources']) or 'nothing'})")
+
+metrics_cli = AppGroup('metrics', help='Inspect request metrics.')
+
+@metrics_cli.command('benchmark')
+@click.option('--requests', 'count', type=int, default=100000, help='Requests per scenario.')
+def benchmark_metrics(count):
+    """Measure the per-request overhead of the metrics middleware"""
+    from app import metrics
+    for name, result in metrics.benchmark(count).items():
+        click.echo(f"{name}: {result['bare_us']} us bare, {result['instrumented_us']} us instrumented, "
+                   f"+{result['overhead_us']} us per request")
+
+@metrics_cli.command('show')
+def show_metrics():
+    """Print the merged metrics of all workers in Prometheus text format"""
+    from app import metrics
+    click.echo(metrics.render(), nl=False)
+
+profiler_cli = AppGroup('profiler', help='Control the sampling profiler.')
+
+@profiler_cli.command('token')
+def profiler_token():
+    """Print a signed header that profiles a single request"""
+    from app import profiler
+    click.echo(f"{current_app.config['PROFILER_HEADER']}: {profiler.sign()}")
+
+@profiler_cli.command('download')
+@click.option('--session', default=None, help='Session id. Defaults to the current session.')
+@click.option('--endpoint', default=None, help='Only stacks rooted at this endpoint.')
+def download_profile(session, endpoint):
+    """Print the merged collapsed stacks of a session"""
+    from app import profiler
+    click.echo(profiler.download(session, endpoint), nl=False)
+
+def register_commands(app):
+    app.cli.add_command(ratings_cli)
+    app.cli.add_command(categories_cli)
+    app.cli.add_command(views_cli)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(media_cli)
+    app.cli.add_command(blocklist_cli)
+    app.cli.add_command(security_models_cli)
+    app.cli.add_command(metrics_cli)
+    app.cli.add_command(profiler_cli)
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""Content-addressed storage for uploaded files.
+
+An upload is stored once per distinct content, at
+'<subfolder>/<h[0:2]>/<h[2:4]>/<sha256>.<ext>' under UPLOAD_FOLDER. Uploading
+bytes that are already stored writes nothing and only adds a reference in the
+storage ledger. Callers then release files with release_upload() instead of
+deleting them, and a file is removed once the transaction releasing its
+last reference commits.
+"""
+import hashlib
+import os
+import uuid
+from flask import current_app
+from app.storage_ledger import add_reference, release_file, check_quota
+
+CHUNK_SIZE = 1024 * 1024
+
+def content_path(digest, ext, subfolder=''):
+    """Relative path of the file with this SHA-256 hex digest"""
+    parts = [subfolder] if subfolder else []
+    parts += [digest[:2], digest[2:4], f'{digest}.{ext}']
+    return '/'.join(parts)
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else 'bin'
+
+def _hash_seekable(stream):
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+def _write_hashed(stream, path):
+    """Copy stream to path chunk by chunk, hashing as it goes"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as out:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def _incoming_path(root):
+    directory = os.path.join(root, '.incoming')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, uuid.uuid4().hex)
+
+def _add_reference(path, size):
+    """add_reference in a savepoint; returns False if a concurrent upload recorded the file first.
+
+    Two requests storing the same new bytes both find no StoredFile row and
+    both insert one. The loser's savepoint fails on the unique path and is
+    retried as an increment of the winner's row.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from app import db
+
+    try:
+        with db.session.begin_nested():
+            add_reference(path, size)
+        return True
+    except IntegrityError:
+        with db.session.begin_nested():
+            add_reference(path, size)
+        return False
+
+def store_upload(file, subfolder=''):
+    """Store a werkzeug FileStorage by content.
+
+    Returns (relative_path, size, created), where created is False when
+    identical bytes were already stored. Raises StorageQuotaExceeded when new
+    content would pass the quota. The caller commits the session.
+    """
+    root = current_app.config['UPLOAD_FOLDER']
+    ext = _extension(file.filename)
+    stream = file.stream
+
+    incoming = None
+    if stream.seekable():
+        # Werkzeug spools uploads to memory or a temp file, so hashing first
+        # lets duplicates skip the write entirely
+        digest, size = _hash_seekable(stream)
+    else:
+        incoming = _incoming_path(root)
+        digest, size = _write_hashed(stream, incoming)
+
+    relative_path = content_path(digest, ext, subfolder)
+    path = os.path.join(root, relative_path)
+    try:
+        referenced = False
+        if os.path.exists(path):
+            _add_reference(path, size)
+            # The row is locked now, so a released copy can no longer be deleted
+            # under us; if it went between the two checks, write it back
+            if os.path.exists(path):
+                return relative_path, size, False
+            referenced = True
+        else:
+            check_quota(size)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if incoming is None:
+            incoming = _incoming_path(root)
+            with open(incoming, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+        # Atomic, so a concurrent upload of the same bytes just replaces identical content
+        os.replace(incoming, path)
+        incoming = None
+        created = _add_reference(path, size) if not referenced else False
+        return relative_path, size, created
+    finally:
+        if incoming is not None and os.path.exists(incoming):
+            os.remove(incoming)
+
+def release_upload(relative_path):
+    """Drop one reference to a file under UPLOAD_FOLDER. Returns True if it was deleted."""
+    if not relative_path:
+        return False
+    if relative_path.startswith('/uploads/'):
+        relative_path = relative_path[len('/uploads/'):]
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], relative_path.lstrip('/'))
+    return release_file(path)
@@ -0,0 +1,249 @@
+"""Server-sent events push channel for the admin dashboard.
+
+Sources are registered with @event_stream.source(name, interval) and return a
+{key: value} mapping of their current state, e.g. the dashboard stats, open
+security alerts or download tasks. One producer across all workers, elected
+through a cache lock, polls the sources only while somebody is listening. It
+diffs each result against the previous one and publishes only the changed
+keys, or only the changed fields for dict values.
+
+Deltas are fanned out to every worker through Redis pub/sub when
+EVENT_STREAM_REDIS_URL is set, otherwise within the process. Each worker then
+hands them to its connected clients. A client queue holds at most one pending
+entry per (event, key), so a slow client receives merged updates instead of
+a growing backlog. If the queue still passes EVENT_STREAM_MAX_PENDING, the
+queue is dropped and the client gets a fresh snapshot instead.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'admin-events'
+STATE_KEY = 'event-stream:state'
+ACTIVE_KEY = 'event-stream:active'
+LEADER_KEY = 'lock:event-stream-producer'
+
+def _diff(previous, current):
+    """Yield (key, delta) for entries that changed; removed keys map to None"""
+    for key, value in current.items():
+        old = previous.get(key)
+        if old == value:
+            continue
+        if isinstance(old, dict) and isinstance(value, dict):
+            value = {field: v for field, v in value.items() if old.get(field) != v}
+        yield key, value
+    for key in previous.keys() - current.keys():
+        yield key, None
+
+def _format(event, data):
+    return f'event: {event}\ndata: ' + json.dumps(data, default=str) + '\n\n'
+
+class Subscriber:
+    """Coalescing event queue for one connected client"""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.resync = False
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+
+    def push(self, event, key, data):
+        with self._condition:
+            slot = (event, key)
+            queued = self._pending.get(slot)
+            if isinstance(queued, dict) and isinstance(data, dict):
+                # Later field deltas for the same key merge into the queued one
+                data = dict(queued, **data)
+            self._pending[slot] = data
+            self._pending.move_to_end(slot)
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+                self.resync = True
+            self._condition.notify()
+
+    def drain(self, timeout):
+        """Wait up to timeout seconds and return (resync, [(event, key, data), ...])"""
+        with self._condition:
+            if not self._pending and not self.resync:
+                self._condition.wait(timeout)
+            pending, self._pending = self._pending, OrderedDict()
+            resync, self.resync = self.resync, False
+        return resync, [(event, key, data) for (event, key), data in pending.items()]
+
+class EventStream:
+    """Flask extension owning the producer, the fan-out and the client queues"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._sources = OrderedDict()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last = {}
+        self._due = {}
+        self._leader = False
+        self._token = uuid.uuid4().hex
+        self._redis = None
+        self._threads = []
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENT_STREAM_REDIS_URL', os.environ.get('REDIS_URL'))
+        app.config.setdefault('EVENT_STREAM_HEARTBEAT', 15)
+        app.config.setdefault('EVENT_STREAM_MAX_PENDING', 200)
+        app.config.setdefault('EVENT_STREAM_MAX_AGE', 300)
+        app.config.setdefault('EVENT_STREAM_TICK', 1.0)
+        self.app = app
+        app.extensions['event_stream'] = self
+
+        @app.before_request
+        def start_event_stream():
+            self._ensure_running()
+
+    def source(self, name, interval=5):
+        """Register f() -> {key: value} as the state behind event `name`"""
+        def decorator(f):
+            self._sources[name] = (f, interval)
+            return f
+        return decorator
+
+    # Client side
+    def subscribe(self):
+        subscriber = Subscriber(self.app.config['EVENT_STREAM_MAX_PENDING'])
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def state(self):
+        """Latest full state of every source, as last stored by the producer"""
+        from app import cache
+        return cache.get(STATE_KEY) or {}
+
+    def stream(self):
+        """Generator of SSE frames for one client; runs outside the request context"""
+        heartbeat = self.app.config['EVENT_STREAM_HEARTBEAT']
+        closes_at = time.monotonic() + self.app.config['EVENT_STREAM_MAX_AGE']
+        subscriber = self.subscribe()
+        try:
+            with self.app.app_context():
+                state = self.state()
+            yield 'retry: 3000\n' + _format('snapshot', state)
+            while time.monotonic() < closes_at:
+                resync, events = subscriber.drain(heartbeat)
+                if resync:
+                    with self.app.app_context():
+                        state = self.state()
+                    yield _format('snapshot', state)
+                elif not events:
+                    # Comment frame keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                for event, key, data in events:
+                    yield _format(event, {'key': key, 'data': data})
+        finally:
+            self.unsubscribe(subscriber)
+
+    # Fan-out
+    def publish(self, event, key, data):
+        if self._redis is not None:
+            self._redis.publish(CHANNEL, json.dumps([event, key, data], default=str))
+        else:
+            self._dispatch(event, key, data)
+
+    def _dispatch(self, event, key, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.push(event, key, data)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    event, key, data = json.loads(message['data'])
+                    self._dispatch(event, key, data)
+            except Exception as e:
+                logger.error(f"Event stream subscription lost: {str(e)}")
+                time.sleep(1)
+
+    # Producer
+    def _mark_active(self):
+        from app import cache
+        if self._subscribers:
+            cache.set(ACTIVE_KEY, 1, timeout=self.app.config['EVENT_STREAM_HEARTBEAT'] * 3)
+
+    def _elect(self):
+        from app import cache
+        timeout = max(int(self.app.config['EVENT_STREAM_TICK'] * 10), 5)
+        if cache.get(LEADER_KEY) == self._token:
+            cache.set(LEADER_KEY, self._token, timeout=timeout)
+            leader = True
+        else:
+            leader = bool(cache.add(LEADER_KEY, self._token, timeout=timeout))
+        if leader and not self._leader:
+            # Continue from the previous producer's state instead of re-sending everything
+            self._last = dict(self.state())
+            self._due = {}
+        self._leader = leader
+        return leader
+
+    def _produce(self):
+        from app import cache
+        now = time.monotonic()
+        state = dict(self._last)
+        for name, (f, interval) in self._sources.items():
+            if self._due.get(name, 0) > now:
+                continue
+            self._due[name] = now + interval
+            try:
+                current = {str(key): value for key, value in (f() or {}).items()}
+            except Exception as e:
+                logger.error(f"Error polling event source {name}: {str(e)}")
+                continue
+            for key, delta in _diff(state.get(name, {}), current):
+                self.publish(name, key, delta)
+            state[name] = current
+        if state != self._last:
+            cache.set(STATE_KEY, state, timeout=0)
+            self._last = state
+
+    def _run(self):
+        from app import cache, db
+        while True:
+            time.sleep(self.app.config['EVENT_STREAM_TICK'])
+            with self.app.app_context():
+                try:
+                    self._mark_active()
+                    if self._elect() and cache.get(ACTIVE_KEY):
+                        self._produce()
+                except Exception as e:
+                    logger.error(f"Error producing admin events: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _ensure_running(self):
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex
+        self._leader = False
+        self._redis = None
+        self._threads = [threading.Thread(target=self._run, name='event-stream-producer', daemon=True)]
+        if self.app.config['EVENT_STREAM_REDIS_URL']:
+            import redis
+            self._redis = redis.Redis.from_url(self.app.config['EVENT_STREAM_REDIS_URL'])
+            self._threads.append(threading.Thread(target=self._listen, name='event-stream-listener', daemon=True))
+        for thread in self._threads:
+            thread.start()
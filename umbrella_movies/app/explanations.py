@@ -0,0 +1,159 @@
+"""Deferred, memoized explanations for suspicious admin activity.
+
+Explaining a prediction is the slowest step of the security pipeline, so it
+never runs where the event is logged. The event's SecurityAudit row is
+written first with 'explanation': None, and submit() queues the row for a
+worker thread. The worker calls the registered @explainer and stores the
+result in the row's details.
+
+Results are memoized in the shared cache by a hash of the feature vector,
+quantized to EXPLANATION_QUANTUM, so a pattern that repeats reuses its
+earlier explanation without running the explainer. Rows waiting on the same
+key in one worker share one computation.
+
+A failed computation is retried up to EXPLANATION_MAX_ATTEMPTS times,
+EXPLANATION_RETRY_DELAY seconds apart and longer with each attempt. After
+the last attempt, the waiting rows get an 'explanation_error' instead.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+def explanation_key(vector, quantum):
+    """Cache key of a feature vector after rounding each value to a multiple of quantum"""
+    quantized = [round(float(value) / quantum) for value in vector]
+    return 'explanation:' + hashlib.sha1(json.dumps(quantized).encode()).hexdigest()
+
+class ExplanationService:
+    """Flask extension computing prediction explanations in a background thread"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._explainer = None
+        self._queue = None
+        self._waiting = {}
+        self._waiting_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stats = {'cached': 0, 'computed': 0, 'shared': 0, 'errors': 0, 'retried': 0, 'failed': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EXPLANATION_QUANTUM', 0.05)
+        app.config.setdefault('EXPLANATION_CACHE_TIMEOUT', 7 * 24 * 3600)
+        app.config.setdefault('EXPLANATION_MAX_ATTEMPTS', 3)
+        app.config.setdefault('EXPLANATION_RETRY_DELAY', 5)
+        self.app = app
+        app.extensions['explanations'] = self
+
+    def explainer(self, f):
+        """Register f(features, score) returning a JSON-serializable explanation"""
+        self._explainer = f
+        return f
+
+    def submit(self, audit_id, vector, features, score):
+        """Attach an explanation to a SecurityAudit row, now if memoized, else in the background"""
+        from app import cache
+
+        key = explanation_key(vector, self.app.config['EXPLANATION_QUANTUM'])
+        explanation = cache.get(key)
+        if explanation is not None:
+            self.stats['cached'] += 1
+            self._store([audit_id], explanation=explanation, explanation_cached=True)
+            return
+
+        with self._waiting_lock:
+            if key in self._waiting:
+                # Same pattern already queued; it will fill this row too
+                self._waiting[key].append(audit_id)
+                self.stats['shared'] += 1
+                return
+            self._waiting[key] = [audit_id]
+        self._ensure_worker()
+        self._queue.put((key, features, score, 1))
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._waiting_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='explanations', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        from app import db
+
+        while True:
+            key, features, score, attempt = self._queue.get()
+            with self.app.app_context():
+                try:
+                    self._explain(key, features, score)
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['errors'] += 1
+                    logger.error(f"Error explaining {key} (attempt {attempt}): {str(e)}")
+                    self._retry_or_fail(key, features, score, attempt, e)
+                finally:
+                    db.session.remove()
+
+    def _explain(self, key, features, score):
+        from app import cache
+
+        explanation = cache.get(key)
+        cached = explanation is not None
+        if not cached:
+            # Round-trip through JSON so what is cached is exactly what the row stores
+            explanation = json.loads(json.dumps(self._explainer(features, score), default=str))
+            cache.set(key, explanation, timeout=self.app.config['EXPLANATION_CACHE_TIMEOUT'])
+            self.stats['computed'] += 1
+        with self._waiting_lock:
+            audit_ids = self._waiting.pop(key, [])
+        try:
+            self._store(audit_ids, explanation=explanation, explanation_cached=cached)
+        except Exception:
+            # Put the rows back so the retry (or the error marker) reaches them
+            with self._waiting_lock:
+                self._waiting.setdefault(key, []).extend(audit_ids)
+            raise
+
+    def _retry_or_fail(self, key, features, score, attempt, error):
+        from app import db
+
+        if attempt < self.app.config['EXPLANATION_MAX_ATTEMPTS']:
+            self.stats['retried'] += 1
+            # Rows submitted for this key meanwhile keep joining the waiting list
+            timer = threading.Timer(self.app.config['EXPLANATION_RETRY_DELAY'] * attempt,
+                                    self._queue.put, args=((key, features, score, attempt + 1),))
+            timer.daemon = True
+            timer.start()
+            return
+
+        with self._waiting_lock:
+            audit_ids = self._waiting.pop(key, [])
+        self.stats['failed'] += len(audit_ids)
+        try:
+            self._store(audit_ids, explanation=None, explanation_error=str(error))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error marking explanation failure for {key}: {str(e)}")
+
+    def _store(self, audit_ids, **fields):
+        from app import db
+        from app.models import SecurityAudit
+
+        for audit in SecurityAudit.query.filter(SecurityAudit.id.in_(audit_ids)):
+            # Reassign rather than mutate so the JSON column is marked dirty
+            audit.details = dict(audit.details or {}, **fields)
+        db.session.commit()
+
+    def status(self):
+        return {'pending': self._queue.qsize() if self._queue is not None else 0, **self.stats}
@@ -0,0 +1,213 @@
+"""Background health probes with latency history.
+
+Probes are registered with @health_probes.probe(name, interval) and return
+a dict of details, raising on failure. One worker holds the
+'lock:health-probes' cache lock and runs each due probe on a background
+thread. Each run is timed, and its (time, latency_ms, ok) sample goes into a
+fixed-size ring buffer per probe. After every tick the leader publishes the
+latest result of each probe and its p50/p95/p99 latency to the cache. Readers
+such as the security overview call status() and never run a probe
+themselves. status() flags a probe as stale once its latest result is older
+than twice its interval, for example when the leader has died and no
+worker has taken over yet.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'health-probes:state'
+LEADER_KEY = 'lock:health-probes'
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 2)
+
+def summarize(samples):
+    """Latency percentiles and availability of (timestamp, latency_ms, ok) samples"""
+    latencies = sorted(latency for _, latency, ok in samples if ok)
+    return {
+        'samples': len(samples),
+        'availability': round(sum(1 for _, _, ok in samples if ok) / len(samples) * 100, 2) if samples else None,
+        'p50': _percentile(latencies, 0.50),
+        'p95': _percentile(latencies, 0.95),
+        'p99': _percentile(latencies, 0.99)
+    }
+
+class HealthProbes:
+    """Flask extension scheduling health probes on a leader worker"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._probes = OrderedDict()
+        self._history = {}
+        self._latest = {}
+        self._due = {}
+        self._leader = False
+        self._token = uuid.uuid4().hex
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('HEALTH_PROBE_TICK', 1.0)
+        app.config.setdefault('HEALTH_PROBE_HISTORY', 360)
+        app.config.setdefault('HEALTH_PROBE_ENDPOINT', '/')
+        self.app = app
+        app.extensions['health_probes'] = self
+        self._register_builtin_probes()
+
+        @app.before_request
+        def start_health_probes():
+            self._ensure_running()
+
+    def probe(self, name, interval=15):
+        """Register f() -> details dict as a probe run every `interval` seconds"""
+        def decorator(f):
+            self._probes[name] = (f, interval)
+            return f
+        return decorator
+
+    def run_probe(self, name):
+        """Run one probe now and return its timed result"""
+        f, _ = self._probes[name]
+        started = time.perf_counter()
+        try:
+            details = f() or {}
+            ok, error = True, None
+        except Exception as e:
+            details, ok, error = {}, False, str(e)
+        latency = (time.perf_counter() - started) * 1000
+        result = {'ok': ok, 'latency_ms': round(latency, 2), 'checked_at': time.time(), **details}
+        if error:
+            result['error'] = error
+        return result
+
+    def status(self):
+        """Latest result and latency percentiles of every probe, as last published"""
+        from app import cache
+        state = cache.get(STATE_KEY) or {}
+        now = time.time()
+        for name, entry in state.items():
+            latest = entry.get('latest')
+            if name in self._probes and latest:
+                entry['stale'] = now - latest['checked_at'] > 2 * self._probes[name][1]
+        return state
+
+    def _elect(self):
+        from app import cache
+        timeout = max(int(self.app.config['HEALTH_PROBE_TICK'] * 10), 5)
+        if cache.get(LEADER_KEY) == self._token:
+            cache.set(LEADER_KEY, self._token, timeout=timeout)
+            leader = True
+        else:
+            leader = bool(cache.add(LEADER_KEY, self._token, timeout=timeout))
+        if leader and not self._leader:
+            # Keep the previous leader's history instead of starting empty
+            size = self.app.config['HEALTH_PROBE_HISTORY']
+            state = self.status()
+            self._history = {name: deque((tuple(sample) for sample in entry.get('history', [])), maxlen=size)
+                             for name, entry in state.items()}
+            self._latest = {name: entry.get('latest') for name, entry in state.items()}
+            self._due = {}
+        self._leader = leader
+        return leader
+
+    def _tick(self):
+        from app import cache
+        now = time.monotonic()
+        ran = False
+        for name, (_, interval) in self._probes.items():
+            if self._due.get(name, 0) > now:
+                continue
+            self._due[name] = now + interval
+            result = self.run_probe(name)
+            history = self._history.setdefault(name, deque(maxlen=self.app.config['HEALTH_PROBE_HISTORY']))
+            history.append((result['checked_at'], result['latency_ms'], result['ok']))
+            self._latest[name] = result
+            ran = True
+        if ran:
+            cache.set(STATE_KEY, {
+                name: {
+                    'latest': self._latest.get(name),
+                    'latency': summarize(history),
+                    'history': list(history)
+                } for name, history in self._history.items() if name in self._probes
+            }, timeout=0)
+
+    def _run(self):
+        from app import db
+        while True:
+            time.sleep(self.app.config['HEALTH_PROBE_TICK'])
+            with self.app.app_context():
+                try:
+                    if self._elect():
+                        self._tick()
+                except Exception as e:
+                    logger.error(f"Error running health probes: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _ensure_running(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex
+        self._leader = False
+        self._thread = threading.Thread(target=self._run, name='health-probes', daemon=True)
+        self._thread.start()
+
+    def _register_builtin_probes(self):
+        app = self.app
+
+        @self.probe('database', interval=10)
+        def probe_database():
+            from sqlalchemy import text
+            from app import db
+            db.session.execute(text('SELECT 1'))
+            return {}
+
+        @self.probe('cache', interval=10)
+        def probe_cache():
+            from app import cache
+            backend = getattr(cache.cache, 'remote', cache.cache)
+            client = getattr(backend, '_write_client', None)
+            if client is not None:
+                client.ping()
+                return {'backend': 'redis'}
+            # No Redis behind the cache: time a write/read round trip instead
+            token = uuid.uuid4().hex
+            cache.set('health-probes:cache-check', token, timeout=60)
+            if cache.get('health-probes:cache-check') != token:
+                raise RuntimeError('Cache read did not return the value just written')
+            return {'backend': type(backend).__name__}
+
+        @self.probe('storage', interval=60)
+        def probe_storage():
+            roots = {'uploads': app.config.get('UPLOAD_FOLDER'), 'movies': app.config.get('MOVIES_DIRECTORY')}
+            volumes = {}
+            for name, root in roots.items():
+                if not root or not os.path.isdir(root):
+                    continue
+                total, used, free = shutil.disk_usage(root)
+                volumes[name] = {'total': total, 'used': used, 'free': free,
+                                 'usage': round(used / total * 100, 1)}
+            return {'volumes': volumes, 'usage': max((v['usage'] for v in volumes.values()), default=0)}
+
+        @self.probe('api', interval=30)
+        def probe_api():
+            # Synthetic request through the whole WSGI stack of this worker
+            with app.test_client() as client:
+                response = client.get(app.config['HEALTH_PROBE_ENDPOINT'],
+                                      headers={'User-Agent': 'umbrella-health-probe'})
+            if response.status_code >= 500:
+                raise RuntimeError(f'{app.config["HEALTH_PROBE_ENDPOINT"]} returned {response.status_code}')
+            return {'status_code': response.status_code}
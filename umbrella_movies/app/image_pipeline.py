@@ -0,0 +1,230 @@
+"""Pre-generated size variants for uploaded posters and thumbnails.
+
+Every uploaded image is resized once to each IMAGE_VARIANT_WIDTHS width and
+encoded twice at that width: in its fallback format (JPEG, or PNG when the
+image has transparency) and as WebP. A 16px-wide blurred JPEG is also
+produced and kept inline as a data URI placeholder. Variants sit next to the
+source as '<stem>.w<width>.<ext>'. Encoding runs in a process pool so
+Pillow's CPU work never blocks a request thread. The result is recorded in the
+target row's image_variants column, and get_file_url()/variant_url() use it to
+pick the smallest adequate file.
+"""
+import base64
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640)
+# Columns holding the image a target's variants were generated from
+SOURCE_COLUMNS = ('poster_url', 'thumbnail_url')
+PLACEHOLDER_WIDTH = 16
+
+def variant_path(source_path, width, ext):
+    stem = os.path.splitext(source_path)[0]
+    return f'{stem}.w{width}.{ext}'
+
+def _encode(image, format, **options):
+    buffer = io.BytesIO()
+    started = time.perf_counter()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue(), (time.perf_counter() - started) * 1000
+
+def generate_variants(source_path, widths=DEFAULT_WIDTHS, quality=82, reuse_existing=True):
+    """Write every variant of source_path and describe them.
+
+    Runs in a pool process, so it only takes and returns plain data. Paths in
+    the result are absolute; callers make them relative to their root.
+    Sources are content-addressed, so with reuse_existing a variant already on
+    disk is kept rather than re-encoded (its encode_ms is None).
+    """
+    from PIL import Image, ImageFilter, ImageOps
+
+    with Image.open(source_path) as original:
+        original.seek(0)  # first frame of animated GIFs
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    fallback_format, fallback_ext = ('PNG', 'png') if has_alpha else ('JPEG', 'jpg')
+    result = {'width': image.width, 'height': image.height, 'variants': []}
+
+    # Never upscale: widths at or above the source collapse into one full-size variant
+    targets = sorted({min(width, image.width) for width in widths})
+    for width in targets:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS) if width != image.width else image
+        encodings = [
+            (fallback_format, fallback_ext, {'optimize': True} if has_alpha else
+             {'quality': quality, 'optimize': True, 'progressive': True}),
+            ('WEBP', 'webp', {'quality': quality, 'method': 4}),
+        ]
+        for format, ext, options in encodings:
+            path = variant_path(source_path, width, ext)
+            if reuse_existing and os.path.exists(path):
+                size, encode_ms = os.path.getsize(path), None
+            else:
+                data, encode_ms = _encode(resized, format, **options)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                size, encode_ms = len(data), round(encode_ms, 2)
+            result['variants'].append({
+                'width': width,
+                'height': height,
+                'format': ext,
+                'path': path,
+                'size': size,
+                'encode_ms': encode_ms
+            })
+
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.convert('RGB').resize((PLACEHOLDER_WIDTH, height), Image.BILINEAR)
+    data, _ = _encode(tiny.filter(ImageFilter.GaussianBlur(1)), 'JPEG', quality=40)
+    result['placeholder'] = 'data:image/jpeg;base64,' + base64.b64encode(data).decode()
+    return result
+
+def pick_variant(image_variants, width=None, format=None):
+    """Smallest recorded variant at least `width` wide, else the largest one"""
+    if not image_variants or not image_variants.get('variants'):
+        return None
+    candidates = [v for v in image_variants['variants'] if format is None or v['format'] == format]
+    if not candidates:
+        candidates = [v for v in image_variants['variants'] if v['format'] != 'webp']
+    candidates.sort(key=lambda v: v['width'])
+    if width is None:
+        return candidates[-1]
+    for variant in candidates:
+        if variant['width'] >= width:
+            return variant
+    return candidates[-1]
+
+def _upload_url(relative_path):
+    return '/uploads/' + relative_path.lstrip('/')
+
+def variant_url(image_variants, width=None, format=None, fallback=None):
+    """Template helper: URL of the best variant, or fallback when none are recorded yet"""
+    variant = pick_variant(image_variants, width, format)
+    return _upload_url(variant['path']) if variant else fallback
+
+def variant_srcset(image_variants, format=None):
+    """Template helper: srcset attribute value listing every variant of one format"""
+    if not image_variants:
+        return ''
+    format = format or next((v['format'] for v in image_variants.get('variants', []) if v['format'] != 'webp'), None)
+    return ', '.join(f"{_upload_url(v['path'])} {v['width']}w"
+                     for v in image_variants.get('variants', []) if v['format'] == format)
+
+def delete_variants(image_variants):
+    """Release recorded variant files; shared ones stay until unreferenced. The caller commits."""
+    from app.content_store import release_upload
+
+    for variant in (image_variants or {}).get('variants', []):
+        release_upload(variant['path'])
+
+def _relative(path_or_url):
+    if path_or_url.startswith('/uploads/'):
+        path_or_url = path_or_url[len('/uploads/'):]
+    return path_or_url.lstrip('/').replace(os.sep, '/')
+
+def uses_source(target, relative_path):
+    """Whether target still shows the image at relative_path"""
+    source = _relative(relative_path)
+    return any(getattr(target, column, None) and _relative(getattr(target, column)) == source
+               for column in SOURCE_COLUMNS)
+
+class ImagePipeline:
+    """Flask extension running generate_variants in a process pool"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS)
+        app.config.setdefault('IMAGE_VARIANT_QUALITY', 82)
+        app.config.setdefault('IMAGE_PIPELINE_WORKERS', 2)
+        self.app = app
+        app.extensions['image_pipeline'] = self
+        app.add_template_global(variant_url)
+        app.add_template_global(variant_srcset)
+
+    def _pool(self):
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            # spawn: the parent runs background threads, which fork would copy mid-state
+            self._executor = ProcessPoolExecutor(max_workers=self.app.config['IMAGE_PIPELINE_WORKERS'],
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, relative_path, target):
+        """Generate variants for a file under UPLOAD_FOLDER in the background.
+
+        The result is stored on target, a committed model instance with an
+        image_variants column, once encoding finishes. Targets without that
+        column get no variants, since nothing could release them later.
+        """
+        if not hasattr(target, 'image_variants'):
+            return None
+        source = os.path.join(self.app.config['UPLOAD_FOLDER'], relative_path)
+        args = (source, tuple(self.app.config['IMAGE_VARIANT_WIDTHS']), self.app.config['IMAGE_VARIANT_QUALITY'])
+        target_ref = (type(target), target.id)
+
+        if not self.app.config['IMAGE_PIPELINE_WORKERS']:
+            self.record(relative_path, target_ref, generate_variants(*args))
+            return None
+
+        future = self._pool().submit(generate_variants, *args)
+        future.add_done_callback(lambda done: self._finish(relative_path, target_ref, done))
+        return future
+
+    def _finish(self, relative_path, target_ref, future):
+        from app import db
+
+        with self.app.app_context():
+            try:
+                self.record(relative_path, target_ref, future.result())
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error generating image variants for {relative_path}: {str(e)}")
+            finally:
+                db.session.remove()
+
+    def record(self, relative_path, target_ref, result):
+        """Account for the variant files and store their description on the target.
+
+        Variants the target no longer needs (its image changed while they were
+        encoded) are discarded. Variants the target already had are released
+        after the new ones are referenced, so files both share survive.
+        """
+        from app import db
+        from app.storage_ledger import add_reference, remove_unreferenced
+
+        root = self.app.config['UPLOAD_FOLDER']
+        model, id = target_ref
+        # Locked so an edit of the image cannot interleave with the check below
+        target = model.query.execution_options(include_hidden=True).filter_by(id=id)\
+            .with_for_update().populate_existing().first()
+        if target is None or not hasattr(target, 'image_variants') or not uses_source(target, relative_path):
+            # The owner is gone or shows another image now, so nothing would ever
+            # release these; keep only files something else references
+            db.session.rollback()
+            remove_unreferenced([variant['path'] for variant in result['variants']])
+            return None
+
+        previous = target.image_variants
+        for variant in result['variants']:
+            # One reference per recorded owner, mirroring the shared source file
+            add_reference(variant['path'], variant['size'])
+            variant['path'] = os.path.relpath(variant['path'], root).replace(os.sep, '/')
+        result['source'] = relative_path.replace(os.sep, '/')
+        target.image_variants = result
+        delete_variants(previous)
+        db.session.commit()
+        return result
@@ -0,0 +1,201 @@
+"""Per-worker compiled copy of the BlacklistedIP table.
+
+Active, unexpired entries are parsed into IPv4 and IPv6 networks, merged
+into disjoint [first, last] integer intervals and kept as two sorted arrays
+per address family. Checking an address is then one bisect, with no query.
+At most every IP_BLOCKLIST_POLL seconds each worker reads a version of the
+table and recompiles when it has moved. The version is the 'ip-blocklist'
+cache tag generation, which every write to BlacklistedIP bumps, together
+with an aggregate fingerprint of the table read from the database. The
+fingerprint is what other workers see when the cache is per-process. Edits
+that leave the fingerprint unchanged are picked up by a forced recompile
+every IP_BLOCKLIST_MAX_AGE seconds. Expiry needs no bump, because the
+compiled copy remembers its earliest expires_at and recompiles once it
+passes.
+"""
+import bisect
+import ipaddress
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime
+from flask import abort, request
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 1000
+
+def parse_network(value):
+    """Normalize an address or CIDR range; raises ValueError when invalid"""
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return network.with_prefixlen
+
+def _merge(intervals):
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+class CompiledBlocklist:
+    """Immutable interval arrays for one generation of the blocklist"""
+
+    def __init__(self, networks, expires_at=None):
+        intervals = {4: [], 6: []}
+        for network in networks:
+            intervals[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self.size = len(networks)
+        self.expires_at = expires_at
+        # IPv4 bounds fit in unsigned 32-bit arrays; IPv6 needs Python ints
+        v4 = _merge(intervals[4])
+        v6 = _merge(intervals[6])
+        self._first = {4: array('I', (first for first, _ in v4)), 6: [first for first, _ in v6]}
+        self._last = {4: array('I', (last for _, last in v4)), 6: [last for _, last in v6]}
+
+    def __contains__(self, address):
+        first, last = self._first[address.version], self._last[address.version]
+        i = bisect.bisect_right(first, int(address)) - 1
+        return i >= 0 and int(address) <= last[i]
+
+class IPBlocklist:
+    """Flask extension rejecting requests from blocklisted addresses"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._compiled = None
+        self._generation = None
+        self._checked_at = 0.0
+        self._compiled_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IP_BLOCKLIST_ENABLED', True)
+        app.config.setdefault('IP_BLOCKLIST_POLL', 1.0)
+        app.config.setdefault('IP_BLOCKLIST_MAX_AGE', 60)
+        self.app = app
+        app.extensions['ip_blocklist'] = self
+        app.before_request(self._check_request)
+
+    def compile(self):
+        """Build a CompiledBlocklist from the database"""
+        from app.models import BlacklistedIP
+
+        now = datetime.utcnow()
+        rows = BlacklistedIP.query.with_entities(BlacklistedIP.ip_address, BlacklistedIP.expires_at).filter(
+            BlacklistedIP.is_active.is_(True),
+            (BlacklistedIP.expires_at.is_(None)) | (BlacklistedIP.expires_at > now)
+        )
+        networks = []
+        expiries = []
+        for ip_address, expires_at in rows:
+            try:
+                networks.append(ipaddress.ip_network(ip_address, strict=False))
+            except ValueError:
+                logger.warning(f"Skipping invalid blocklist entry {ip_address!r}")
+                continue
+            if expires_at is not None:
+                expiries.append(expires_at)
+        return CompiledBlocklist(networks, min(expiries) if expiries else None)
+
+    def version(self):
+        """Cache tag generation plus a database fingerprint of BlacklistedIP"""
+        from sqlalchemy import case, func
+        from app import db
+        from app.cache_tags import tag_generation
+        from app.models import BlacklistedIP
+
+        fingerprint = db.session.query(
+            func.count(BlacklistedIP.id),
+            func.max(BlacklistedIP.id),
+            func.sum(case((BlacklistedIP.is_active.is_(True), BlacklistedIP.id), else_=0)),
+            func.max(BlacklistedIP.expires_at)
+        ).one()
+        return (tag_generation('ip-blocklist'),) + tuple(fingerprint)
+
+    def current(self):
+        """The compiled blocklist, recompiled if the table or an expiry has moved on"""
+        compiled = self._compiled
+        now = time.monotonic()
+        if compiled is not None and now - self._checked_at < self.app.config['IP_BLOCKLIST_POLL']:
+            if compiled.expires_at is None or compiled.expires_at > datetime.utcnow():
+                return compiled
+
+        with self._lock:
+            self._checked_at = now
+            compiled = self._compiled
+            try:
+                generation = self.version()
+                expired = compiled is not None and compiled.expires_at is not None \
+                    and compiled.expires_at <= datetime.utcnow()
+                stale = now - self._compiled_at >= self.app.config['IP_BLOCKLIST_MAX_AGE']
+                if compiled is None or expired or stale or generation != self._generation:
+                    compiled = self.compile()
+                    self._compiled, self._generation, self._compiled_at = compiled, generation, now
+            except Exception as e:
+                # Fail open: a cache or database outage must not turn every request
+                # into a 500. Keep serving the last good copy; the next poll retries
+                logger.error(f"Error refreshing IP blocklist: {str(e)}")
+                return compiled or CompiledBlocklist([])
+            return compiled
+
+    def is_blocked(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        # IPv4-mapped IPv6 peers ('::ffff:203.0.113.7') match IPv4 entries
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        return address in self.current()
+
+    def _check_request(self):
+        if not self.app.config['IP_BLOCKLIST_ENABLED'] or not request.remote_addr:
+            return
+        if self.is_blocked(request.remote_addr):
+            abort(403)
+
+def import_networks(lines, reason=None, added_by=None, expires_at=None):
+    """Bulk-insert addresses/CIDR ranges, one per line ('#' starts a comment).
+
+    Entries already present are skipped. Returns (added, skipped, invalid
+    lines). Inserts bypass mapper events, so the blocklist tag is bumped once
+    at the end.
+    """
+    from app import db
+    from app.cache_tags import invalidate_tags
+    from app.models import BlacklistedIP
+
+    networks = []
+    invalid = []
+    for line in lines:
+        value = line.split('#', 1)[0].strip()
+        if not value:
+            continue
+        try:
+            networks.append(parse_network(value))
+        except ValueError:
+            invalid.append(value)
+
+    existing = {ip for (ip,) in db.session.query(BlacklistedIP.ip_address)}
+    new = list(dict.fromkeys(network for network in networks if network not in existing))
+    created_at = datetime.utcnow()
+    for start in range(0, len(new), IMPORT_BATCH_SIZE):
+        db.session.execute(db.insert(BlacklistedIP), [{
+            'ip_address': network,
+            'reason': reason,
+            'added_by': added_by,
+            'is_active': True,
+            'created_at': created_at,
+            'expires_at': expires_at
+        } for network in new[start:start + IMPORT_BATCH_SIZE]])
+    db.session.commit()
+    if new:
+        invalidate_tags('ip-blocklist')
+    return len(new), len(networks) - len(new), invalid
@@ -0,0 +1,191 @@
+"""Background execution of long-running admin operations.
+
+Handlers are registered with @jobs.handler('kind') and called as
+handler(job, **params). submit() records a BackgroundJob row and runs the
+handler on a small per-worker thread pool, so the request only returns the
+job id. Handlers work in bounded chunks and advance job.processed in the
+same commit as each chunk. The row therefore always shows how far the job
+really got, and a job interrupted by a worker restart can be resumed with
+'flask jobs resume'.
+
+While a process holds a job, queued or running, a heartbeat thread touches
+the job's heartbeat_at every JOB_HEARTBEAT_INTERVAL seconds. run() claims a
+job with one conditional UPDATE that succeeds only if the job is queued or
+failed, or is running with a heartbeat older than JOB_STALE_AFTER. The same
+job therefore never runs in two places at once.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+class JobRunner:
+    """Flask extension that runs registered job handlers in the background"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._handlers = {}
+        self._executor = None
+        self._pid = None
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat = None
+        self._heartbeat_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_HEARTBEAT_INTERVAL', 15)
+        app.config.setdefault('JOB_STALE_AFTER', 120)
+        self.app = app
+        app.extensions['jobs'] = self
+
+    def handler(self, kind):
+        """Register f(job, **params) as the handler for jobs of this kind"""
+        def decorator(f):
+            self._handlers[kind] = f
+            return f
+        return decorator
+
+    def submit(self, kind, created_by=None, **params):
+        """Record a new job and start it; returns the BackgroundJob"""
+        from app import db
+        from app.models import BackgroundJob
+
+        if kind not in self._handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+        job = BackgroundJob(id=uuid.uuid4().hex, kind=kind, params=params, created_by=created_by,
+                            heartbeat_at=datetime.utcnow())
+        db.session.add(job)
+        db.session.commit()
+        self._start(job.id)
+        return job
+
+    def resume(self, job):
+        """Start a failed or interrupted job again from its last committed chunk"""
+        from app import db
+
+        job.status = 'queued'
+        job.error = None
+        job.finished_at = None
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+        self._start(job.id)
+
+    def is_stale(self, job):
+        """True if no live process has touched a queued or running job recently"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['JOB_STALE_AFTER'])
+        return job.heartbeat_at is None or job.heartbeat_at < cutoff
+
+    def claim(self, job_id, force=False):
+        """Mark a job running for this process unless a live one holds it; returns True on success"""
+        from app import db
+        from app.models import BackgroundJob
+
+        table = BackgroundJob.__table__
+        now = datetime.utcnow()
+        condition = table.c.id == job_id
+        if not force:
+            cutoff = now - timedelta(seconds=self.app.config['JOB_STALE_AFTER'])
+            condition = db.and_(condition, db.or_(
+                table.c.status.in_(['queued', 'failed']),
+                db.and_(table.c.status == 'running',
+                        db.or_(table.c.heartbeat_at.is_(None), table.c.heartbeat_at < cutoff))
+            ))
+        result = db.session.execute(table.update().where(condition).values(
+            status='running', heartbeat_at=now, started_at=db.func.coalesce(table.c.started_at, now)
+        ))
+        db.session.commit()
+        return result.rowcount == 1
+
+    def run(self, job_id, force=False):
+        """Execute a job in the calling thread; returns False if another process holds it"""
+        self._hold(job_id)
+        try:
+            if not self.claim(job_id, force):
+                logger.info(f"Job {job_id} is held by another process or already finished")
+                return False
+            self._execute(job_id)
+            return True
+        finally:
+            self._release(job_id)
+
+    def _execute(self, job_id):
+        from app import db
+        from app.models import BackgroundJob
+
+        job = BackgroundJob.query.get(job_id)
+        try:
+            self._handlers[job.kind](job, **(job.params or {}))
+            job.status = 'completed'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Job {job_id} ({job.kind}) failed: {str(e)}")
+            job = BackgroundJob.query.get(job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    def _start(self, job_id):
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOB_WORKERS'],
+                                                thread_name_prefix='background-job')
+        # Keep the job's heartbeat fresh while it waits in the pool
+        self._hold(job_id)
+        future = self._executor.submit(self._run_in_context, job_id)
+        future.add_done_callback(lambda _: self._release(job_id))
+
+    # Heartbeats
+    def _hold(self, job_id):
+        with self._held_lock:
+            self._held.add(job_id)
+            if self._heartbeat is None or self._heartbeat_pid != os.getpid() or not self._heartbeat.is_alive():
+                self._heartbeat_pid = os.getpid()
+                self._heartbeat = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _release(self, job_id):
+        with self._held_lock:
+            self._held.discard(job_id)
+
+    def _beat(self):
+        from app import db
+        from app.models import BackgroundJob
+
+        table = BackgroundJob.__table__
+        while True:
+            time.sleep(self.app.config['JOB_HEARTBEAT_INTERVAL'])
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            with self.app.app_context():
+                try:
+                    db.session.execute(table.update().where(
+                        table.c.id.in_(held), table.c.status.in_(['queued', 'running'])
+                    ).values(heartbeat_at=datetime.utcnow()))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error updating job heartbeats: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _run_in_context(self, job_id):
+        from app import db
+
+        with self.app.app_context():
+            try:
+                self.run(job_id)
+            finally:
+                db.session.remove()
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('media', __name__)
+
+from app.media import routes
\ No newline at end of file
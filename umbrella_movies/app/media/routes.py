@@ -0,0 +1,14 @@
+from flask_login import login_required
+from app.media import bp
+from app.media_server import send_media
+
+@bp.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """Posters, thumbnails and their variants"""
+    return send_media('uploads', filename)
+
+@bp.route('/media/movies/<path:filename>')
+@login_required
+def movie_file(filename):
+    """Downloaded movie files, with Range support for seeking"""
+    return send_media('movies', filename, private=True)
@@ -0,0 +1,203 @@
+"""Serving of uploaded images and downloaded movie files.
+
+Every response carries a strong ETag. For content-addressed uploads the ETag
+is the SHA-256 already in the file name. Other files are hashed once, and the
+digest is cached against their size and mtime. Content-addressed files never
+change in place, so they get a year-long immutable Cache-Control. Everything
+else is revalidated, which usually ends in a body-less 304.
+
+Full responses go through send_file, which gunicorn turns into sendfile(2).
+Single and multiple byte ranges are read in chunks. When MEDIA_SENDFILE is
+'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd), the transfer is handed
+to the front server and the worker only answers revalidations itself.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Response, abort, current_app, request, send_file
+from werkzeug.utils import safe_join
+
+CHUNK_SIZE = 256 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_MAX_BYTES = 64 * 1024 * 1024
+MAX_RANGES = 16
+
+# '<sha256>.<ext>' and its image variants '<sha256>.w<width>.<ext>'
+_CONTENT_ADDRESSED = re.compile(r'(?:^|/)([0-9a-f]{64})((?:\.w\d+)?\.[a-z0-9]+)$')
+
+def media_roots():
+    return {
+        'uploads': current_app.config.get('UPLOAD_FOLDER'),
+        'movies': current_app.config.get('MOVIES_DIRECTORY'),
+    }
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_etag(root_name, relative_path, path, stat):
+    """Strong ETag for a file, derived from its content"""
+    from app import cache
+
+    match = _CONTENT_ADDRESSED.search(relative_path)
+    if match:
+        return match.group(1) + match.group(2)
+
+    # Size and mtime are part of the key, so replacing the file misses the cache
+    key = f'media-etag:{root_name}:{relative_path}:{stat.st_size}:{stat.st_mtime_ns}'
+    etag = cache.get(key)
+    if etag is None:
+        if stat.st_size > current_app.config.get('MEDIA_HASH_MAX_BYTES', HASH_MAX_BYTES):
+            # Downloaded movies are written once and never modified, so their
+            # identity is enough and the request does not wait on hashing gigabytes
+            etag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+        else:
+            etag = _hash_file(path)
+        cache.set(key, etag, timeout=24 * 3600)
+    return etag
+
+def _set_validators(response, etag, stat, immutable, private):
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    response.headers['Accept-Ranges'] = 'bytes'
+    # Replaces whatever send_file chose
+    scope = 'private' if private else 'public'
+    if immutable:
+        max_age = current_app.config.get('MEDIA_IMMUTABLE_MAX_AGE', IMMUTABLE_MAX_AGE)
+        response.headers['Cache-Control'] = f'{scope}, max-age={max_age}, immutable'
+    else:
+        response.headers['Cache-Control'] = f'{scope}, no-cache'
+
+def _range_applies(etag, stat):
+    """If-Range: only honour Range when the client's copy is still current"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    return True
+
+def requested_spans(size):
+    """Satisfiable (start, stop) spans of the Range header, sorted and coalesced.
+
+    Returns None when the whole file should be sent and [] when no span can
+    be satisfied.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes':
+        return None
+    if len(rng.ranges) > current_app.config.get('MEDIA_MAX_RANGES', MAX_RANGES):
+        return None  # many tiny ranges cost more than the file itself
+
+    spans = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(0, size + start), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _read_spans(path, spans, separators=None, closing=b''):
+    with open(path, 'rb') as f:
+        for i, (start, stop) in enumerate(spans):
+            if separators:
+                yield separators[i]
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    if closing:
+        yield closing
+
+def _partial_response(path, spans, size, mimetype):
+    if len(spans) == 1:
+        start, stop = spans[0]
+        response = Response(_read_spans(path, spans), status=206, mimetype=mimetype,
+                            direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+        return response
+
+    boundary = uuid.uuid4().hex
+    separators = [(f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                   f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+                  for start, stop in spans]
+    # Each part body is followed by the CRLF that starts the next delimiter
+    separators = [separators[0]] + [b'\r\n' + separator for separator in separators[1:]]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    response = Response(_read_spans(path, spans, separators, closing), status=206,
+                        direct_passthrough=True)
+    response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    response.content_length = (sum(stop - start for start, stop in spans)
+                               + sum(len(separator) for separator in separators) + len(closing))
+    return response
+
+def _offload_response(root_name, relative_path, path, mimetype):
+    mode = current_app.config.get('MEDIA_SENDFILE')
+    if mode == 'x-accel':
+        prefix = current_app.config.get('MEDIA_ACCEL_PREFIXES', {}).get(root_name)
+        if not prefix:
+            return None
+        header, value = 'X-Accel-Redirect', prefix.rstrip('/') + '/' + quote(relative_path)
+    elif mode == 'x-sendfile':
+        header, value = 'X-Sendfile', path
+    else:
+        return None
+    # The front server reads the file and answers Range itself
+    response = Response(mimetype=mimetype)
+    response.headers[header] = value
+    return response
+
+def send_media(root_name, relative_path, private=False):
+    """Response for a file under one of the media roots, honouring conditional and Range headers"""
+    root = media_roots().get(root_name)
+    # Dot-files are in-progress uploads and other internals
+    if not root or any(part.startswith('.') for part in relative_path.split('/')):
+        abort(404)
+    path = safe_join(root, relative_path)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    etag = content_etag(root_name, relative_path, path, stat)
+    immutable = _CONTENT_ADDRESSED.search(relative_path) is not None
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = _offload_response(root_name, relative_path, path, mimetype)
+    if response is None:
+        spans = requested_spans(stat.st_size) if _range_applies(etag, stat) else None
+        if spans == []:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if spans:
+            response = _partial_response(path, spans, stat.st_size, mimetype)
+        else:
+            # conditional=False: validators and ranges are handled here instead
+            response = send_file(path, mimetype=mimetype, conditional=False, max_age=None)
+
+    _set_validators(response, etag, stat, immutable, private)
+    return response
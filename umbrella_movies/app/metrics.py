@@ -0,0 +1,360 @@
+"""Per-endpoint request metrics in Prometheus text format.
+
+A WSGI middleware times every request and records its latency into a
+fixed-bucket histogram keyed by (endpoint, method, status), together with
+request and response byte counts and an in-flight gauge. Latency is
+measured until the view returns its response, so long-lived streams (SSE,
+CSV exports) do not swamp the histograms with their open time.
+
+Recording takes no lock. Each thread writes into its own shard, and shards
+are only summed when metrics are exported. Every METRICS_FLUSH_INTERVAL
+seconds a worker writes its totals to '<pid>.json' in METRICS_DIR. The
+/admin/metrics endpoint merges all of these files, so one scrape covers
+every worker.
+
+Counts of exited workers are folded into 'archived.json' and their files
+are removed. This works like prometheus_client's multiprocess mode, so the
+directory does not grow with restarts. A snapshot also records its
+process's random token. A new worker that reuses an exited worker's pid
+folds the old file first instead of overwriting it.
+"""
+import bisect
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from flask import request, request_started
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ENDPOINT_KEY = 'umbrella.metrics.endpoint'
+ARCHIVE_NAME = 'archived.json'
+MAX_FOLDED_TOKENS = 1000
+
+class _Shard:
+    """One thread's counters; only that thread writes to it"""
+
+    def __init__(self, size):
+        self.size = size
+        self.requests = {}  # (endpoint, method, status) -> [bucket counts..., +Inf, sum, request bytes, response bytes]
+        self.in_flight = 0
+
+    def observe(self, key, duration, request_bytes, response_bytes):
+        row = self.requests.get(key)
+        if row is None:
+            row = self.requests[key] = [0] * (self.size + 4)
+        row[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+        row[-3] += duration
+        row[-2] += request_bytes
+        row[-1] += response_bytes
+
+class _CountingIterable:
+    """Wraps a streamed body to count its bytes and close the in-flight slot when done"""
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._on_close(self.sent)
+
+class RequestMetrics:
+    """Flask extension and WSGI middleware collecting request metrics"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flusher = None
+        self._token = uuid.uuid4().hex
+        # Counters a worker inherits through fork are the parent's, not its own
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        self.app = app
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+        self._wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+        request_started.connect(self._remember_endpoint, app)
+
+    def _remember_endpoint(self, sender, **extra):
+        # Unmatched URLs share one label so scans cannot explode cardinality
+        rule = request.url_rule
+        request.environ[ENDPOINT_KEY] = rule.endpoint if rule is not None else 'unmatched'
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flusher = None
+        self._token = uuid.uuid4().hex
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(len(DURATION_BUCKETS) + 1)
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._ensure_flusher()
+        return shard
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        shard = self._shard()
+        shard.in_flight += 1
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                if name.lower() == 'content-length':
+                    captured['length'] = int(value)
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self._wsgi_app(environ, capture_start_response)
+        except Exception:
+            shard.in_flight -= 1
+            raise
+        duration = time.perf_counter() - started
+        key = (environ.get(ENDPOINT_KEY, 'unmatched'), environ.get('REQUEST_METHOD', ''),
+               captured.get('status', '500'))
+        request_bytes = int(environ.get('CONTENT_LENGTH') or 0)
+
+        if 'length' in captured or environ.get('REQUEST_METHOD') == 'HEAD':
+            shard.observe(key, duration, request_bytes, captured.get('length', 0))
+            shard.in_flight -= 1
+            return body
+
+        def finished(sent):
+            # close() may run on another thread; write to that thread's shard
+            closing = self._shard()
+            closing.observe(key, duration, request_bytes, sent)
+            closing.in_flight -= 1
+        return _CountingIterable(body, finished)
+
+    # Aggregation
+    def snapshot(self):
+        """This worker's totals, summed over its thread shards"""
+        requests = {}
+        in_flight = 0
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            in_flight += shard.in_flight
+            for key, row in list(shard.requests.items()):
+                total = requests.setdefault('\t'.join(key), [0] * len(row))
+                for i, value in enumerate(row):
+                    total[i] += value
+        return {'pid': os.getpid(), 'token': self._token, 'written_at': time.time(),
+                'in_flight': in_flight, 'requests': requests}
+
+    def flush(self):
+        """Write this worker's snapshot to METRICS_DIR/<pid>.json"""
+        directory = self.app.config['METRICS_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        previous = _read(path)
+        if previous is not None and previous.get('token') != self._token:
+            # Left by an exited worker that had this pid; keep its counts
+            self._fold([path], exited_only=False)
+        _write(path, self.snapshot())
+
+    def _fold(self, paths, exited_only=True):
+        """Add the snapshots at paths to the archive and remove them.
+
+        Runs under an exclusive lock on the directory. Folded tokens are
+        remembered, so a file left behind by an interrupted fold is not
+        counted twice.
+        """
+        directory = self.app.config['METRICS_DIR']
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(directory, ARCHIVE_NAME)
+            archive = _read(archive_path) or {'requests': {}, 'folded': []}
+            for path in paths:
+                # Re-read under the lock: another scrape may have folded it, or a
+                # new worker that reused the pid may have replaced it
+                snapshot = _read(path)
+                if snapshot is None or (exited_only and _alive(snapshot['pid'])):
+                    continue
+                token = snapshot.get('token')
+                if token is None or token not in archive['folded']:
+                    _merge(archive['requests'], snapshot['requests'])
+                    if token is not None:
+                        archive['folded'] = archive['folded'][1 - MAX_FOLDED_TOKENS:] + [token]
+                    _write(archive_path, archive)
+                os.remove(path)
+
+    def _ensure_flusher(self):
+        if self.app is None:
+            return  # unbound instances (benchmark probes) never write snapshots
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._shards_lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.app.config['METRICS_FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing request metrics: {str(e)}")
+
+    def collect(self):
+        """Merge the archive with every live worker's latest snapshot, folding exited workers' files"""
+        self.flush()
+        directory = self.app.config['METRICS_DIR']
+        merged = {}
+        in_flight = 0
+        exited = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json') or name == ARCHIVE_NAME:
+                continue
+            path = os.path.join(directory, name)
+            snapshot = _read(path)
+            if snapshot is None:
+                continue
+            if _alive(snapshot['pid']):
+                in_flight += snapshot['in_flight']
+                _merge(merged, snapshot['requests'])
+            else:
+                exited.append(path)
+        if exited:
+            self._fold(exited)
+        archive = _read(os.path.join(directory, ARCHIVE_NAME))
+        if archive is not None:
+            _merge(merged, archive['requests'])
+        return merged, in_flight
+
+    def render(self):
+        """Prometheus text exposition of the merged metrics"""
+        merged, in_flight = self.collect()
+        lines = [
+            '# HELP umbrella_http_request_duration_seconds Time until the view returned its response.',
+            '# TYPE umbrella_http_request_duration_seconds histogram'
+        ]
+        sizes = []
+        for key in sorted(merged):
+            endpoint, method, status = key.split('\t')
+            labels = f'endpoint="{_escape(endpoint)}",method="{_escape(method)}",status="{status}"'
+            row = merged[key]
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), row[:len(DURATION_BUCKETS) + 1]):
+                cumulative += count
+                lines.append(f'umbrella_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'umbrella_http_request_duration_seconds_sum{{{labels}}} {row[-3]:.6f}')
+            lines.append(f'umbrella_http_request_duration_seconds_count{{{labels}}} {cumulative}')
+            sizes.append((labels, row[-2], row[-1]))
+
+        lines.append('# HELP umbrella_http_request_size_bytes_total Request body bytes received.')
+        lines.append('# TYPE umbrella_http_request_size_bytes_total counter')
+        lines.extend(f'umbrella_http_request_size_bytes_total{{{labels}}} {received}' for labels, received, _ in sizes)
+        lines.append('# HELP umbrella_http_response_size_bytes_total Response body bytes sent.')
+        lines.append('# TYPE umbrella_http_response_size_bytes_total counter')
+        lines.extend(f'umbrella_http_response_size_bytes_total{{{labels}}} {sent}' for labels, _, sent in sizes)
+        lines.append('# HELP umbrella_http_requests_in_flight Requests being handled by live workers.')
+        lines.append('# TYPE umbrella_http_requests_in_flight gauge')
+        lines.append(f'umbrella_http_requests_in_flight {in_flight}')
+        return '\n'.join(lines) + '\n'
+
+    def benchmark(self, count=100000):
+        """Per-request cost of the middleware in microseconds, measured around a no-op WSGI app"""
+        from werkzeug.test import EnvironBuilder
+
+        def sized(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+            return [b'ok']
+
+        def streamed(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return iter([b'o', b'k'])
+
+        environ = EnvironBuilder(path='/', method='GET').get_environ()
+        environ[ENDPOINT_KEY] = 'main.index'
+        start_response = lambda status, headers, exc_info=None: None
+
+        def run(wsgi):
+            started = time.perf_counter()
+            for _ in range(count):
+                body = wsgi(environ, start_response)
+                for _ in body:
+                    pass
+                if hasattr(body, 'close'):
+                    body.close()
+            return (time.perf_counter() - started) / count * 1e6
+
+        results = {}
+        for name, inner in (('sized', sized), ('streamed', streamed)):
+            probe = RequestMetrics()
+            probe._wsgi_app = inner
+            bare = run(inner)
+            wrapped = run(probe)
+            results[name] = {'bare_us': round(bare, 3), 'instrumented_us': round(wrapped, 3),
+                             'overhead_us': round(wrapped - bare, 3)}
+        return results
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write(path, data):
+    # Unique per writer: the flusher thread and a scrape may flush at the same time
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _merge(totals, requests):
+    for key, row in requests.items():
+        total = totals.setdefault(key, [0] * len(row))
+        for i, value in enumerate(row):
+            total[i] += value
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,33 +1,45 @@
 from datetime import datetime
 from app import db, login_manager, cache
+from app.cache_tags import tagged_memoize, invalidate_on_commit
+from app.user_cache import load_cached_user, invalidate_user_on_commit
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from slugify import slugify
 import jwt
 from time import time
 from flask import current_app
-from sqlalchemy import Index, event
+from sqlalchemy import Index, event, case, func, inspect
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, object_session, with_loader_criteria
 import os
 
 # Cache invalidation on model changes
+@event.listens_for(Movie, 'after_insert')
 @event.listens_for(Movie, 'after_update')
 @event.listens_for(Movie, 'after_delete')
 def invalidate_movie_cache(mapper, connection, target):
-    cache.delete_memoized(get_daily_views_data)
-    cache.delete_memoized(calculate_storage_usage)
+    invalidate_on_commit(target, 'movies', f'movie:{target.id}', f'category:{target.category_id}')
 
+@event.listens_for(Category, 'after_insert')
 @event.listens_for(Category, 'after_update')
 @event.listens_for(Category, 'after_delete')
 def invalidate_category_cache(mapper, connection, target):
-    cache.delete_memoized(get_categories_data)
+    invalidate_on_commit(target, 'categories', f'category:{target.id}')
 
 @event.listens_for(MovieView, 'after_insert')
 def invalidate_views_cache(mapper, connection, target):
-    cache.delete_memoized(get_daily_views_data)
+    from app.rollups import apply_view_rows
+    apply_view_rows(connection, [{'movie_id': target.movie_id, 'viewed_at': target.viewed_at}])
+    invalidate_on_commit(target, 'views:day', f'movie:{target.movie_id}')
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user_snapshot(mapper, connection, target):
+    invalidate_user_on_commit(target)
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return load_cached_user(int(id))
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,6 +72,8 @@ class User(UserMixin, db.Model):
             return None
         return User.query.get(id)
 
+RATING_STARS = range(1, 6)
+
 class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -68,9 +82,21 @@ class Movie(db.Model):
     release_date = db.Column(db.DateTime)
     duration = db.Column(db.Integer)  # in minutes
     poster_url = db.Column(db.String(200))
+    # Sizes/WebP/placeholder generated from the poster by app.image_pipeline
+    image_variants = db.Column(db.JSON)
     trailer_url = db.Column(db.String(200))
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
     is_featured = db.Column(db.Boolean, default=False)
+    # Set when deletion starts; app.purge removes the row once its dependents are gone
+    is_hidden = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # Denormalized rating aggregates, maintained by the Rating listeners below
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     views = db.relationship('MovieView', backref=db.backref('movie', lazy='dynamic'))
     reviews = db.relationship('Review', backref='movie', lazy='dynamic')
     ratings = db.relationship('Rating', backref='movie', lazy='dynamic')
@@ -82,18 +108,28 @@ class Movie(db.Model):
         if self.title:
             self.slug = slugify(self.title)
     
-    @property
+    @hybrid_property
     def average_rating(self):
-        ratings = [r.value for r in self.ratings.all()]
-        return sum(ratings) / len(ratings) if ratings else 0
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+    
+    @average_rating.expression
+    def average_rating(cls):
+        return case((cls.rating_count > 0, cls.rating_sum * 1.0 / cls.rating_count), else_=0)
+    
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') or 0 for star in RATING_STARS}
     
     @property
     def view_count(self):
-        return self.views.count()
+        return db.session.query(func.coalesce(func.sum(MovieViewDaily.views), 0)).filter(
+            MovieViewDaily.movie_id == self.id).scalar()
     
     @property
     def today_views(self):
-        return self.views.filter(MovieView.viewed_at >= datetime.today()).count()
+        return db.session.query(func.coalesce(func.sum(MovieViewDaily.views), 0)).filter(
+            MovieViewDaily.movie_id == self.id,
+            MovieViewDaily.day == datetime.utcnow().date()).scalar()
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -101,6 +137,8 @@ class Category(db.Model):
     slug = db.Column(db.String(64), unique=True)
     description = db.Column(db.Text)
     movies = db.relationship('Movie', backref='category', lazy='dynamic')
+    # Maintained by the Movie listeners below; rebuild with 'flask categories rebuild'
+    movie_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     def __init__(self, *args, **kwargs):
         super(Category, self).__init__(*args, **kwargs)
@@ -133,8 +171,265 @@ class MovieView(db.Model):
     ip_address = db.Column(db.String(45))  # Support IPv6
     viewed_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class MovieViewHourly(db.Model):
+    """Per-movie view counts bucketed by UTC hour, maintained by app.rollups"""
+    __tablename__ = 'movie_view_hourly'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+class MovieViewDaily(db.Model):
+    """Per-movie view counts bucketed by UTC day, maintained by app.rollups"""
+    __tablename__ = 'movie_view_daily'
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+
+class StoredFile(db.Model):
+    """One file under UPLOAD_FOLDER or MOVIES_DIRECTORY, maintained by app.storage_ledger"""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), unique=True, nullable=False)  # relative to its root
+    category = db.Column(db.String(20), nullable=False)  # posters, thumbnails, movies, other
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    # Rows/uploads sharing this file; it is deleted when the count drops to zero
+    ref_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StorageLedger(db.Model):
+    """Running byte and file totals per storage category"""
+    category = db.Column(db.String(20), primary_key=True)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    files = db.Column(db.Integer, nullable=False, default=0)
+    # Bytes as if every reference had its own copy; logical_bytes / bytes is the dedup ratio
+    logical_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BackgroundJob(db.Model):
+    """A long-running admin operation executed by app.jobs"""
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    params = db.Column(db.JSON)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer)  # no FK: the job may outlive the admin who started it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # touched by the process holding the job; see app.jobs
+
+    @property
+    def progress(self):
+        return round(self.processed / self.total * 100, 1) if self.total else (100.0 if self.status == 'completed' else 0.0)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': self.progress,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None
+        }
+
+class BlacklistedIP(db.Model):
+    """Blocked address or CIDR range, compiled into app.ip_blocklist"""
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(49), unique=True, nullable=False)  # '203.0.113.7', '2001:db8::/32'
+    reason = db.Column(db.String(255))
+    added_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # None for imports and the system
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime)
+
+class SecurityAudit(db.Model):
+    """Append-only log of security-relevant admin and user events"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    ip_address = db.Column(db.String(45))
+    user_agent = db.Column(db.String(256))
+    details = db.Column(db.JSON)
+    severity = db.Column(db.String(20), nullable=False, default='low')  # low, medium, high, critical
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def log(cls, event_type, user_id=None, ip_address=None, user_agent=None, details=None, severity='low'):
+        audit = cls(event_type=event_type, user_id=user_id, ip_address=ip_address,
+                    user_agent=user_agent[:256] if user_agent else None, details=details, severity=severity)
+        db.session.add(audit)
+        db.session.commit()
+        return audit
+
+# Movies pending purge are invisible to ORM queries unless they opt in with
+# .execution_options(include_hidden=True)
+@event.listens_for(Session, 'do_orm_execute')
+def exclude_hidden_movies(execute_state):
+    if (execute_state.is_select and not execute_state.is_column_load
+            and not execute_state.execution_options.get('include_hidden', False)):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(Movie, lambda cls: cls.is_hidden.is_(False), include_aliases=True)
+        )
+
+@event.listens_for(BlacklistedIP, 'after_insert')
+@event.listens_for(BlacklistedIP, 'after_update')
+@event.listens_for(BlacklistedIP, 'after_delete')
+def invalidate_ip_blocklist(mapper, connection, target):
+    invalidate_on_commit(target, 'ip-blocklist')
+
+# Security audit event-type facet: each worker bumps the tag the first time it
+# commits a type, so the cached list picks up new types without rescanning
+_seen_security_event_types = set()
+
+@event.listens_for(SecurityAudit, 'after_insert')
+def add_security_event_type(mapper, connection, target):
+    if target.event_type not in _seen_security_event_types:
+        invalidate_on_commit(target, 'security-event-types')
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('security_event_types', set()).add(target.event_type)
+
+# Only a committed type is seen; after a rollback the tag bump is discarded too
+@event.listens_for(Session, 'after_commit')
+def mark_security_event_types_seen(session):
+    _seen_security_event_types.update(session.info.pop('security_event_types', ()))
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_security_event_types(session):
+    session.info.pop('security_event_types', None)
+
+# Rating aggregate maintenance
+def _apply_rating_delta(connection, movie_id, value, sign):
+    """Add (sign=1) or remove (sign=-1) one rating from the movie's aggregates"""
+    if movie_id is None or value is None:
+        return
+    movie_table = Movie.__table__
+    values = {
+        'rating_sum': movie_table.c.rating_sum + sign * value,
+        'rating_count': movie_table.c.rating_count + sign,
+    }
+    if value in RATING_STARS:
+        column = f'rating_{value}_count'
+        values[column] = movie_table.c[column] + sign
+    connection.execute(
+        movie_table.update().where(movie_table.c.id == movie_id).values(**values)
+    )
+
+@event.listens_for(Rating, 'after_insert')
+def add_rating_to_aggregates(mapper, connection, target):
+    _apply_rating_delta(connection, target.movie_id, target.value, 1)
+
+@event.listens_for(Rating, 'after_delete')
+def remove_rating_from_aggregates(mapper, connection, target):
+    _apply_rating_delta(connection, target.movie_id, target.value, -1)
+
+@event.listens_for(Rating, 'after_update')
+def update_rating_aggregates(mapper, connection, target):
+    state = inspect(target)
+    value_history = state.attrs.value.history
+    movie_history = state.attrs.movie_id.history
+    if not value_history.has_changes() and not movie_history.has_changes():
+        return
+    old_value = value_history.deleted[0] if value_history.deleted else target.value
+    old_movie_id = movie_history.deleted[0] if movie_history.deleted else target.movie_id
+    _apply_rating_delta(connection, old_movie_id, old_value, -1)
+    _apply_rating_delta(connection, target.movie_id, target.value, 1)
+
+# Category movie counters
+def _apply_category_delta(connection, category_id, delta):
+    if category_id is None:
+        return
+    category_table = Category.__table__
+    connection.execute(
+        category_table.update().where(category_table.c.id == category_id).values(
+            movie_count=category_table.c.movie_count + delta
+        )
+    )
+
+# Hidden movies are being purged and no longer count towards their category
+@event.listens_for(Movie, 'after_insert')
+def add_movie_to_category_count(mapper, connection, target):
+    if not target.is_hidden:
+        _apply_category_delta(connection, target.category_id, 1)
+
+@event.listens_for(Movie, 'after_delete')
+def remove_movie_from_category_count(mapper, connection, target):
+    if not target.is_hidden:
+        _apply_category_delta(connection, target.category_id, -1)
+
+@event.listens_for(Movie, 'after_update')
+def move_movie_between_category_counts(mapper, connection, target):
+    attrs = inspect(target).attrs
+    category, hidden = attrs.category_id.history, attrs.is_hidden.history
+    if not category.has_changes() and not hidden.has_changes():
+        return
+    old_category = category.deleted[0] if category.deleted else target.category_id
+    old_hidden = hidden.deleted[0] if hidden.deleted else target.is_hidden
+    if not old_hidden:
+        _apply_category_delta(connection, old_category, -1)
+    if not target.is_hidden:
+        _apply_category_delta(connection, target.category_id, 1)
+
+def rebuild_category_counts():
+    """Recompute Category.movie_count with one grouped query. Returns categories corrected."""
+    counts = dict(db.session.query(Movie.category_id, func.count(Movie.id))
+                  .filter(Movie.category_id.isnot(None))
+                  .group_by(Movie.category_id))
+    updates = [{'id': category_id, 'movie_count': counts.get(category_id, 0)}
+               for category_id, stored in db.session.query(Category.id, Category.movie_count)
+               if (stored or 0) != counts.get(category_id, 0)]
+    if updates:
+        db.session.execute(db.update(Category), updates)
+    return len(updates)
+
+def rebuild_rating_aggregates(movie_ids=None):
+    """Recompute the denormalized rating columns on Movie from Rating rows.
+
+    Bulk query deletes bypass the mapper events above, so callers that remove
+    ratings with Query.delete() should rebuild the affected movies afterwards.
+    Returns the number of movies whose stored aggregates had drifted.
+    """
+    star_columns = [f'rating_{star}_count' for star in RATING_STARS]
+    totals_query = db.session.query(
+        Rating.movie_id,
+        func.coalesce(func.sum(Rating.value), 0),
+        func.count(Rating.id),
+        *[func.sum(case((Rating.value == star, 1), else_=0)) for star in RATING_STARS]
+    ).group_by(Rating.movie_id)
+    stored_query = db.session.query(
+        Movie.id, Movie.rating_sum, Movie.rating_count,
+        *[getattr(Movie, column) for column in star_columns]
+    )
+    if movie_ids is not None:
+        movie_ids = list(movie_ids)
+        if not movie_ids:
+            return 0
+        totals_query = totals_query.filter(Rating.movie_id.in_(movie_ids))
+        stored_query = stored_query.filter(Movie.id.in_(movie_ids))
+    
+    totals = {row[0]: tuple(int(v or 0) for v in row[1:]) for row in totals_query}
+    empty = (0,) * (2 + len(star_columns))
+    
+    updates = []
+    for row in stored_query:
+        expected = totals.get(row[0], empty)
+        if tuple(v or 0 for v in row[1:]) != expected:
+            values = dict(zip(['rating_sum', 'rating_count'] + star_columns, expected))
+            values['id'] = row[0]
+            updates.append(values)
+    
+    if updates:
+        db.session.execute(db.update(Movie), updates)
+    return len(updates)
+
 # Cache functions
-@cache.memoize(timeout=300)
+@tagged_memoize('views:day', timeout=300)
 def get_daily_views_data():
     """Get movie view statistics for the last 7 days"""
     from datetime import datetime, timedelta
@@ -142,24 +437,22 @@ def get_daily_views_data():
     views = MovieView.query.filter(MovieView.viewed_at >= seven_days_ago).all()
     return views
 
-@cache.memoize(timeout=300)
+@tagged_memoize('security-event-types', timeout=24 * 3600)
+def get_security_event_types():
+    """Distinct SecurityAudit event types, read off the event_type index"""
+    return [event_type for (event_type,) in db.session.query(SecurityAudit.event_type).distinct().order_by(
+        SecurityAudit.event_type)]
+
 def calculate_storage_usage():
     """Calculate total storage usage of movie files"""
-    movies = Movie.query.all()
-    total_size = 0
-    for movie in movies:
-        if movie.poster_url and movie.poster_url.startswith('/'):
-            try:
-                total_size += os.path.getsize(movie.poster_url[1:])
-            except OSError:
-                pass
-    return total_size
-
-@cache.memoize(timeout=300)
+    from app.storage_ledger import total_bytes
+    return total_bytes()
+
+@tagged_memoize('categories', 'movies', timeout=300)
 def get_categories_data():
     """Get all categories with their movie counts"""
-    categories = Category.query.all()
-    return [(cat, cat.movies.count()) for cat in categories]
+    categories = Category.query.order_by(Category.name).all()
+    return [(cat, cat.movie_count) for cat in categories]
 
 # Add indexes for frequently queried columns
 Index('idx_movie_created_at', Movie.created_at)
@@ -170,4 +463,11 @@ Index('idx_rating_movie', Rating.movie_id)
 Index('idx_rating_user', Rating.user_id)
 Index('idx_movieview_movie', MovieView.movie_id)
 Index('idx_movieview_user', MovieView.user_id)
-Index('idx_movieview_date', MovieView.viewed_at)
\ No newline at end of file
+Index('idx_movieview_date', MovieView.viewed_at)
+Index('idx_movieview_hourly_hour', MovieViewHourly.hour)
+Index('idx_movieview_daily_day', MovieViewDaily.day)
+Index('idx_background_job_status', BackgroundJob.status, BackgroundJob.created_at)
+# Keyset pagination walks (created_at, id) backwards, optionally after an equality filter
+Index('idx_security_audit_created', SecurityAudit.created_at, SecurityAudit.id)
+Index('idx_security_audit_severity_created', SecurityAudit.severity, SecurityAudit.created_at, SecurityAudit.id)
+Index('idx_security_audit_event_created', SecurityAudit.event_type, SecurityAudit.created_at, SecurityAudit.id)
\ No newline at end of file
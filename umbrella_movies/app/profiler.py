@@ -0,0 +1,290 @@
+"""On-demand sampling profiler for production requests.
+
+Profiling is off until an admin starts a session with a sample rate and, if
+wanted, a list of endpoints. The settings live in the shared cache, and each
+worker re-reads them every PROFILER_POLL seconds. A request is profiled when
+it falls in that sample, or when it carries a token from sign() in the
+PROFILER_HEADER header. Signed requests are profiled even while sampling is
+off. A token is good for one request within PROFILER_TOKEN_MAX_AGE seconds:
+its nonce is claimed in the cache the first time it is used.
+
+While any request in a worker is being profiled, a sampler thread reads
+sys._current_frames() every PROFILER_INTERVAL seconds and counts the stack
+of each profiled thread. Stacks are folded into collapsed format, with the
+endpoint as the root frame, and each worker writes its totals for the session
+to PROFILER_DIR. download() merges these files into one flamegraph input.
+
+When nothing is being profiled, a request costs one header lookup and,
+while a session is active, one random() call.
+"""
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import request, request_started
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_KEY = 'profiler:settings'
+
+class _Profile:
+    """Stack counts of one request being profiled"""
+
+    def __init__(self, endpoint, signed):
+        self.endpoint = endpoint
+        self.signed = signed
+        self.stacks = Counter()
+        self.samples = 0
+
+class SamplingProfiler:
+    """Flask extension sampling the stacks of selected requests"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._settings = {}
+        self._checked_at = None
+        self._active = {}
+        self._totals = Counter()
+        self._session = None
+        self._written_at = 0.0
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER_HEADER', 'X-Umbrella-Profile')
+        app.config.setdefault('PROFILER_INTERVAL', 0.005)
+        app.config.setdefault('PROFILER_POLL', 1.0)
+        app.config.setdefault('PROFILER_MAX_DEPTH', 128)
+        app.config.setdefault('PROFILER_TOKEN_MAX_AGE', 300)
+        app.config.setdefault('PROFILER_WRITE_INTERVAL', 5.0)
+        self.app = app
+        app.extensions['profiler'] = self
+        # request_started fires before any before_request hook, so those are sampled too
+        request_started.connect(self._start_request, app)
+        app.teardown_request(self._finish_request)
+        app.after_request(self._annotate_response)
+
+    # Settings shared by all workers
+    def settings(self):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.app.config['PROFILER_POLL']:
+            from app import cache
+            self._checked_at = now
+            try:
+                self._settings = cache.get(SETTINGS_KEY) or {}
+            except Exception as e:
+                logger.error(f"Error reading profiler settings: {str(e)}")
+        return self._settings
+
+    def configure(self, rate, endpoints=None, user_id=None):
+        """Start a new profiling session sampling `rate` of requests (to `endpoints` if given)"""
+        from app import cache
+        settings = {
+            'session': uuid.uuid4().hex[:12],
+            'rate': min(max(float(rate), 0.0), 1.0),
+            'endpoints': sorted(endpoints) if endpoints else None,
+            'started_by': user_id,
+            'started_at': time.time()
+        }
+        cache.set(SETTINGS_KEY, settings, timeout=0)
+        self._checked_at = None
+        return settings
+
+    def stop(self):
+        """Stop sampling; the session's profile stays downloadable"""
+        from app import cache
+        settings = dict(self.settings(), rate=0.0)
+        cache.set(SETTINGS_KEY, settings, timeout=0)
+        self._checked_at = None
+        return settings
+
+    def _serializer(self):
+        from itsdangerous import URLSafeTimedSerializer
+        return URLSafeTimedSerializer(self.app.config['SECRET_KEY'], salt='umbrella-profiler')
+
+    def sign(self, user_id=None):
+        """Token that profiles the first request sending it in PROFILER_HEADER"""
+        return self._serializer().dumps({'by': user_id, 'nonce': uuid.uuid4().hex})
+
+    def _verified(self, token):
+        from itsdangerous import BadSignature
+        from app import cache
+        max_age = self.app.config['PROFILER_TOKEN_MAX_AGE']
+        try:
+            payload = self._serializer().loads(token, max_age=max_age)
+        except BadSignature:
+            return False
+        nonce = payload.get('nonce') if isinstance(payload, dict) else None
+        if not nonce:
+            return False
+        try:
+            # Only the first request to claim the nonce is profiled; the claim
+            # outlives the token, so a replay is never accepted
+            return bool(cache.add(f'profiler-token:{nonce}', 1, timeout=max_age))
+        except Exception as e:
+            logger.error(f"Error claiming profiler token: {str(e)}")
+            return False
+
+    # Request hooks
+    def _start_request(self, sender, **extra):
+        token = request.headers.get(self.app.config['PROFILER_HEADER'])
+        settings = self.settings()
+        if token is None:
+            rate = settings.get('rate')
+            if not rate or random.random() >= rate:
+                return
+            endpoints = settings.get('endpoints')
+            if endpoints and request.endpoint not in endpoints:
+                return
+        elif not self._verified(token):
+            return
+        profile = _Profile(request.endpoint or 'unmatched', token is not None)
+        request.environ['umbrella.profile'] = profile
+        self._ensure_sampler()
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+        self._wake.set()
+
+    def _annotate_response(self, response):
+        profile = request.environ.get('umbrella.profile')
+        if profile is not None and profile.signed:
+            # Counted so far; a streamed body keeps sampling after this
+            response.headers['X-Profile-Samples'] = str(profile.samples)
+            response.headers['X-Profile-Session'] = self.settings().get('session') or 'manual'
+        return response
+
+    def _finish_request(self, exc=None):
+        profile = request.environ.pop('umbrella.profile', None)
+        if profile is None:
+            return
+        session = self.settings().get('session') or 'manual'
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if session != self._session:
+                self._session, self._totals = session, Counter()
+            self._totals.update(profile.stacks)
+            due = time.monotonic() - self._written_at >= self.app.config['PROFILER_WRITE_INTERVAL']
+        if due or profile.signed:
+            self.flush()
+
+    # Sampling
+    def _ensure_sampler(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._active = {}
+            self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+            self._thread.start()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            for marker in ('site-packages' + os.sep, 'umbrella_movies' + os.sep):
+                if marker in filename:
+                    filename = filename.rsplit(marker, 1)[1]
+                    break
+            label = self._labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+        return label
+
+    def _run(self):
+        max_depth = self.app.config['PROFILER_MAX_DEPTH']
+        while True:
+            if not self._active:
+                self._wake.clear()
+                # Re-check after clearing so a request registered in between is not missed
+                if not self._active:
+                    self._wake.wait()
+            time.sleep(self.app.config['PROFILER_INTERVAL'])
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, profile in active:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    stack.append(profile.endpoint)
+                    profile.stacks[';'.join(reversed(stack))] += 1
+                    profile.samples += 1
+            del frames
+
+    # Output
+    def flush(self):
+        """Write this worker's stack totals for the current session"""
+        # Request threads and downloads flush concurrently; one writer at a
+        # time, so they neither share the temp file nor land out of order
+        with self._write_lock:
+            with self._lock:
+                session, totals = self._session, dict(self._totals)
+                self._written_at = time.monotonic()
+            if session is None:
+                return
+            directory = self.app.config['PROFILER_DIR']
+            try:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f'{session}-{os.getpid()}.folded')
+                with open(path + '.tmp', 'w') as f:
+                    for stack, count in totals.items():
+                        f.write(f'{stack} {count}\n')
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                logger.error(f"Error writing profile: {str(e)}")
+
+    def download(self, session=None, endpoint=None):
+        """Collapsed stacks of every worker for a session, heaviest first.
+
+        Other workers' most recent samples appear once they next write, at
+        most PROFILER_WRITE_INTERVAL after their next profiled request.
+        """
+        self.flush()
+        session = session or self.settings().get('session') or 'manual'
+        directory = self.app.config['PROFILER_DIR']
+        merged = Counter()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if not (name.startswith(session + '-') and name.endswith('.folded')):
+                    continue
+                with open(os.path.join(directory, name)) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if endpoint and stack.split(';', 1)[0] != endpoint:
+                            continue
+                        merged[stack] += int(count)
+        return ''.join(f'{stack} {count}\n' for stack, count in merged.most_common())
+
+    def sessions(self):
+        """Sessions with profiles on disk, and how many workers wrote to each"""
+        directory = self.app.config['PROFILER_DIR']
+        found = Counter()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.folded'):
+                    found[name.rsplit('-', 1)[0]] += 1
+        return dict(found)
+
+    def status(self):
+        return {
+            'settings': self.settings(),
+            'header': self.app.config['PROFILER_HEADER'],
+            'profiling_now': len(self._active),
+            'sessions': self.sessions()
+        }
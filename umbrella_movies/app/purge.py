@@ -0,0 +1,95 @@
+"""Set-based, chunked deletion jobs for users, movies and their dependent rows.
+
+Each step deletes with DELETE ... WHERE ... IN (...) over a bounded slice and
+commits before the next one, so no transaction holds locks on movie_view for
+long. Denormalized data (view rollups, rating aggregates, cached user
+snapshots) is corrected inside the same transaction as each slice.
+"""
+from flask import current_app
+from sqlalchemy import func
+from app import db, jobs
+from app.models import Movie, User, Review, Rating, MovieView, rebuild_rating_aggregates
+from app.rollups import subtract_views, drop_movie_rollups
+from app.content_store import release_upload
+from app.image_pipeline import delete_variants
+from app.user_cache import invalidate_user_cache
+
+def delete_in_batches(model, criterion, batch_size, job=None, before_delete=None):
+    """Delete rows of model matching criterion batch_size at a time, committing each batch.
+
+    before_delete(ids) runs in the batch's transaction; job.processed advances
+    with every committed batch when a job is given.
+    """
+    deleted = 0
+    while True:
+        ids = [id for (id,) in db.session.query(model.id).filter(criterion).limit(batch_size)]
+        if not ids:
+            return deleted
+        if before_delete is not None:
+            before_delete(ids)
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        if job is not None:
+            job.processed += len(ids)
+        db.session.commit()
+        deleted += len(ids)
+
+def _subtract_view_ids(ids):
+    subtract_views(MovieView.id.in_(ids))
+
+@jobs.handler('purge_users')
+def purge_users(job, user_ids):
+    """Delete users with their reviews, ratings and views, chunk by chunk"""
+    chunk_size = current_app.config.get('PURGE_CHUNK_SIZE', 500)
+    batch_size = current_app.config.get('PURGE_BATCH_SIZE', 5000)
+    user_ids = sorted(set(user_ids))
+    job.total = len(user_ids)
+    db.session.commit()
+
+    # Chunks before job.processed were committed by an earlier run
+    for start in range(job.processed, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        delete_in_batches(MovieView, MovieView.user_id.in_(chunk), batch_size,
+                          before_delete=_subtract_view_ids)
+
+        rated_movie_ids = [movie_id for (movie_id,) in db.session.query(Rating.movie_id).filter(
+            Rating.user_id.in_(chunk)).distinct()]
+        Review.query.filter(Review.user_id.in_(chunk)).delete(synchronize_session=False)
+        Rating.query.filter(Rating.user_id.in_(chunk)).delete(synchronize_session=False)
+        rebuild_rating_aggregates(rated_movie_ids)
+        User.query.filter(User.id.in_(chunk)).delete(synchronize_session=False)
+
+        job.processed = start + len(chunk)
+        db.session.commit()
+        invalidate_user_cache(*chunk)
+
+@jobs.handler('purge_movie')
+def purge_movie(job, movie_id):
+    """Remove a hidden movie's views, reviews and ratings in batches, then the movie itself"""
+    batch_size = current_app.config.get('PURGE_BATCH_SIZE', 5000)
+    movie = Movie.query.execution_options(include_hidden=True).get(movie_id)
+    if movie is None:
+        return
+
+    if not job.total:
+        job.total = sum(db.session.query(func.count(model.id)).filter(model.movie_id == movie_id).scalar()
+                        for model in (MovieView, Review, Rating))
+        db.session.commit()
+
+    # The rollups are dropped wholesale below, so views need no per-batch subtraction
+    for model in (MovieView, Review, Rating):
+        delete_in_batches(model, model.movie_id == movie_id, batch_size, job=job)
+
+    # Lock the movie row so no view insert can reference it until this commits, then
+    # sweep views that buffered ingestion wrote while the batches above were running
+    movie = Movie.query.execution_options(include_hidden=True).filter_by(id=movie_id).with_for_update().first()
+    if movie is None:
+        # A concurrent or earlier run of this job already finished the purge
+        db.session.commit()
+        return
+    MovieView.query.filter(MovieView.movie_id == movie_id).delete(synchronize_session=False)
+    drop_movie_rollups(movie_id)
+    delete_variants(movie.image_variants)
+    if movie.poster_url:
+        release_upload(movie.poster_url)
+    db.session.delete(movie)
+    db.session.commit()
@@ -0,0 +1,219 @@
+"""Hourly and daily MovieView rollups.
+
+Dashboard and stats queries read MovieViewHourly/MovieViewDaily instead of
+scanning raw MovieView rows. The rollups are kept current incrementally by
+the buffered view ingestion flush and the MovieView after_insert listener;
+bulk deletes of raw views must go through subtract_views() first. All
+buckets are UTC.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, date
+from sqlalchemy import desc, func
+from app import db, view_archive
+from app.models import Movie, MovieView, MovieViewHourly, MovieViewDaily
+
+def _hour_bucket(viewed_at):
+    return viewed_at.replace(minute=0, second=0, microsecond=0)
+
+def _upsert_counts(connection, table, key_columns, counts):
+    """Add each count in {key_tuple: delta} to table.views, inserting missing rows"""
+    rows = [dict(zip(key_columns, key), views=delta) for key, delta in counts.items() if delta]
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={'views': table.c.views + stmt.excluded.views}
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        condition = db.and_(*[table.c[col] == row[col] for col in key_columns])
+        result = connection.execute(
+            table.update().where(condition).values(views=table.c.views + row['views'])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert(), [row])
+
+def apply_view_rows(connection, rows, sign=1):
+    """Fold raw view rows (dicts with movie_id and viewed_at) into both rollups"""
+    hourly = Counter()
+    daily = Counter()
+    for row in rows:
+        viewed_at = row['viewed_at'] or datetime.utcnow()
+        hourly[(row['movie_id'], _hour_bucket(viewed_at))] += sign
+        daily[(row['movie_id'], viewed_at.date())] += sign
+    _upsert_counts(connection, MovieViewHourly.__table__, ['movie_id', 'hour'], hourly)
+    _upsert_counts(connection, MovieViewDaily.__table__, ['movie_id', 'day'], daily)
+
+def subtract_views(*criteria):
+    """Remove the views matching criteria from the rollups.
+
+    Call before a bulk MovieView Query.delete(), which skips mapper events,
+    e.g. subtract_views(MovieView.user_id.in_(user_ids)).
+    """
+    hour_counts = _grouped_hourly_counts(*criteria)
+    hourly = Counter({(movie_id, hour): -views for movie_id, hour, views in hour_counts})
+    daily = Counter()
+    for (movie_id, hour), delta in hourly.items():
+        daily[(movie_id, hour.date())] += delta
+    connection = db.session.connection()
+    _upsert_counts(connection, MovieViewHourly.__table__, ['movie_id', 'hour'], hourly)
+    _upsert_counts(connection, MovieViewDaily.__table__, ['movie_id', 'day'], daily)
+
+def drop_movie_rollups(movie_id):
+    """Delete every rollup row for a movie that is being removed"""
+    MovieViewHourly.query.filter_by(movie_id=movie_id).delete(synchronize_session=False)
+    MovieViewDaily.query.filter_by(movie_id=movie_id).delete(synchronize_session=False)
+
+def _hour_expression(column):
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc('hour', column)
+    return func.strftime('%Y-%m-%d %H:00:00', column)
+
+def _grouped_hourly_counts(*criteria):
+    """Yield (movie_id, hour datetime, views) from raw MovieView rows"""
+    hour = _hour_expression(MovieView.viewed_at)
+    query = db.session.query(MovieView.movie_id, hour, func.count(MovieView.id))\
+        .filter(*criteria)\
+        .group_by(MovieView.movie_id, hour)
+    for movie_id, bucket, views in query:
+        if isinstance(bucket, str):
+            bucket = datetime.strptime(bucket, '%Y-%m-%d %H:%M:%S')
+        yield movie_id, bucket, views
+
+# Read API used by the dashboard and stats endpoints
+def daily_view_totals(days=7, end_day=None):
+    """Return [(day, views)] for the last `days` days, oldest first, zero-filled"""
+    end_day = end_day or datetime.utcnow().date()
+    start_day = end_day - timedelta(days=days - 1)
+    totals = dict(db.session.query(MovieViewDaily.day, func.sum(MovieViewDaily.views))
+                  .filter(MovieViewDaily.day.between(start_day, end_day))
+                  .group_by(MovieViewDaily.day))
+    return [(start_day + timedelta(days=i), int(totals.get(start_day + timedelta(days=i)) or 0))
+            for i in range(days)]
+
+def total_view_count():
+    return int(db.session.query(func.coalesce(func.sum(MovieViewDaily.views), 0)).scalar())
+
+def popular_movies(limit=5, since=None):
+    """Movies ordered by rolled-up view count, optionally since a given day"""
+    query = Movie.query.join(MovieViewDaily, MovieViewDaily.movie_id == Movie.id)
+    if since is not None:
+        query = query.filter(MovieViewDaily.day >= since)
+    return query.group_by(Movie.id)\
+        .order_by(desc(func.sum(MovieViewDaily.views)))\
+        .limit(limit)\
+        .all()
+
+# Maintenance
+def _existing_movie_ids(movie_ids):
+    """The subset of movie_ids still in the movies table"""
+    ids = sorted(set(movie_ids))
+    existing = set()
+    for i in range(0, len(ids), 500):
+        existing.update(movie_id for movie_id, in
+                        db.session.query(Movie.id).filter(Movie.id.in_(ids[i:i + 500])))
+    return existing
+
+def _day_range(start_day, end_day):
+    day = start_day
+    while day <= end_day:
+        yield day
+        day += timedelta(days=1)
+
+def backfill_view_rollups(start_day=None, end_day=None):
+    """Rebuild both rollups from raw MovieView rows, one day per transaction.
+
+    Returns the number of days rebuilt. Views ingested for a day while it is
+    being rebuilt may be counted twice; run check_view_rollups afterwards.
+    """
+    if start_day is None:
+        first_view = db.session.query(func.min(MovieView.viewed_at)).scalar()
+        if first_view is None:
+            return 0
+        start_day = first_view.date() if isinstance(first_view, datetime) else \
+            datetime.fromisoformat(str(first_view)).date()
+    end_day = end_day or datetime.utcnow().date()
+
+    rebuilt = 0
+    for day in _day_range(start_day, end_day):
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        MovieViewHourly.query.filter(MovieViewHourly.hour >= day_start,
+                                     MovieViewHourly.hour < day_end).delete(synchronize_session=False)
+        MovieViewDaily.query.filter(MovieViewDaily.day == day).delete(synchronize_session=False)
+
+        # Days older than the archive horizon live partly or wholly on disk. Archive
+        # partitions keep the views of movies deleted since, which must not come back
+        hourly = view_archive.movie_hour_counts(day)
+        existing = _existing_movie_ids(movie_id for movie_id, _ in hourly)
+        hourly = Counter({key: views for key, views in hourly.items() if key[0] in existing})
+        for movie_id, hour, views in _grouped_hourly_counts(MovieView.viewed_at >= day_start,
+                                                             MovieView.viewed_at < day_end):
+            hourly[(movie_id, hour)] += views
+        daily = Counter()
+        for (movie_id, _), views in hourly.items():
+            daily[(movie_id, day)] += views
+        connection = db.session.connection()
+        _upsert_counts(connection, MovieViewHourly.__table__, ['movie_id', 'hour'], hourly)
+        _upsert_counts(connection, MovieViewDaily.__table__, ['movie_id', 'day'], daily)
+        db.session.commit()
+        rebuilt += 1
+    return rebuilt
+
+def check_view_rollups(start_day, end_day=None):
+    """Compare MovieViewDaily with raw counts per (movie_id, day).
+
+    Raw counts include views already moved to the cold-storage archive, except
+    those of movies that have since been deleted.
+
+    Returns a list of mismatches as dicts with movie_id, day, raw and rollup.
+    """
+    end_day = end_day or datetime.utcnow().date()
+    range_start = datetime.combine(start_day, datetime.min.time())
+    range_end = datetime.combine(end_day, datetime.min.time()) + timedelta(days=1)
+
+    raw_day = func.date(MovieView.viewed_at)
+    raw = {}
+    for movie_id, day, views in db.session.query(MovieView.movie_id, raw_day, func.count(MovieView.id))\
+            .filter(MovieView.viewed_at >= range_start, MovieView.viewed_at < range_end)\
+            .group_by(MovieView.movie_id, raw_day):
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        raw[(movie_id, day)] = views
+
+    archived = view_archive.movie_day_counts(start_day, end_day)
+    existing = _existing_movie_ids(movie_id for movie_id, _ in archived)
+    for key, views in archived.items():
+        if key[0] in existing:
+            raw[key] = raw.get(key, 0) + views
+
+    rolled = {(row.movie_id, row.day): row.views for row in
+              MovieViewDaily.query.filter(MovieViewDaily.day.between(start_day, end_day))}
+
+    mismatches = []
+    for key in sorted(set(raw) | set(rolled)):
+        if raw.get(key, 0) != rolled.get(key, 0):
+            mismatches.append({
+                'movie_id': key[0],
+                'day': key[1].isoformat(),
+                'raw': raw.get(key, 0),
+                'rollup': rolled.get(key, 0)
+            })
+    return mismatches
+
+def fold_flushed_views(rows):
+    apply_view_rows(db.session.connection(), rows)
+
+def init_rollups(view_ingest):
+    """Keep rollups current from the buffered view ingestion flush"""
+    if fold_flushed_views not in view_ingest.flush_listeners:
+        view_ingest.on_flush(fold_flushed_views)
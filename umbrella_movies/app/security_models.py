@@ -0,0 +1,242 @@
+"""Lazy, memory-mapped loading of the security ML singletons.
+
+Route modules bind proxies from security_models.lazy(module, name) instead of
+importing the singletons. The proxy resolves on first attribute access or
+call, so a worker that never serves an admin request never builds the models.
+
+With persist=True a proxy first looks for '<name>.joblib' in
+SECURITY_MODEL_DIR. These dumps are written uncompressed by
+'flask security-models persist' and loaded with mmap_mode='r', so their numpy
+arrays stay in the page cache rather than on each worker's heap, and every
+process mapping them shares the same physical pages. Under gunicorn
+preload_app, preload() maps them once in the master before forking. It then
+calls gc.freeze(), so the garbage collector does not touch the inherited
+objects and break copy-on-write.
+
+Unpickling imports each dumped object's class. A class defined in the same
+module that builds the singleton at import time would rebuild it, so
+persisted models need their classes to live apart from the instances.
+"""
+import gc
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def memory_usage():
+    """RSS and PSS of this process in MB; PSS splits shared pages between their users"""
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    usage[key.lower()] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        import resource
+        usage['rss'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return usage
+
+def touch_arrays(obj, depth=4, seen=None):
+    """Read every numpy array reachable from obj, faulting in mapped pages as inference would"""
+    seen = set() if seen is None else seen
+    if depth < 0 or id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if hasattr(obj, 'dtype') and hasattr(obj, 'sum'):
+        obj.sum()
+        return
+    if isinstance(obj, dict):
+        children = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        children = obj
+    else:
+        children = getattr(obj, '__dict__', {}).values()
+    for child in children:
+        touch_arrays(child, depth - 1, seen)
+
+class LazyModel:
+    """Stand-in for a module-level singleton, resolved on first use"""
+
+    def __init__(self, registry, module, name, persist):
+        self._registry = registry
+        self._module = module
+        self._name = name
+        self._persist = persist
+        self._target = None
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            with self._registry._lock:
+                if self._target is None:
+                    self._target = self._registry._load(self)
+                target = self._target
+        return target
+
+    def __getattr__(self, attribute):
+        return getattr(self._resolve(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        state = 'loaded' if self._target is not None else 'not loaded'
+        return f'<LazyModel {self._module}.{self._name} ({state})>'
+
+class SecurityModels:
+    """Flask extension holding the registry of lazily loaded security models"""
+
+    def __init__(self, app=None):
+        self.model_dir = os.environ.get('SECURITY_MODEL_DIR')
+        self._models = []
+        self._lock = threading.RLock()
+        self.load_times = {}
+        # A fork taken while another thread held the lock must not inherit it held
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_lock)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SECURITY_MODEL_DIR', self.model_dir)
+        self.model_dir = app.config['SECURITY_MODEL_DIR']
+        app.extensions['security_models'] = self
+
+    def _reset_lock(self):
+        self._lock = threading.RLock()
+
+    def lazy(self, module, name, persist=False):
+        """Proxy for module.name; persist=True allows loading it from a memory-mapped dump"""
+        model = LazyModel(self, module, name, persist)
+        self._models.append(model)
+        return model
+
+    def dump_path(self, model):
+        return os.path.join(self.model_dir, f'{model._name}.joblib') if self.model_dir else None
+
+    def _load(self, model):
+        started = time.perf_counter()
+        path = self.dump_path(model) if model._persist else None
+        if path and os.path.exists(path):
+            import joblib
+            target, source = joblib.load(path, mmap_mode='r'), 'mmap'
+        else:
+            target, source = getattr(importlib.import_module(model._module), model._name), 'import'
+        elapsed = time.perf_counter() - started
+        self.load_times[model._name] = {'source': source, 'seconds': round(elapsed, 4), 'pid': os.getpid()}
+        logger.info(f"Loaded {model._name} via {source} in {elapsed:.3f}s")
+        return target
+
+    def persist(self):
+        """Build every persistable model and write its uncompressed dump; returns the paths"""
+        import joblib
+
+        if not self.model_dir:
+            raise RuntimeError('SECURITY_MODEL_DIR is not set')
+        os.makedirs(self.model_dir, exist_ok=True)
+        written = []
+        for model in self._models:
+            if not model._persist:
+                continue
+            target = getattr(importlib.import_module(model._module), model._name)
+            path = self.dump_path(model)
+            # compress=0 keeps arrays as raw buffers that mmap_mode can map
+            joblib.dump(target, path + '.tmp', compress=0)
+            os.replace(path + '.tmp', path)
+            written.append(path)
+        return written
+
+    def preload(self):
+        """Resolve every persisted model now, in the process that will fork workers"""
+        for model in self._models:
+            if model._persist:
+                model._resolve()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def benchmark(self, workers=4):
+        """Fork a stand-in master per mode and measure its workers' load time and memory.
+
+        Modes: 'import' builds the models in every worker (the old eager
+        import), 'mmap' maps the dumps in every worker, and 'preload+mmap'
+        maps them once in the master before forking. Linux only.
+        """
+        results = []
+        for mode in ('import', 'mmap', 'preload+mmap'):
+            results.append(self._in_child(lambda: self._benchmark_master(mode, workers)))
+        return results
+
+    def _in_child(self, f):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            try:
+                result = f()
+            except Exception as e:
+                result = {'error': str(e)}
+            with os.fdopen(write, 'w') as out:
+                json.dump(result, out)
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as f_in:
+            data = f_in.read()
+        os.waitpid(pid, 0)
+        return json.loads(data) if data else {'error': 'no result'}
+
+    def _benchmark_master(self, mode, workers):
+        if mode == 'import':
+            self.model_dir = None
+        models = [model for model in self._models if model._persist]
+        result = {'mode': mode, 'master_before': memory_usage()}
+        if mode == 'preload+mmap':
+            started = time.perf_counter()
+            self.preload()
+            result['master_load_seconds'] = round(time.perf_counter() - started, 4)
+        result['master_after'] = memory_usage()
+
+        # Workers stay alive until all have loaded, so PSS reflects the sharing
+        go_read, go_write = os.pipe()
+        children = []
+        for _ in range(workers):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read)
+                os.close(go_write)
+                started = time.perf_counter()
+                for model in models:
+                    touch_arrays(model._resolve())
+                report = {'load_seconds': round(time.perf_counter() - started, 4),
+                          'sources': sorted({times['source'] for times in self.load_times.values()})}
+                os.write(write, b'l')
+                os.read(go_read, 1)
+                report.update(memory_usage())
+                os.write(write, json.dumps(report).encode())
+                os._exit(0)
+            os.close(write)
+            children.append((pid, read))
+        for _, read in children:
+            os.read(read, 1)
+        os.close(go_write)
+        reports = []
+        for pid, read in children:
+            with os.fdopen(read) as f:
+                reports.append(json.loads(f.read()))
+            os.waitpid(pid, 0)
+        result['workers'] = reports
+        return result
+
+    def status(self):
+        return [{
+            'name': model._name,
+            'module': model._module,
+            'persist': model._persist,
+            'loaded': model._target is not None,
+            **self.load_times.get(model._name, {})
+        } for model in self._models]
@@ -0,0 +1,122 @@
+"""Precomputed admin dashboard stats served as a versioned cached document.
+
+One worker at a time rebuilds the dashboard payload in the background. It
+does so every STATS_SNAPSHOT_INTERVAL seconds, or sooner after a relevant
+cache tag is invalidated. The payload is stored in the shared cache with a
+content ETag. Request handlers only read the cached document, so N admins
+polling the dashboard cost the same as one, and If-None-Match polls are
+answered without a database query.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'stats-snapshot'
+STALE_KEY = 'stats-snapshot:stale'
+LOCK_KEY = 'lock:stats-snapshot'
+
+# Invalidating any of these tags schedules an early rebuild
+WATCHED_TAGS = ('movies', 'categories', 'views:day')
+
+class StatsSnapshotService:
+    def __init__(self, app=None):
+        self.app = None
+        self._builder = None
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATS_SNAPSHOT_INTERVAL', 60)
+        app.config.setdefault('STATS_SNAPSHOT_POLL', 2)
+        self.app = app
+        app.extensions['stats_snapshot'] = self
+
+        from app.cache_tags import on_invalidate
+        on_invalidate(self._tag_invalidated)
+
+        @app.before_request
+        def start_stats_snapshot_refresher():
+            self._ensure_refresher()
+
+    def builder(self, f):
+        """Register the function that computes the dashboard payload"""
+        self._builder = f
+        return f
+
+    def mark_stale(self):
+        from app import cache
+        cache.set(STALE_KEY, 1, timeout=0)
+
+    def _tag_invalidated(self, tag):
+        if tag in WATCHED_TAGS:
+            self.mark_stale()
+
+    def rebuild(self):
+        """Recompute and store the snapshot. Returns it, or None if another worker holds the lock."""
+        from app import cache
+        if not cache.add(LOCK_KEY, 1, timeout=60):
+            return None
+        try:
+            cache.delete(STALE_KEY)
+            payload = self._builder()
+            body = json.dumps(payload, sort_keys=True, default=str)
+            snapshot = {
+                'payload': payload,
+                'etag': hashlib.sha1(body.encode()).hexdigest(),
+                'built_at': time.time()
+            }
+            cache.set(SNAPSHOT_KEY, snapshot, timeout=0)
+            return snapshot
+        finally:
+            cache.delete(LOCK_KEY)
+
+    def get(self):
+        """Return the current snapshot, building it inline only on a cold cache"""
+        from app import cache
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot
+        snapshot = self.rebuild()
+        if snapshot is not None:
+            return snapshot
+        # Another worker is building it; wait briefly instead of piling on
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            snapshot = cache.get(SNAPSHOT_KEY)
+            if snapshot is not None:
+                return snapshot
+        raise RuntimeError('Stats snapshot unavailable')
+
+    def _needs_rebuild(self):
+        from app import cache
+        snapshot = cache.get(SNAPSHOT_KEY)
+        if snapshot is None or cache.get(STALE_KEY):
+            return True
+        return time.time() - snapshot['built_at'] >= self.app.config['STATS_SNAPSHOT_INTERVAL']
+
+    def _ensure_refresher(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='stats-snapshot', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['STATS_SNAPSHOT_POLL'])
+            if self._builder is None:
+                continue
+            with self.app.app_context():
+                try:
+                    if self._needs_rebuild():
+                        self.rebuild()
+                except Exception as e:
+                    logger.error(f"Error rebuilding stats snapshot: {str(e)}")
@@ -0,0 +1,366 @@
+"""Incremental storage accounting for uploads and downloaded movie files.
+
+Every file written under UPLOAD_FOLDER or MOVIES_DIRECTORY is recorded as a
+StoredFile row and added to the StorageLedger total for its category, so the
+dashboard reads byte counts instead of walking the upload tree. A periodic
+os.scandir reconciliation corrects drift from files changed outside the app.
+
+Files can be shared (see app.content_store): StoredFile.ref_count counts
+their users and StorageLedger.logical_bytes what they would occupy without
+deduplication. Reference counts only change through UPDATE ... SET
+ref_count = ref_count +/- 1 on the locked row. Releasing the last reference
+leaves the row at zero, and the file is deleted once the transaction
+commits, after re-checking the count under the row lock. A rollback or a
+concurrent upload of the same bytes keeps the file.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from app import db, cache
+from app.models import StoredFile, StorageLedger
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('posters', 'thumbnails', 'actors', 'movies', 'other')
+# The quota covers UPLOAD_FOLDER only; downloaded movie files are reported but not counted
+UPLOAD_CATEGORIES = ('posters', 'thumbnails', 'actors', 'other')
+DEFAULT_QUOTA_BYTES = 5 * 1024 * 1024 * 1024  # 5GB
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+def _roots():
+    roots = {'uploads': current_app.config.get('UPLOAD_FOLDER')}
+    if current_app.config.get('MOVIES_DIRECTORY'):
+        roots['movies'] = current_app.config['MOVIES_DIRECTORY']
+    return {name: os.path.abspath(path) for name, path in roots.items() if path}
+
+def ledger_key(path):
+    """Map an absolute file path to '<root>/<relative path>'"""
+    path = os.path.abspath(path)
+    for name, root in _roots().items():
+        if path.startswith(root + os.sep):
+            return f'{name}/' + os.path.relpath(path, root).replace(os.sep, '/')
+    raise ValueError(f'{path} is outside the managed storage roots')
+
+def _absolute(key):
+    name, _, relative = key.partition('/')
+    return os.path.join(_roots()[name], *relative.split('/'))
+
+def categorize(key):
+    root, _, relative = key.partition('/')
+    if root == 'movies':
+        return 'movies'
+    folder = relative.split('/', 1)[0] if '/' in relative else ''
+    if folder == '':
+        return 'posters'
+    return folder if folder in CATEGORIES else 'other'
+
+def _adjust(category, byte_delta, file_delta, logical_delta=None):
+    logical_delta = byte_delta if logical_delta is None else logical_delta
+    table = StorageLedger.__table__
+    result = db.session.execute(
+        table.update().where(table.c.category == category).values(
+            bytes=table.c.bytes + byte_delta,
+            files=table.c.files + file_delta,
+            logical_bytes=table.c.logical_bytes + logical_delta,
+            updated_at=datetime.utcnow()
+        )
+    )
+    if result.rowcount == 0:
+        db.session.add(StorageLedger(category=category, bytes=byte_delta, files=file_delta,
+                                     logical_bytes=logical_delta))
+
+def record_file_added(path, size=None):
+    """Account for a file written to disk. The caller commits the session."""
+    key = ledger_key(path)
+    size = os.path.getsize(path) if size is None else size
+    entry = StoredFile.query.filter_by(path=key).first()
+    if entry:
+        _adjust(entry.category, size - entry.size, 0, (size - entry.size) * entry.ref_count)
+        entry.size = size
+    else:
+        category = categorize(key)
+        db.session.add(StoredFile(path=key, category=category, size=size, ref_count=1))
+        _adjust(category, size, 1)
+
+def record_file_removed(path):
+    """Account for a file deleted from disk. The caller commits the session."""
+    entry = StoredFile.query.filter_by(path=ledger_key(path)).first()
+    if entry:
+        _adjust(entry.category, -entry.size, -1, -entry.size * entry.ref_count)
+        db.session.delete(entry)
+
+def _locked_entry(key):
+    """(id, category, size, ref_count) of a StoredFile row, locked until the transaction ends"""
+    return db.session.query(StoredFile.id, StoredFile.category, StoredFile.size, StoredFile.ref_count)\
+        .filter(StoredFile.path == key).with_for_update().first()
+
+def _change_references(entry_id, delta):
+    table = StoredFile.__table__
+    db.session.execute(table.update().where(table.c.id == entry_id)
+                       .values(ref_count=table.c.ref_count + delta))
+
+def add_reference(path, size=None):
+    """Record a new file, or one more user of a file already on record. The caller commits."""
+    key = ledger_key(path)
+    entry = _locked_entry(key)
+    if entry is None:
+        record_file_added(path, size)
+        return 1
+    _change_references(entry.id, 1)
+    if entry.ref_count == 0:
+        # Released by its last owner but not yet deleted; it is stored again
+        _adjust(entry.category, entry.size, 1)
+    else:
+        _adjust(entry.category, 0, 0, entry.size)
+    return entry.ref_count + 1
+
+def reference_count(path):
+    """How many owners the ledger records for a file; 0 if it is not on record"""
+    count = db.session.query(StoredFile.ref_count).filter(StoredFile.path == ledger_key(path)).scalar()
+    return count or 0
+
+def release_file(path):
+    """Drop one reference; the file is deleted after commit once nothing uses it.
+
+    Returns True if this was the last reference. The caller commits.
+    """
+    entry = _locked_entry(ledger_key(path))
+    if entry is not None and entry.ref_count > 1:
+        _change_references(entry.id, -1)
+        _adjust(entry.category, 0, 0, -entry.size)
+        return False
+    if entry is not None and entry.ref_count == 1:
+        _change_references(entry.id, -1)
+        _adjust(entry.category, -entry.size, -1)
+    db.session.info.setdefault('storage_unlinks', set()).add(os.path.abspath(path))
+    return True
+
+def remove_unreferenced(paths):
+    """Delete each file whose StoredFile row is gone or at zero references, with the row locked.
+
+    Runs in its own transaction, so an upload re-referencing the file either
+    commits first (and the file stays) or waits for the row to be deleted
+    and writes the file again.
+    """
+    table = StoredFile.__table__
+    removed = 0
+    with db.engine.begin() as connection:
+        for path in paths:
+            row = connection.execute(db.select(table.c.id, table.c.ref_count)
+                                     .where(table.c.path == ledger_key(path)).with_for_update()).first()
+            if row is not None and row.ref_count > 0:
+                continue
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+            except OSError as e:
+                logger.error(f"Error deleting {path}: {str(e)}")
+                continue
+            if row is not None:
+                connection.execute(table.delete().where(table.c.id == row.id))
+    return removed
+
+@event.listens_for(Session, 'after_commit')
+def _unlink_released_files(session):
+    paths = session.info.pop('storage_unlinks', None)
+    if paths:
+        try:
+            remove_unreferenced(sorted(paths))
+        except Exception as e:
+            # The rows stay at zero references; reconciliation retries them
+            logger.error(f"Error deleting released files: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_rolled_back_files(session):
+    session.info.pop('storage_unlinks', None)
+
+def storage_totals():
+    """Return {category: {'bytes': n, 'files': n, 'logical_bytes': n}}"""
+    totals = {category: {'bytes': 0, 'files': 0, 'logical_bytes': 0} for category in CATEGORIES}
+    for row in StorageLedger.query:
+        totals[row.category] = {'bytes': row.bytes, 'files': row.files, 'logical_bytes': row.logical_bytes}
+    return totals
+
+def dedup_stats():
+    """Physical vs. logical bytes across all categories"""
+    physical, logical = db.session.query(
+        func.coalesce(func.sum(StorageLedger.bytes), 0),
+        func.coalesce(func.sum(StorageLedger.logical_bytes), 0)
+    ).one()
+    return {
+        'physical_bytes': int(physical),
+        'logical_bytes': int(logical),
+        'dedup_ratio': round(logical / physical, 3) if physical else 1.0
+    }
+
+def total_bytes(categories=UPLOAD_CATEGORIES):
+    """Physical bytes in the given categories; upload categories by default"""
+    return int(db.session.query(func.coalesce(func.sum(StorageLedger.bytes), 0))
+               .filter(StorageLedger.category.in_(categories)).scalar())
+
+def quota_bytes():
+    return current_app.config.get('STORAGE_QUOTA_BYTES', DEFAULT_QUOTA_BYTES)
+
+def storage_percentage(used=None):
+    used = total_bytes() if used is None else used
+    return min(used / quota_bytes() * 100, 100)
+
+def check_quota(additional_bytes):
+    """Raise StorageQuotaExceeded if writing additional_bytes would pass the upload quota"""
+    if total_bytes() + (additional_bytes or 0) > quota_bytes():
+        raise StorageQuotaExceeded('Storage quota exceeded')
+
+# Reconciliation
+def _scan(root):
+    """Yield (absolute path, size) for every regular file below root"""
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue  # in-progress uploads and other hidden files
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+
+def _insert_found(rows):
+    """Insert StoredFile rows for files found on disk, skipping paths an upload recorded meanwhile"""
+    from sqlalchemy.exc import IntegrityError
+
+    table = StoredFile.__table__
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert(), rows)
+        return len(rows)
+    except IntegrityError:
+        pass
+    inserted = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), [row])
+            inserted += 1
+        except IntegrityError:
+            continue
+    return inserted
+
+def reconcile_storage():
+    """Bring StoredFile and StorageLedger in line with what is on disk.
+
+    Runs next to live uploads. Only rows created before the scan started can
+    be dropped for a missing file, rows already on record keep their
+    ref_count, and ledger rows are corrected in place under a row lock.
+    """
+    scan_started = datetime.utcnow()
+    on_disk = {}
+    for name, root in _roots().items():
+        for path, size in _scan(root):
+            on_disk[f'{name}/' + os.path.relpath(path, root).replace(os.sep, '/')] = size
+
+    known = {path: (id, size, created_at) for id, path, size, created_at in
+             db.session.query(StoredFile.id, StoredFile.path, StoredFile.size, StoredFile.created_at)}
+
+    added = [key for key in on_disk if key not in known]
+    # A row created after the scan started belongs to a file the scan may have missed
+    removed = [known[key][0] for key in known
+               if key not in on_disk and known[key][2] is not None and known[key][2] < scan_started]
+    resized = [{'id': known[key][0], 'size': size} for key, size in on_disk.items()
+               if key in known and known[key][1] != size]
+
+    inserted = 0
+    for start in range(0, len(added), 1000):
+        inserted += _insert_found([
+            {'path': key, 'category': categorize(key), 'size': on_disk[key], 'ref_count': 1,
+             'created_at': datetime.utcnow()} for key in added[start:start + 1000]
+        ])
+    if removed:
+        for start in range(0, len(removed), 1000):
+            StoredFile.query.filter(StoredFile.id.in_(removed[start:start + 1000]))\
+                .delete(synchronize_session=False)
+    if resized:
+        db.session.execute(db.update(StoredFile), resized)
+
+    # Lock the ledger rows before summing, so an upload's _adjust either
+    # committed before the sums are read or applies its delta on top of them
+    ledger = {row.category: row for row in StorageLedger.query.with_for_update()}
+    # Rows at zero references are released files waiting for deletion
+    totals = dict((category, (bytes_, files, logical)) for category, bytes_, files, logical in db.session.query(
+        StoredFile.category, func.sum(StoredFile.size), func.count(StoredFile.id),
+        func.sum(StoredFile.size * StoredFile.ref_count)
+    ).filter(StoredFile.ref_count > 0).group_by(StoredFile.category))
+    table = StorageLedger.__table__
+    for category in set(CATEGORIES) | set(totals):
+        bytes_, files, logical = totals.get(category, (0, 0, 0))
+        values = {'bytes': int(bytes_ or 0), 'files': files, 'logical_bytes': int(logical or 0)}
+        row = ledger.get(category)
+        if row is None:
+            db.session.add(StorageLedger(category=category, **values))
+        elif (row.bytes, row.files, row.logical_bytes) != (values['bytes'], values['files'], values['logical_bytes']):
+            db.session.execute(table.update().where(table.c.category == category)
+                               .values(updated_at=datetime.utcnow(), **values))
+    db.session.commit()
+
+    # Files whose deletion after commit failed or never ran
+    released = [_absolute(key) for (key,) in db.session.query(StoredFile.path).filter(StoredFile.ref_count == 0)]
+    db.session.commit()
+    unlinked = remove_unreferenced(released) if released else 0
+    return {'added': inserted, 'removed': len(removed), 'resized': len(resized), 'unlinked': unlinked}
+
+class StorageReconciler:
+    """Runs reconcile_storage in a background thread of each worker.
+
+    A cache lock ensures only one worker reconciles per interval.
+    """
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self):
+        if not self.interval:
+            return
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='storage-reconciler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                if not cache.add('lock:storage-reconcile', 1, timeout=self.interval):
+                    continue
+                try:
+                    result = reconcile_storage()
+                    if any(result.values()):
+                        logger.info(f"Storage reconciliation corrected drift: {result}")
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Error reconciling storage: {str(e)}")
+
+def init_storage_ledger(app):
+    reconciler = StorageReconciler(app, app.config.get('STORAGE_RECONCILE_INTERVAL', 3600))
+    app.extensions['storage_reconciler'] = reconciler
+
+    @app.before_request
+    def start_storage_reconciler():
+        reconciler.ensure_running()
@@ -1,7 +1,13 @@
-from flask import Blueprint, render_template, jsonify, request, current_app
+from flask import Blueprint, render_template, jsonify, request, current_app, Response, url_for
 from flask_login import login_required, current_user
-from app.models import Movie, User, Review, Category, MovieView, Rating
-from app import db, cache, limiter, csrf
+from app.models import Movie, User, Review, Category, MovieView, Rating, BackgroundJob, rebuild_rating_aggregates
+from app.rollups import daily_view_totals, subtract_views
+from app.storage_ledger import total_bytes, storage_percentage, dedup_stats, StorageQuotaExceeded
+from app import db, cache, limiter, csrf, stats_snapshot, event_stream, jobs, image_pipeline
+from app.image_pipeline import delete_variants
+from app.content_store import store_upload, release_upload
+from app.cache_tags import tagged_memoize, tag_stats
+from app.user_cache import invalidate_user_cache
 from datetime import datetime, timedelta
 from functools import wraps
 import os
@@ -24,86 +30,67 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Cache storage calculation
-@cache.memoize(timeout=300)  # Cache for 5 minutes
+# Storage totals come from the incrementally maintained ledger
 def calculate_storage_usage():
     try:
-        total_size = 0
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        for dirpath, dirnames, filenames in os.walk(upload_folder):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if os.path.exists(fp):
-                    total_size += os.path.getsize(fp)
-        return total_size
+        return total_bytes()
     except Exception as e:
         current_app.logger.error(f"Error calculating storage: {str(e)}")
         return 0
 
 # Cache daily views data
-@cache.memoize(timeout=300)
+@tagged_memoize('views:day', timeout=300)
 def get_daily_views_data():
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=6)
-        dates = []
-        data = []
-        
-        current_date = start_date
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            dates.append(date_str)
-            
-            day_start = current_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = current_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            view_count = MovieView.query.filter(
-                MovieView.viewed_at.between(day_start, day_end)
-            ).count()
-            
-            data.append(view_count)
-            current_date += timedelta(days=1)
-        
+        totals = daily_view_totals(days=7)
         return {
-            'labels': dates,
-            'data': data
+            'labels': [day.strftime('%Y-%m-%d') for day, _ in totals],
+            'data': [views for _, views in totals]
         }
     except Exception as e:
         current_app.logger.error(f"Error getting daily views: {str(e)}")
         return {'labels': [], 'data': []}
 
 # Cache categories data
-@cache.memoize(timeout=300)
+@tagged_memoize('categories', 'movies', timeout=300)
 def get_categories_data():
     try:
-        categories = Category.query.all()
+        categories = db.session.query(Category.name, Category.movie_count).order_by(Category.name).all()
         return {
-            'labels': [cat.name for cat in categories],
-            'data': [cat.movies.count() for cat in categories]
+            'labels': [name for name, _ in categories],
+            'data': [movie_count for _, movie_count in categories]
         }
     except Exception as e:
         current_app.logger.error(f"Error getting categories data: {str(e)}")
         return {'labels': [], 'data': []}
 
+# Dashboard stats are rebuilt in the background and served from one cached snapshot
+@stats_snapshot.builder
+def build_dashboard_stats():
+    storage_used = calculate_storage_usage()
+    return {
+        'total_movies': Movie.query.count(),
+        'new_movies_today': Movie.query.filter(Movie.created_at >= datetime.today()).count(),
+        'total_users': User.query.count(),
+        'new_users_today': User.query.filter(User.created_at >= datetime.today()).count(),
+        'total_reviews': Review.query.count(),
+        'pending_reviews': Review.query.filter_by(status='pending').count(),
+        'storage_used': storage_used,
+        'storage_percentage': storage_percentage(storage_used),
+        'storage_dedup_ratio': dedup_stats()['dedup_ratio'],
+        'chart_data': {
+            'views': get_daily_views_data(),
+            'categories': get_categories_data()
+        }
+    }
+
 @bp.route('/dashboard')
 @login_required
 @admin_required
 def dashboard():
     try:
-        stats = {
-            'total_movies': Movie.query.count(),
-            'new_movies_today': Movie.query.filter(Movie.created_at >= datetime.today()).count(),
-            'total_users': User.query.count(),
-            'new_users_today': User.query.filter(User.created_at >= datetime.today()).count(),
-            'total_reviews': Review.query.count(),
-            'pending_reviews': Review.query.filter_by(status='pending').count(),
-            'storage_used': calculate_storage_usage(),
-            'storage_percentage': min(calculate_storage_usage() / (5 * 1024 * 1024 * 1024) * 100, 100)  # 5GB limit
-        }
-        
-        chart_data = {
-            'views': get_daily_views_data(),
-            'categories': get_categories_data()
-        }
+        stats = dict(stats_snapshot.get()['payload'])
+        chart_data = stats.pop('chart_data')
         
         recent_movies = Movie.query.order_by(Movie.created_at.desc()).limit(5).all()
         
@@ -120,25 +107,43 @@ def dashboard():
 @admin_required
 def get_stats():
     try:
-        stats = {
-            'total_movies': Movie.query.count(),
-            'new_movies_today': Movie.query.filter(Movie.created_at >= datetime.today()).count(),
-            'total_users': User.query.count(),
-            'new_users_today': User.query.filter(User.created_at >= datetime.today()).count(),
-            'total_reviews': Review.query.count(),
-            'pending_reviews': Review.query.filter_by(status='pending').count(),
-            'storage_used': calculate_storage_usage(),
-            'storage_percentage': min(calculate_storage_usage() / (5 * 1024 * 1024 * 1024) * 100, 100),
-            'chart_data': {
-                'views': get_daily_views_data(),
-                'categories': get_categories_data()
-            }
-        }
-        return jsonify(stats)
+        snapshot = stats_snapshot.get()
+        # Pollers revalidate with If-None-Match and get a bodiless 304 until the snapshot changes
+        if request.if_none_match.contains(snapshot['etag']):
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify(snapshot['payload'])
+        response.set_etag(snapshot['etag'])
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         current_app.logger.error(f"Error getting stats: {str(e)}")
         return jsonify({'error': 'Failed to get stats'}), 500
 
+# Pushed to /api/events subscribers as field-level deltas of the snapshot
+@event_stream.source('stats', interval=2)
+def stream_dashboard_stats():
+    return {'dashboard': stats_snapshot.get()['payload']}
+
+@bp.route('/api/events')
+@login_required
+@admin_required
+def stream_events():
+    # The generator only waits on an in-process queue, so with gthread workers
+    # each open stream costs one thread rather than a whole worker
+    return Response(event_stream.stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/api/cache/tags')
+@login_required
+@admin_required
+def get_cache_tag_stats():
+    # Per-tag hit/miss/invalidation counters for this worker
+    return jsonify(tag_stats())
+
 @bp.route('/api/movies/<int:movie_id>', methods=['DELETE'])
 @login_required
 @admin_required
@@ -146,21 +151,16 @@ def delete_movie(movie_id):
     try:
         movie = Movie.query.get_or_404(movie_id)
         
-        # Delete associated files
-        if movie.poster_url:
-            poster_path = os.path.join(current_app.config['UPLOAD_FOLDER'], movie.poster_url)
-            if os.path.exists(poster_path):
-                os.remove(poster_path)
-        
-        # Delete associated reviews and ratings
-        Review.query.filter_by(movie_id=movie.id).delete()
-        Rating.query.filter_by(movie_id=movie.id).delete()
-        MovieView.query.filter_by(movie_id=movie.id).delete()
-        
-        db.session.delete(movie)
+        # Hide the movie now; dependents, files and rollups are purged in the background
+        movie.is_hidden = True
         db.session.commit()
+        job = jobs.submit('purge_movie', created_by=current_user.id, movie_id=movie.id)
         
-        return jsonify({'success': True})
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': url_for('admin.get_job', job_id=job.id)
+        }), 202
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error deleting movie: {str(e)}")
@@ -173,6 +173,8 @@ def edit_movie(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     if request.method == 'POST':
         try:
+            # Locked so a variant job finishing meanwhile cannot record for the old poster
+            movie = Movie.query.filter_by(id=movie_id).with_for_update().populate_existing().first_or_404()
             form_data = request.form
             movie.title = form_data.get('title')
             movie.description = form_data.get('description')
@@ -181,24 +183,29 @@ def edit_movie(movie_id):
             movie.category_id = int(form_data.get('category'))
             
             # Handle poster upload
+            new_poster = None
             if 'poster' in request.files:
                 file = request.files['poster']
                 if file and allowed_file(file.filename):
-                    # Delete old poster if exists
-                    if movie.poster_url:
-                        old_poster = os.path.join(current_app.config['UPLOAD_FOLDER'], movie.poster_url)
-                        if os.path.exists(old_poster):
-                            os.remove(old_poster)
+                    # Save new poster; identical posters share one stored copy
+                    filename, _, _ = store_upload(file, 'posters')
                     
-                    # Save new poster
-                    filename = secure_filename(file.filename)
-                    file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+                    # Release the old poster and its variants; shared files stay until unreferenced
+                    delete_variants(movie.image_variants)
+                    movie.image_variants = None
+                    if movie.poster_url:
+                        release_upload(movie.poster_url)
                     movie.poster_url = filename
+                    new_poster = filename
             
             db.session.commit()
+            if new_poster:
+                image_pipeline.submit(new_poster, target=movie)
             return jsonify({'success': True})
         except RequestEntityTooLarge:
             return jsonify({'error': 'File size exceeded'}), 413
+        except StorageQuotaExceeded:
+            return jsonify({'error': 'Storage quota exceeded'}), 507
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Error editing movie: {str(e)}")
@@ -215,7 +222,7 @@ def allowed_file(filename):
 @admin_required
 def list_categories():
     try:
-        categories = Category.query.all()
+        categories = Category.query.order_by(Category.name).all()
         return render_template('admin/categories.html', categories=categories)
     except Exception as e:
         current_app.logger.error(f"Error listing categories: {str(e)}")
@@ -247,7 +254,7 @@ def create_category():
                 'id': category.id,
                 'name': category.name,
                 'description': category.description,
-                'movie_count': category.movies.count()
+                'movie_count': category.movie_count
             }
         })
     except Exception as e:
@@ -263,8 +270,9 @@ def manage_category(category_id):
     
     if request.method == 'DELETE':
         try:
-            # Check if category has movies
-            if category.movies.count() > 0:
+            # Ask the movie table itself: movie_count is a display counter that can
+            # drift, and hidden movies still reference the category
+            if db.session.query(Movie.query.filter_by(category_id=category.id).exists()).scalar():
                 return jsonify({'error': 'Cannot delete category with associated movies'}), 400
                 
             db.session.delete(category)
@@ -298,7 +306,7 @@ def manage_category(category_id):
                     'id': category.id,
                     'name': category.name,
                     'description': category.description,
-                    'movie_count': category.movies.count()
+                    'movie_count': category.movie_count
                 }
             })
         except Exception as e:
@@ -331,12 +339,17 @@ def manage_user(user_id):
     if request.method == 'DELETE':
         try:
             # Delete user's reviews and ratings
+            rated_movie_ids = [movie_id for (movie_id,) in
+                               db.session.query(Rating.movie_id).filter_by(user_id=user.id)]
             Review.query.filter_by(user_id=user.id).delete()
             Rating.query.filter_by(user_id=user.id).delete()
+            subtract_views(MovieView.user_id == user.id)
             MovieView.query.filter_by(user_id=user.id).delete()
+            rebuild_rating_aggregates(rated_movie_ids)
             
             db.session.delete(user)
             db.session.commit()
+            invalidate_user_cache(user_id)
             return jsonify({'success': True})
         except Exception as e:
             db.session.rollback()
@@ -358,6 +371,7 @@ def manage_user(user_id):
                 user.is_admin = bool(data['is_admin'])
                 
             db.session.commit()
+            invalidate_user_cache(user.id)
             return jsonify({
                 'success': True,
                 'user': {
@@ -390,6 +404,15 @@ def bulk_user_action():
         if current_user.id in user_ids:
             return jsonify({'error': 'Cannot modify your own account'}), 400
         
+        if action == 'delete':
+            # Runs as a chunked background job; poll the returned job for progress
+            job = jobs.submit('purge_users', created_by=current_user.id, user_ids=list(user_ids))
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': url_for('admin.get_job', job_id=job.id)
+            }), 202
+        
         users = User.query.filter(User.id.in_(user_ids)).all()
         
         if action == 'activate':
@@ -398,18 +421,35 @@ def bulk_user_action():
         elif action == 'deactivate':
             for user in users:
                 user.is_active = False
-        elif action == 'delete':
-            for user in users:
-                Review.query.filter_by(user_id=user.id).delete()
-                Rating.query.filter_by(user_id=user.id).delete()
-                MovieView.query.filter_by(user_id=user.id).delete()
-                db.session.delete(user)
         else:
             return jsonify({'error': 'Invalid action'}), 400
             
         db.session.commit()
+        invalidate_user_cache(*[user.id for user in users])
         return jsonify({'success': True, 'affected_users': len(users)})
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error performing bulk user action: {str(e)}")
-        return jsonify({'error': 'Failed to perform bulk user action'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to perform bulk user action'}), 500
+
+@bp.route('/api/jobs/<job_id>')
+@login_required
+@admin_required
+def get_job(job_id):
+    job = BackgroundJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@bp.route('/api/jobs/<job_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_job(job_id):
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.status != 'failed':
+        return jsonify({'error': 'Only failed jobs can be retried'}), 400
+    try:
+        jobs.resume(job)
+        return jsonify(job.to_dict()), 202
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error retrying job: {str(e)}")
+        return jsonify({'error': 'Failed to retry job'}), 500
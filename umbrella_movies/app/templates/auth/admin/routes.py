@@ -1,43 +1,51 @@
-from flask import render_template, request, jsonify, current_app, flash, redirect, url_for
+from flask import render_template, request, jsonify, current_app, flash, redirect, url_for, g, abort
 from flask_login import login_required, current_user
 from umbrella_movies.app.admin import bp
-from umbrella_movies.app.models import Movie, Category, Review, Rating, MovieView, User, UserActivity, LoginAttempt, Permission, db, BlacklistedIP, SecurityAudit, SiteCustomization, Actor
+from umbrella_movies.app.models import Movie, Category, Review, Rating, MovieView, User, UserActivity, LoginAttempt, Permission, db, BlacklistedIP, SecurityAudit, SiteCustomization, Actor, get_security_event_types
 from umbrella_movies.app.decorators import admin_required, moderator_required
+from umbrella_movies.app.rollups import daily_view_totals, total_view_count, popular_movies
+from umbrella_movies.app.user_cache import invalidate_user_cache
+from umbrella_movies.app import event_stream, jobs, image_pipeline, threat_scoring, explanations, health_probes, metrics, profiler
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, tuple_
 import os
 import uuid
-import time
-import shutil
-import re
 import csv
 from io import StringIO
-from flask import Response
+from flask import Response, stream_with_context
 import json
-from umbrella_movies.app.security.monitoring import security_monitor, content_monitor, api_monitor
-from umbrella_movies.app.security.ml_monitoring import ml_monitor
-from umbrella_movies.app.security.advanced_ml import advanced_ml
-from umbrella_movies.app.security.specialized_ml import specialized_ml
-from umbrella_movies.app.security.enhanced_security import (
-    enhanced_models, enhanced_features, enhanced_explainer,
-    enhanced_optimizer, enhanced_response, enhanced_monitoring,
-    admin_security_monitor
-)
-import numpy as np
-from umbrella_movies.app.security.admin_protection import (
-    verify_admin_session,
-    check_admin_privileges,
-    log_admin_action,
-    detect_privilege_escalation,
-    monitor_admin_behavior
-)
-import psutil
+import zlib
+from umbrella_movies.app import security_models
+
+# Resolved on first use, so workers do not build the ML models at import time;
+# persist=True ones load from memory-mapped dumps when SECURITY_MODEL_DIR has them
+security_monitor = security_models.lazy('umbrella_movies.app.security.monitoring', 'security_monitor')
+content_monitor = security_models.lazy('umbrella_movies.app.security.monitoring', 'content_monitor')
+api_monitor = security_models.lazy('umbrella_movies.app.security.monitoring', 'api_monitor')
+ml_monitor = security_models.lazy('umbrella_movies.app.security.ml_monitoring', 'ml_monitor', persist=True)
+advanced_ml = security_models.lazy('umbrella_movies.app.security.advanced_ml', 'advanced_ml', persist=True)
+specialized_ml = security_models.lazy('umbrella_movies.app.security.specialized_ml', 'specialized_ml', persist=True)
+enhanced_models = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_models', persist=True)
+enhanced_explainer = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_explainer', persist=True)
+enhanced_features = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_features')
+enhanced_optimizer = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_optimizer')
+enhanced_response = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_response')
+enhanced_monitoring = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'enhanced_monitoring')
+admin_security_monitor = security_models.lazy('umbrella_movies.app.security.enhanced_security', 'admin_security_monitor')
+verify_admin_session = security_models.lazy('umbrella_movies.app.security.admin_protection', 'verify_admin_session')
+check_admin_privileges = security_models.lazy('umbrella_movies.app.security.admin_protection', 'check_admin_privileges')
+log_admin_action = security_models.lazy('umbrella_movies.app.security.admin_protection', 'log_admin_action')
+detect_privilege_escalation = security_models.lazy('umbrella_movies.app.security.admin_protection', 'detect_privilege_escalation')
+monitor_admin_behavior = security_models.lazy('umbrella_movies.app.security.admin_protection', 'monitor_admin_behavior')
 
 from .download_manager import download_manager
 from .download_analytics import download_analytics
 from .download_scheduler import download_scheduler
-from .upload_handler import save_uploaded_file, delete_uploaded_file, get_file_url
+from .upload_handler import save_uploaded_file, delete_uploaded_file, get_file_url, UPLOAD_SUBFOLDERS
+from umbrella_movies.app.content_store import store_upload
+from umbrella_movies.app.ip_blocklist import parse_network, import_networks
+from umbrella_movies.app.storage_ledger import storage_percentage, StorageQuotaExceeded
 
 @bp.route('/downloads/start', methods=['POST'])
 @login_required
@@ -80,6 +88,14 @@ def get_all_downloads():
     """Get status of all downloads"""
     return jsonify(download_manager.get_all_downloads())
 
+@event_stream.source('download', interval=1)
+def stream_download_progress():
+    """Per-task download progress for the admin event stream"""
+    downloads = download_manager.get_all_downloads()
+    if isinstance(downloads, dict):
+        return downloads
+    return {task['task_id']: task for task in downloads}
+
 @bp.route('/downloads/cancel/<task_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -234,6 +250,7 @@ def get_speed_analysis():
 @admin_required
 def get_system_health():
     """Get system health metrics"""
+    import psutil
     try:
         # Get disk usage
         movies_dir = Path(current_app.config['MOVIES_DIRECTORY'])
@@ -318,6 +335,7 @@ def cleanup_downloads():
 @admin_required
 def optimize_downloads():
     """Optimize download queue and settings"""
+    import psutil
     try:
         # Get system resources
         memory = psutil.virtual_memory()
@@ -696,6 +714,8 @@ def upload_image():
             })
         
         return jsonify({'error': 'Invalid file type'}), 400
+    except StorageQuotaExceeded:
+        return jsonify({'error': 'Storage quota exceeded'}), 507
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -791,128 +811,231 @@ def delete_review(movie_id, review_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+ADMIN_THREAT_TYPES = ['session_hijacking', 'privilege_escalation', 'unauthorized_access']
+
+def admin_request_features():
+    """Enhanced features for this request, extracted once and shared by every check"""
+    if 'admin_features' not in g:
+        g.admin_features = enhanced_features.extract_enhanced_features(
+            request,
+            current_user.id if current_user.is_authenticated else None,
+            admin_context=True
+        )
+    return g.admin_features
+
+@threat_scoring.model
+def admin_threat_model():
+    return enhanced_models.admin_threat_model
+
+@threat_scoring.on_scores
+def handle_admin_threat_scores(context, admin_threats):
+    """Act on full-model scores once the request's batch has been scored"""
+    if any(score > 0.7 for score in admin_threats):
+        threat_type = ADMIN_THREAT_TYPES[max(range(len(admin_threats)), key=lambda i: admin_threats[i])]
+        enhanced_monitoring.track_threat(f'admin_{threat_type}', 'critical')
+        enhanced_response.execute_response(f'admin_{threat_type}', 'critical', {
+            'user_id': context['user_id'],
+            'features': context['features']
+        })
+        
+    # Log suspicious admin activity now; the explanation is attached to the
+    # audit row later by the explanations worker
+    if any(score > 0.5 for score in admin_threats):
+        threat_scores = dict(zip(ADMIN_THREAT_TYPES, (float(score) for score in admin_threats)))
+        audit = SecurityAudit.log(
+            'suspicious_admin_activity',
+            user_id=context['user_id'],
+            ip_address=context['ip_address'],
+            user_agent=context['user_agent'],
+            details={
+                'endpoint': context['endpoint'],
+                'threat_scores': threat_scores,
+                'explanation': None
+            },
+            severity='high'
+        )
+        
+        admin_security_monitor.log_security_event(
+            'suspicious_admin_activity',
+            {
+                'user_id': context['user_id'],
+                'features': context['features'],
+                'audit_id': audit.id,
+                'threat_scores': threat_scores
+            },
+            severity='high'
+        )
+        explanations.submit(audit.id, context['vector'], context['features'], max(admin_threats))
+
+@explanations.explainer
+def explain_admin_threat(features, score):
+    return enhanced_explainer.explain_prediction(enhanced_models.admin_threat_model, features, score)
+
 def admin_required(f):
     """Enhanced admin decorator with security checks"""
     @login_required
     def decorated_function(*args, **kwargs):
+        with threat_scoring.timed():
+            start_time = datetime.utcnow()
+            
+            features = admin_request_features()
+            
+            # Verify admin session
+            if not verify_admin_session(current_user, features):
+                enhanced_monitoring.track_threat('unauthorized_admin_access', 'critical')
+                enhanced_response.execute_response('unauthorized_admin_access', 'critical', {
+                    'user_id': current_user.id,
+                    'features': features
+                })
+                abort(403)
+                
+            # Check admin privileges
+            if not check_admin_privileges(current_user, request.endpoint):
+                enhanced_monitoring.track_threat('privilege_escalation', 'critical')
+                enhanced_response.execute_response('privilege_escalation', 'critical', {
+                    'user_id': current_user.id,
+                    'endpoint': request.endpoint,
+                    'features': features
+                })
+                abort(403)
+                
+            # Monitor admin behavior
+            behavior_score = monitor_admin_behavior(current_user, request, features)
+            if behavior_score > 0.7:
+                enhanced_monitoring.track_threat('suspicious_admin_behavior', 'high')
+                enhanced_response.execute_response('suspicious_admin_behavior', 'high', {
+                    'user_id': current_user.id,
+                    'behavior_score': behavior_score,
+                    'features': features
+                })
+                
+            # Track admin action
+            log_admin_action(current_user, request, features)
+            
+            # Track metrics
+            enhanced_monitoring.track_request(
+                request,
+                (datetime.utcnow() - start_time).total_seconds(),
+                admin_context=True
+            )
+        
+        return f(*args, **kwargs)
+    return decorated_function
+
+@bp.before_request
+def before_request():
+    """Security checks before processing any admin request"""
+    if not current_user.is_authenticated:
+        return
+        
+    with threat_scoring.timed():
         start_time = datetime.utcnow()
         
-        # Extract enhanced features
-        features = enhanced_features.extract_enhanced_features(
-            request,
-            current_user.id if current_user.is_authenticated else None,
-            admin_context=True
-        )
+        features = admin_request_features()
         
-        # Verify admin session
-        if not verify_admin_session(current_user, features):
-            enhanced_monitoring.track_threat('unauthorized_admin_access', 'critical')
-            enhanced_response.execute_response('unauthorized_admin_access', 'critical', {
+        # Check for privilege escalation attempts
+        if detect_privilege_escalation(current_user, request, features):
+            enhanced_monitoring.track_threat('privilege_escalation_attempt', 'critical')
+            enhanced_response.execute_response('privilege_escalation_attempt', 'critical', {
                 'user_id': current_user.id,
                 'features': features
             })
             abort(403)
             
-        # Check admin privileges
-        if not check_admin_privileges(current_user, request.endpoint):
-            enhanced_monitoring.track_threat('privilege_escalation', 'critical')
-            enhanced_response.execute_response('privilege_escalation', 'critical', {
+        # Only the fast-path model runs here; the full model scores this request
+        # in the next batch and handle_admin_threat_scores acts on the result
+        vector = list(features['admin_features'].values())
+        admin_threats = threat_scoring.score(vector, {
+            'user_id': current_user.id,
+            'endpoint': request.endpoint,
+            'ip_address': request.remote_addr,
+            'user_agent': request.user_agent.string,
+            'vector': vector,
+            'features': features
+        })
+        
+        if admin_threats is not None and any(score > 0.7 for score in admin_threats):
+            threat_type = ADMIN_THREAT_TYPES[max(range(len(admin_threats)), key=lambda i: admin_threats[i])]
+            enhanced_monitoring.track_threat(f'admin_{threat_type}', 'critical')
+            enhanced_response.execute_response(f'admin_{threat_type}', 'critical', {
                 'user_id': current_user.id,
-                'endpoint': request.endpoint,
                 'features': features
             })
             abort(403)
             
-        # Monitor admin behavior
-        behavior_score = monitor_admin_behavior(current_user, request, features)
-        if behavior_score > 0.7:
-            enhanced_monitoring.track_threat('suspicious_admin_behavior', 'high')
-            enhanced_response.execute_response('suspicious_admin_behavior', 'high', {
-                'user_id': current_user.id,
-                'behavior_score': behavior_score,
-                'features': features
-            })
-            
-        # Track admin action
-        log_admin_action(current_user, request, features)
-        
         # Track metrics
         enhanced_monitoring.track_request(
             request,
             (datetime.utcnow() - start_time).total_seconds(),
             admin_context=True
         )
-        
-        return f(*args, **kwargs)
-    return decorated_function
 
-@bp.before_request
-def before_request():
-    """Security checks before processing any admin request"""
-    if not current_user.is_authenticated:
-        return
-        
-    start_time = datetime.utcnow()
-    
-    # Extract enhanced features
-    features = enhanced_features.extract_enhanced_features(
-        request,
-        current_user.id,
-        admin_context=True
-    )
-    
-    # Check for privilege escalation attempts
-    if detect_privilege_escalation(current_user, request, features):
-        enhanced_monitoring.track_threat('privilege_escalation_attempt', 'critical')
-        enhanced_response.execute_response('privilege_escalation_attempt', 'critical', {
-            'user_id': current_user.id,
-            'features': features
-        })
-        abort(403)
-        
-    # Advanced threat detection for admin panel
-    admin_threats = enhanced_models.admin_threat_model.predict_proba(
-        [list(features['admin_features'].values())]
-    )[0]
-    
-    if any(score > 0.7 for score in admin_threats):
-        threat_type = ['session_hijacking', 'privilege_escalation', 'unauthorized_access'][
-            np.argmax(admin_threats)
-        ]
-        enhanced_monitoring.track_threat(f'admin_{threat_type}', 'critical')
-        enhanced_response.execute_response(f'admin_{threat_type}', 'critical', {
-            'user_id': current_user.id,
-            'features': features
-        })
-        abort(403)
+@bp.route('/api/threat-scoring')
+@login_required
+@admin_required
+def threat_scoring_status():
+    """Security latency histogram, batch scorer and explanation worker counters"""
+    return jsonify(dict(threat_scoring.status(), explanations=explanations.status()))
+
+@bp.route('/metrics')
+@login_required
+@admin_required
+def request_metrics():
+    """Per-endpoint latency histograms, sizes and in-flight requests in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/profiler')
+@login_required
+@admin_required
+def profiler_status():
+    """Current profiling session, sampled endpoints and stored profiles"""
+    return jsonify(profiler.status())
+
+@bp.route('/api/profiler', methods=['POST'])
+@login_required
+@admin_required
+def configure_profiler():
+    """Start a profiling session ({"rate": 0.05, "endpoints": [...]}) or stop it ({"rate": 0})"""
+    try:
+        data = request.get_json() or {}
+        rate = float(data.get('rate', 0))
         
-    # Generate explanations for suspicious admin activity
-    if any(score > 0.5 for score in admin_threats):
-        explanation = enhanced_explainer.explain_prediction(
-            enhanced_models.admin_threat_model,
-            features,
-            max(admin_threats)
-        )
+        if rate <= 0:
+            settings = profiler.stop()
+        else:
+            settings = profiler.configure(rate, data.get('endpoints'), current_user.id)
         
-        admin_security_monitor.log_security_event(
-            'suspicious_admin_activity',
-            {
-                'user_id': current_user.id,
-                'features': features,
-                'explanation': explanation,
-                'threat_scores': dict(zip(
-                    ['session_hijacking', 'privilege_escalation', 'unauthorized_access'],
-                    admin_threats
-                ))
-            },
-            severity='high'
+        log_admin_action(
+            current_user,
+            'profiler_configured',
+            {'rate': settings['rate'], 'endpoints': settings.get('endpoints')}
         )
-        
-    # Track metrics
-    enhanced_monitoring.track_request(
-        request,
-        (datetime.utcnow() - start_time).total_seconds(),
-        admin_context=True
+        return jsonify(settings)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'rate must be a number between 0 and 1'}), 400
+
+@bp.route('/api/profiler/token', methods=['POST'])
+@login_required
+@admin_required
+def profiler_token():
+    """Signed token that profiles the first request sending it"""
+    return jsonify({
+        'header': current_app.config['PROFILER_HEADER'],
+        'token': profiler.sign(current_user.id),
+        'expires_in': current_app.config['PROFILER_TOKEN_MAX_AGE']
+    })
+
+@bp.route('/profiler/download')
+@login_required
+@admin_required
+def download_profile():
+    """Collapsed stacks of a session (?session=, ?endpoint=) for flamegraph tools"""
+    session = request.args.get('session') or profiler.settings().get('session') or 'manual'
+    
+    return Response(
+        profiler.download(session, request.args.get('endpoint')),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename=profile-{secure_filename(session)}.folded'}
     )
 
 @bp.route('/dashboard')
@@ -923,12 +1046,11 @@ def dashboard():
         'total_users': User.query.count(),
         'total_movies': Movie.query.count(),
         'total_reviews': Review.query.count(),
-        'total_views': MovieView.query.count(),
+        'total_views': total_view_count(),
         'recent_activities': UserActivity.query.order_by(UserActivity.created_at.desc()).limit(10).all(),
         'recent_users': User.query.order_by(User.created_at.desc()).limit(5).all(),
-        'popular_movies': Movie.query.join(MovieView).group_by(Movie.id).order_by(
-            desc(func.count(MovieView.id))).limit(5).all(),
-        'storage_percentage': check_storage_health().get('usage', 0)
+        'popular_movies': popular_movies(limit=5),
+        'storage_percentage': round(storage_percentage(), 1)
     }
     return render_template('admin/dashboard.html', stats=stats)
 
@@ -938,22 +1060,19 @@ def dashboard():
 def get_stats():
     """Get dashboard statistics"""
     total_movies = Movie.query.count()
-    total_views = MovieView.query.count()
+    total_views = total_view_count()
     total_reviews = Review.query.count()
-    avg_rating = db.session.query(func.avg(Rating.value)).scalar() or 0
+    rating_sum, rating_count = db.session.query(
+        func.sum(Movie.rating_sum), func.sum(Movie.rating_count)
+    ).one()
+    avg_rating = rating_sum / rating_count if rating_count else 0
     
-    # Get daily views for the past week
-    daily_views = db.session.query(
-        func.date(MovieView.viewed_at).label('date'),
-        func.count(MovieView.id).label('views')
-    ).group_by(func.date(MovieView.viewed_at))\
-     .order_by(desc('date'))\
-     .limit(7)\
-     .all()
+    # Get daily views for the past week, newest first
+    daily_views = list(reversed(daily_view_totals(days=7)))
     
     chart_data = {
-        'labels': [str(view.date) for view in daily_views],
-        'views': [view.views for view in daily_views]
+        'labels': [str(day) for day, _ in daily_views],
+        'views': [views for _, views in daily_views]
     }
     
     return jsonify({
@@ -980,9 +1099,8 @@ def upload_movie():
         return jsonify({'error': 'Invalid file type'}), 400
     
     try:
-        # Save poster file
-        filename = secure_filename(f"{uuid.uuid4()}_{poster.filename}")
-        poster.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+        # Save poster file; identical posters share one stored copy
+        filename, _, _ = store_upload(poster, UPLOAD_SUBFOLDERS['movie'])
         
         # Create movie record
         movie = Movie(
@@ -998,6 +1116,7 @@ def upload_movie():
         
         db.session.add(movie)
         db.session.commit()
+        image_pipeline.submit(filename, target=movie)
         
         SecurityAudit.log(
             'movie_added',
@@ -1016,6 +1135,8 @@ def upload_movie():
             'movie_id': movie.id
         })
         
+    except StorageQuotaExceeded:
+        return jsonify({'error': 'Storage quota exceeded'}), 507
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -1028,15 +1149,10 @@ def delete_movie(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     
     try:
-        # Delete poster file
-        if movie.poster_path:
-            poster_path = os.path.join(current_app.config['UPLOAD_FOLDER'], movie.poster_path)
-            if os.path.exists(poster_path):
-                os.remove(poster_path)
-        
-        # Delete movie record
-        db.session.delete(movie)
+        # Hide the movie now; dependents, files and rollups are purged in the background
+        movie.is_hidden = True
         db.session.commit()
+        job = jobs.submit('purge_movie', created_by=current_user.id, movie_id=movie.id)
         
         SecurityAudit.log(
             'movie_deleted',
@@ -1045,12 +1161,13 @@ def delete_movie(movie_id):
             user_agent=request.user_agent.string,
             details={
                 'movie_id': movie_id,
-                'title': movie.title
+                'title': movie.title,
+                'job_id': job.id
             },
             severity='high'
         )
         
-        return jsonify({'message': 'Movie deleted successfully'})
+        return jsonify({'message': 'Movie deletion started', 'job_id': job.id}), 202
         
     except Exception as e:
         db.session.rollback()
@@ -1107,6 +1224,7 @@ def lock_user(user_id):
     duration = request.json.get('duration', 30)  # Default 30 minutes
     
     user.lock_account(duration)
+    invalidate_user_cache(user.id)
     user.log_activity(
         'account_locked',
         details=f'Account locked for {duration} minutes by admin',
@@ -1136,6 +1254,7 @@ def unlock_user(user_id):
     """Unlock a user account"""
     user = User.query.get_or_404(user_id)
     user.reset_login_attempts()
+    invalidate_user_cache(user.id)
     user.log_activity(
         'account_unlocked',
         details='Account unlocked by admin',
@@ -1180,6 +1299,7 @@ def change_user_role(user_id):
         user_agent=request.user_agent.string
     )
     db.session.commit()
+    invalidate_user_cache(user.id)
     
     SecurityAudit.log(
         'user_role_updated',
@@ -1271,14 +1391,15 @@ def security_overview():
         UserActivity.action.in_(['failed_login', 'password_reset', 'account_locked'])
     ).count()
     
-    # Get system health
-    db_health = check_database_health()
-    storage_health = check_storage_health()
-    cache_health = check_cache_health()
-    api_health = check_api_health()
+    # Get system health from the background probes' last results
+    health = health_probes.status()
+    db_health = check_database_health(health)
+    storage_health = check_storage_health(health)
+    cache_health = check_cache_health(health)
+    api_health = check_api_health(health)
     
     # Get active security alerts
-    alerts = get_security_alerts()
+    alerts = get_security_alerts(health)
     
     return jsonify({
         'failed_logins': failed_logins,
@@ -1294,89 +1415,63 @@ def security_overview():
         'alerts': alerts
     })
 
-def check_database_health():
-    """Check database connection and performance"""
-    try:
-        # Measure query execution time
-        start_time = time.time()
-        db.session.execute('SELECT 1')
-        response_time = (time.time() - start_time) * 1000  # Convert to milliseconds
-        
-        status = 100 if response_time < 100 else (
-            80 if response_time < 500 else 60
-        )
-        
-        return {
-            'status': status,
-            'message': 'Healthy' if status > 80 else 'Degraded',
-            'response_time': round(response_time, 2)
-        }
-    except Exception as e:
-        return {
-            'status': 0,
-            'message': 'Error',
-            'error': str(e)
-        }
+def _probe_health(health, name):
+    """Overview entry for one background probe: last result plus latency history"""
+    probe = health.get(name)
+    if not probe or not probe.get('latest'):
+        return {'status': None, 'message': 'Pending'}
+    latest = probe['latest']
+    checked_at = datetime.utcfromtimestamp(latest['checked_at']).isoformat()
+    if probe.get('stale'):
+        return {'status': None, 'message': 'Stale', 'checked_at': checked_at, 'latency': probe['latency']}
+    if not latest['ok']:
+        return {'status': 0, 'message': 'Error', 'error': latest.get('error'), 'latency': probe['latency']}
+    response_time = latest['latency_ms']
+    status = 100 if response_time < 100 else (
+        80 if response_time < 500 else 60
+    )
+    return {
+        'status': status,
+        'message': 'Healthy' if status > 80 else 'Degraded',
+        'response_time': response_time,
+        'checked_at': checked_at,
+        'latency': probe['latency']
+    }
 
-def check_storage_health():
-    """Check storage usage"""
-    try:
-        upload_dir = current_app.config['UPLOAD_FOLDER']
-        total, used, free = shutil.disk_usage(upload_dir)
-        usage_percent = (used / total) * 100
-        
-        return {
-            'usage': round(usage_percent, 1),
-            'total': total,
-            'used': used,
-            'free': free
-        }
-    except Exception as e:
-        return {
-            'usage': 0,
-            'error': str(e)
-        }
+def check_database_health(health=None):
+    """Database SELECT 1 probe"""
+    return _probe_health(health if health is not None else health_probes.status(), 'database')
+
+def check_storage_health(health=None):
+    """Disk usage of the upload and movie volumes"""
+    probe = (health if health is not None else health_probes.status()).get('storage') or {}
+    latest = probe.get('latest')
+    if not latest:
+        return {'usage': 0, 'message': 'Pending'}
+    if probe.get('stale'):
+        return {'usage': 0, 'message': 'Stale'}
+    if not latest['ok']:
+        return {'usage': 0, 'error': latest.get('error')}
+    uploads = latest['volumes'].get('uploads', {})
+    return {
+        'usage': latest['usage'],
+        'total': uploads.get('total'),
+        'used': uploads.get('used'),
+        'free': uploads.get('free'),
+        'volumes': latest['volumes']
+    }
 
-def check_cache_health():
-    """Check cache status"""
-    try:
-        # Add your cache health check logic here
-        # For example, if using Redis:
-        # redis_client.ping()
-        return {
-            'status': 100,
-            'message': 'Operational'
-        }
-    except Exception as e:
-        return {
-            'status': 0,
-            'message': 'Error',
-            'error': str(e)
-        }
+def check_cache_health(health=None):
+    """Redis ping, or a cache round trip without Redis"""
+    return _probe_health(health if health is not None else health_probes.status(), 'cache')
 
-def check_api_health():
-    """Check API response times"""
-    try:
-        start_time = time.time()
-        # Make a sample API request
-        response_time = (time.time() - start_time) * 1000
-        
-        status = 100 if response_time < 100 else (
-            80 if response_time < 500 else 60
-        )
-        
-        return {
-            'status': status,
-            'response_time': round(response_time, 2)
-        }
-    except Exception as e:
-        return {
-            'status': 0,
-            'error': str(e)
-        }
+def check_api_health(health=None):
+    """Synthetic request through the application"""
+    return _probe_health(health if health is not None else health_probes.status(), 'api')
 
-def get_security_alerts():
+def get_security_alerts(health=None):
     """Get active security alerts"""
+    health = health if health is not None else health_probes.status()
     now = datetime.utcnow()
     day_ago = now - timedelta(days=1)
     
@@ -1419,7 +1514,7 @@ def get_security_alerts():
         })
     
     # Check storage usage
-    storage = check_storage_health()
+    storage = check_storage_health(health)
     if storage.get('usage', 0) > 90:
         alerts.append({
             'id': 'storage_warning',
@@ -1430,18 +1525,40 @@ def get_security_alerts():
         })
     
     # Check database health
-    db_health = check_database_health()
-    if db_health['status'] < 80:
+    db_health = check_database_health(health)
+    if db_health['status'] is not None and db_health['status'] < 80:
         alerts.append({
             'id': 'database_health',
             'level': 'danger',
             'title': 'Database Performance Issue',
-            'message': f'Database response time: {db_health["response_time"]}ms',
+            'message': f'Database response time: {db_health["response_time"]}ms' if db_health['status']
+            else f'Database check failed: {db_health.get("error")}',
+            'timestamp': now.isoformat()
+        })
+    
+    # Check that the probes are still running
+    stale = sorted(name for name, probe in health.items() if probe.get('stale'))
+    if stale:
+        alerts.append({
+            'id': 'health_probes_stale',
+            'level': 'warning',
+            'title': 'Health Checks Not Running',
+            'message': f'No recent result from: {", ".join(stale)}',
             'timestamp': now.isoformat()
         })
     
     return alerts
 
+@event_stream.source('security_alert', interval=15)
+def stream_security_alerts():
+    """Open security alerts for the admin event stream"""
+    # The timestamp is regenerated on every check, so leave it out of the
+    # comparison and only push alerts that are new, changed or cleared
+    return {
+        alert['id']: {field: value for field, value in alert.items() if field != 'timestamp'}
+        for alert in get_security_alerts()
+    }
+
 @bp.route('/security-alert/<alert_id>/dismiss', methods=['POST'])
 @login_required
 @admin_required
@@ -1462,17 +1579,19 @@ def clear_alerts():
 @login_required
 @admin_required
 def get_ip_blacklist():
-    blacklist = BlacklistedIP.query.all()
+    blacklist = db.session.query(BlacklistedIP, User.username).outerjoin(
+        User, User.id == BlacklistedIP.added_by
+    ).order_by(BlacklistedIP.created_at.desc()).all()
     return jsonify({
         'blacklist': [{
             'id': ip.id,
             'ip_address': ip.ip_address,
             'reason': ip.reason,
-            'added_by_name': User.query.get(ip.added_by).username if ip.added_by else 'System',
+            'added_by_name': username or 'System',
             'created_at': ip.created_at.isoformat(),
             'expires_at': ip.expires_at.isoformat() if ip.expires_at else None,
             'is_active': ip.is_active
-        } for ip in blacklist]
+        } for ip, username in blacklist]
     })
 
 @bp.route('/ip-blacklist/add', methods=['POST'])
@@ -1484,15 +1603,18 @@ def add_to_blacklist():
     if not data.get('ip_address'):
         return jsonify({'error': 'IP address is required'}), 400
         
-    if not re.match(r'^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$', data['ip_address']):
-        return jsonify({'error': 'Invalid IP address format'}), 400
+    # Single IPv4/IPv6 addresses or CIDR ranges such as 203.0.113.0/24
+    try:
+        ip_address = parse_network(data['ip_address'])
+    except ValueError:
+        return jsonify({'error': 'Invalid IP address or CIDR range'}), 400
         
-    existing = BlacklistedIP.query.filter_by(ip_address=data['ip_address']).first()
+    existing = BlacklistedIP.query.filter_by(ip_address=ip_address).first()
     if existing:
         return jsonify({'error': 'IP address is already blacklisted'}), 400
         
     blacklist = BlacklistedIP(
-        ip_address=data['ip_address'],
+        ip_address=ip_address,
         reason=data.get('reason'),
         added_by=current_user.id,
         expires_at=datetime.fromisoformat(data['expires_at']) if data.get('expires_at') else None
@@ -1506,12 +1628,46 @@ def add_to_blacklist():
         user_id=current_user.id,
         ip_address=request.remote_addr,
         user_agent=request.user_agent.string,
-        details={'blacklisted_ip': data['ip_address'], 'reason': data.get('reason')},
+        details={'blacklisted_ip': ip_address, 'reason': data.get('reason')},
         severity='high'
     )
     
     return jsonify({'message': 'IP added to blacklist'})
 
+@bp.route('/ip-blacklist/import', methods=['POST'])
+@login_required
+@admin_required
+def import_blacklist():
+    """Bulk-add addresses and CIDR ranges from an uploaded text file, one per line"""
+    file = request.files.get('file')
+    if not file:
+        return jsonify({'error': 'File is required'}), 400
+        
+    expires_at = datetime.fromisoformat(request.form['expires_at']) if request.form.get('expires_at') else None
+    lines = (line.decode('utf-8', 'replace') for line in file.stream)
+    added, skipped, invalid = import_networks(
+        lines,
+        reason=request.form.get('reason'),
+        added_by=current_user.id,
+        expires_at=expires_at
+    )
+    
+    SecurityAudit.log(
+        'ip_blacklist_imported',
+        user_id=current_user.id,
+        ip_address=request.remote_addr,
+        user_agent=request.user_agent.string,
+        details={'added': added, 'skipped': skipped, 'invalid': len(invalid), 'reason': request.form.get('reason')},
+        severity='high'
+    )
+    
+    return jsonify({
+        'message': f'Imported {added} entries',
+        'added': added,
+        'skipped': skipped,
+        'invalid': invalid[:100]
+    })
+
 @bp.route('/ip-blacklist/<int:id>/deactivate', methods=['POST'])
 @login_required
 @admin_required
@@ -1574,84 +1730,139 @@ def delete_ip(id):
 @login_required
 @admin_required
 def get_security_audit():
-    page = request.args.get('page', 1, type=int)
+    """One page of the audit log, newest first.
+    
+    Pages are keyset-based: pass the previous response's next_cursor as
+    ?cursor= to continue, so every page is one index range scan on
+    (created_at, id) however deep it is.
+    """
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    cursor = request.args.get('cursor')
     severity = request.args.get('severity')
     event_type = request.args.get('event_type')
     date = request.args.get('date')
     
-    query = SecurityAudit.query
+    query = db.session.query(SecurityAudit, User.username).outerjoin(User, User.id == SecurityAudit.user_id)
     
     if severity:
-        query = query.filter_by(severity=severity)
+        query = query.filter(SecurityAudit.severity == severity)
     if event_type:
-        query = query.filter_by(event_type=event_type)
+        query = query.filter(SecurityAudit.event_type == event_type)
     if date:
         start_date = datetime.strptime(date, '%Y-%m-%d')
         end_date = start_date + timedelta(days=1)
         query = query.filter(SecurityAudit.created_at.between(start_date, end_date))
-        
-    query = query.order_by(SecurityAudit.created_at.desc())
-    pagination = query.paginate(page=page, per_page=20)
-    
-    event_types = db.session.query(SecurityAudit.event_type).distinct().all()
+    if cursor:
+        try:
+            created_at, audit_id = cursor.split('_')
+            after = (datetime.fromisoformat(created_at), int(audit_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(tuple_(SecurityAudit.created_at, SecurityAudit.id) < after)
+        
+    query = query.order_by(SecurityAudit.created_at.desc(), SecurityAudit.id.desc())
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    next_cursor = None
+    if has_more:
+        last = rows[-1][0]
+        next_cursor = f'{last.created_at.isoformat()}_{last.id}'
     
     return jsonify({
         'audits': [{
             'id': audit.id,
             'event_type': audit.event_type,
-            'username': User.query.get(audit.user_id).username if audit.user_id else None,
+            'username': username,
             'ip_address': audit.ip_address,
             'user_agent': audit.user_agent,
             'details': audit.details,
             'severity': audit.severity,
             'created_at': audit.created_at.isoformat()
-        } for audit in pagination.items],
-        'current_page': page,
-        'pages': pagination.pages,
-        'event_types': [et[0] for et in event_types]
+        } for audit, username in rows],
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+        'event_types': get_security_event_types()
     })
 
 @bp.route('/security-audit/export')
 @login_required
 @admin_required
 def export_security_audit():
+    """Stream the filtered audit log as CSV, optionally gzip-compressed (?compress=gzip)"""
     severity = request.args.get('severity')
     event_type = request.args.get('event_type')
     date = request.args.get('date')
-    
-    query = SecurityAudit.query
+    compress = request.args.get('compress') == 'gzip'
+    
+    # Usernames come from the same query; yield_per keeps a server-side cursor
+    # open and holds one batch of rows at a time
+    query = db.session.query(
+        SecurityAudit.created_at,
+        SecurityAudit.event_type,
+        User.username,
+        SecurityAudit.ip_address,
+        SecurityAudit.user_agent,
+        SecurityAudit.severity,
+        SecurityAudit.details
+    ).outerjoin(User, User.id == SecurityAudit.user_id)
     
     if severity:
-        query = query.filter_by(severity=severity)
+        query = query.filter(SecurityAudit.severity == severity)
     if event_type:
-        query = query.filter_by(event_type=event_type)
+        query = query.filter(SecurityAudit.event_type == event_type)
     if date:
         start_date = datetime.strptime(date, '%Y-%m-%d')
         end_date = start_date + timedelta(days=1)
         query = query.filter(SecurityAudit.created_at.between(start_date, end_date))
         
-    query = query.order_by(SecurityAudit.created_at.desc())
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Time', 'Event Type', 'User', 'IP Address', 'User Agent', 'Severity', 'Details'])
-    
-    for audit in query.all():
-        writer.writerow([
-            audit.created_at.isoformat(),
-            audit.event_type,
-            User.query.get(audit.user_id).username if audit.user_id else None,
-            audit.ip_address,
-            audit.user_agent,
-            audit.severity,
-            json.dumps(audit.details) if audit.details else ''
-        ])
+    query = query.order_by(SecurityAudit.created_at.desc(), SecurityAudit.id.desc()).yield_per(1000)
+    
+    def generate_csv():
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Time', 'Event Type', 'User', 'IP Address', 'User Agent', 'Severity', 'Details'])
+        # The header goes out before the first row is fetched
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+        
+        for created_at, event_type, username, ip_address, user_agent, severity, details in query:
+            writer.writerow([
+                created_at.isoformat(),
+                event_type,
+                username,
+                ip_address,
+                user_agent,
+                severity,
+                json.dumps(details) if details else ''
+            ])
+            if output.tell() >= 64 * 1024:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+    
+    def generate_gzip():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        for chunk in generate_csv():
+            # Sync flush so every CSV chunk reaches the client as soon as it is written
+            yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    
+    filename = f'security_audit_{datetime.now().strftime("%Y%m%d")}.csv'
+    if compress:
+        body, mimetype, filename = generate_gzip(), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = generate_csv(), 'text/csv'
     
     return Response(
-        output.getvalue(),
-        mimetype='text/csv',
+        stream_with_context(body),
+        mimetype=mimetype,
         headers={
-            'Content-Disposition': f'attachment; filename=security_audit_{datetime.now().strftime("%Y%m%d")}.csv'
+            'Content-Disposition': f'attachment; filename={filename}',
+            'X-Accel-Buffering': 'no'
         }
     )
 
@@ -1831,13 +2042,12 @@ def add_content():
         content.trailer_url = request.form.get('trailer')
         
         # Handle thumbnail upload
+        thumbnail_relative_path = None
         if 'thumbnail' in request.files:
             thumbnail = request.files['thumbnail']
             if thumbnail and allowed_file(thumbnail.filename):
-                filename = secure_filename(thumbnail.filename)
-                thumbnail_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'thumbnails', filename)
-                thumbnail.save(thumbnail_path)
-                content.thumbnail_url = f'/uploads/thumbnails/{filename}'
+                thumbnail_relative_path, _, _ = store_upload(thumbnail, UPLOAD_SUBFOLDERS['thumbnail'])
+                content.thumbnail_url = get_file_url(thumbnail_relative_path)
         
         # Set type-specific attributes
         if content_type == 'movie':
@@ -1881,12 +2091,16 @@ def add_content():
         
         db.session.add(content)
         db.session.commit()
+        if thumbnail_relative_path:
+            image_pipeline.submit(thumbnail_relative_path, target=content)
         
         return jsonify({
             'message': f'{content_type.title()} added successfully',
             'id': content.id
         })
     
+    except StorageQuotaExceeded:
+        return jsonify({'error': 'Storage quota exceeded'}), 507
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,60 @@
+"""Saving and releasing uploaded images under UPLOAD_FOLDER"""
+import os
+from umbrella_movies.app import db
+from umbrella_movies.app.content_store import store_upload, release_upload
+from umbrella_movies.app.image_pipeline import pick_variant
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+# Subfolder of UPLOAD_FOLDER per upload type. Posters uploaded before the
+# content-addressed store live at the top level.
+UPLOAD_SUBFOLDERS = {
+    'movie': 'posters',
+    'thumbnail': 'thumbnails',
+    'actor': 'actors'
+}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def get_file_url(relative_path, width=None, format=None, image_variants=None):
+    """Public URL for a path relative to UPLOAD_FOLDER.
+
+    With recorded image_variants, returns the smallest variant at least
+    `width` pixels wide (optionally in `format`, e.g. 'webp') instead.
+    """
+    variant = pick_variant(image_variants, width, format)
+    if variant:
+        relative_path = variant['path']
+    if not relative_path:
+        return None
+    return '/uploads/' + relative_path.lstrip('/').replace(os.sep, '/')
+
+def save_uploaded_file(file, upload_type='movie'):
+    """Save an uploaded image into the content-addressed store.
+
+    Returns a dict describing the stored file, or None for a disallowed type.
+    Identical bytes uploaded again share the stored file ('deduplicated').
+    Raises StorageQuotaExceeded if new content would pass the storage quota.
+    """
+    if not file or not allowed_file(file.filename):
+        return None
+
+    subfolder = UPLOAD_SUBFOLDERS.get(upload_type, 'other')
+    relative_path, size, created = store_upload(file, subfolder)
+    db.session.commit()
+
+    # No row owns the file yet, so no size variants: the route that attaches it
+    # to a movie or show submits them with that row as the target
+    return {
+        'filename': os.path.basename(relative_path),
+        'path': relative_path,
+        'url': get_file_url(relative_path),
+        'size': size,
+        'type': upload_type,
+        'deduplicated': not created
+    }
+
+def delete_uploaded_file(relative_path):
+    """Release a file under UPLOAD_FOLDER; it is deleted once unreferenced. The caller commits."""
+    return release_upload(relative_path)
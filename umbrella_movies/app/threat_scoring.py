@@ -0,0 +1,270 @@
+"""Admin request threat scoring kept off the request path.
+
+A request is scored synchronously only by a fast-path model. This is a linear
+surrogate of the full threat model, refit by least squares from the full
+model's own recent outputs, so it costs one dot product. The fit is shared
+through the cache, and a worker loads it on its first scored request, so
+restarts and deploys do not reset it. Until some worker has seen
+THREAT_FAST_PATH_MIN_SAMPLES scored requests it abstains. Every request's
+feature vector is also queued for the full model. A worker thread collects
+up to THREAT_BATCH_SIZE vectors, or waits at most THREAT_BATCH_WAIT seconds,
+and calls predict_proba once per batch. It then hands each row's scores to
+the @on_scores handlers inside an app context.
+
+Time spent in security checks is accumulated per request with timed() and
+recorded in a latency histogram when the request ends.
+"""
+import bisect
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import g
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in milliseconds"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms):
+        i = bisect.bisect_left(self.buckets, value_ms)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value_ms
+
+    def quantile(self, q, counts=None):
+        """Upper bound of the bucket holding the q-th quantile"""
+        counts = counts or self._counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total_ms = self._sum
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            buckets.append({'le': bound, 'count': cumulative})
+        return {
+            'buckets': buckets,
+            'count': cumulative,
+            'sum_ms': round(total_ms, 3),
+            'p50': self.quantile(0.5, counts),
+            'p95': self.quantile(0.95, counts),
+            'p99': self.quantile(0.99, counts)
+        }
+
+class FastPathModel:
+    """Linear surrogate of the full model, fit on the full model's batch outputs.
+
+    The latest fit is shared through the cache under SHARED_KEY, so a worker
+    that has just started serves with it instead of abstaining until its own
+    window fills. Every `poll` seconds a worker adopts a newer fit from
+    another worker.
+    """
+
+    SHARED_KEY = 'threat-fast-path:coef'
+
+    def __init__(self, window=4096, min_samples=256, refit_every=256, poll=30.0):
+        self.min_samples = min_samples
+        self.refit_every = refit_every
+        self.poll = poll
+        self._rows = deque(maxlen=window)
+        self._scores = deque(maxlen=window)
+        self._since_fit = 0
+        self._checked_at = None
+        self.fitted_at = 0.0
+        self.coef = None
+
+    def predict(self, vector):
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.poll:
+            self.load()
+        coef = self.coef
+        if coef is None or len(vector) + 1 != coef.shape[0]:
+            return None
+        import numpy as np
+        return np.clip(np.append(np.asarray(vector, dtype=float), 1.0) @ coef, 0.0, 1.0)
+
+    def load(self):
+        """Adopt the shared fit if it is newer than this worker's own"""
+        from app import cache
+        import numpy as np
+        self._checked_at = time.monotonic()
+        try:
+            shared = cache.get(self.SHARED_KEY)
+        except Exception as e:
+            logger.error(f"Error loading fast-path coefficients: {str(e)}")
+            return
+        if shared and shared['fitted_at'] > self.fitted_at:
+            self.coef = np.asarray(shared['coef'], dtype=float)
+            self.fitted_at = shared['fitted_at']
+
+    def observe(self, rows, scores):
+        """Add full-model results; refits every refit_every samples once warm"""
+        import numpy as np
+        self._rows.extend(rows)
+        self._scores.extend(scores)
+        self._since_fit += len(rows)
+        if len(self._rows) < self.min_samples or (self.coef is not None and self._since_fit < self.refit_every):
+            return
+        try:
+            X = np.asarray(self._rows, dtype=float)
+        except ValueError:
+            return  # feature vectors changed length; wait for the window to turn over
+        X = np.hstack([X, np.ones((X.shape[0], 1))])
+        coef, *_ = np.linalg.lstsq(X, np.asarray(self._scores, dtype=float), rcond=None)
+        self.coef = coef
+        self.fitted_at = time.time()
+        self._since_fit = 0
+        self._share()
+
+    def _share(self):
+        from app import cache
+        try:
+            cache.set(self.SHARED_KEY, {'coef': self.coef.tolist(), 'fitted_at': self.fitted_at}, timeout=0)
+        except Exception as e:
+            logger.error(f"Error sharing fast-path coefficients: {str(e)}")
+
+class ThreatScoring:
+    """Flask extension batching full-model threat scoring in a background thread"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._model_loader = None
+        self._handlers = []
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.fast_path = None
+        self.latency = LatencyHistogram()
+        self.stats = {'queued': 0, 'dropped': 0, 'batches': 0, 'scored': 0, 'errors': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('THREAT_BATCH_SIZE', 64)
+        app.config.setdefault('THREAT_BATCH_WAIT', 0.02)
+        app.config.setdefault('THREAT_QUEUE_SIZE', 10000)
+        app.config.setdefault('THREAT_FAST_PATH_MIN_SAMPLES', 256)
+        app.config.setdefault('THREAT_FAST_PATH_POLL', 30.0)
+        self.app = app
+        app.extensions['threat_scoring'] = self
+        self.fast_path = FastPathModel(min_samples=app.config['THREAT_FAST_PATH_MIN_SAMPLES'],
+                                       poll=app.config['THREAT_FAST_PATH_POLL'])
+        app.teardown_request(self._record_latency)
+
+    def model(self, f):
+        """Register the function returning the full model (with predict_proba)"""
+        self._model_loader = f
+        return f
+
+    def on_scores(self, f):
+        """Register f(context, scores) to handle each full-model result"""
+        self._handlers.append(f)
+        return f
+
+    @contextmanager
+    def timed(self):
+        """Count the enclosed block as security latency added to this request"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            g.threat_scoring_ms = g.get('threat_scoring_ms', 0.0) + (time.perf_counter() - started) * 1000
+
+    def _record_latency(self, exc=None):
+        elapsed = g.pop('threat_scoring_ms', None)
+        if elapsed is not None:
+            self.latency.observe(elapsed)
+
+    def score(self, vector, context):
+        """Fast-path scores for vector (None while the surrogate is untrained); queues full scoring"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((vector, context))
+            self.stats['queued'] += 1
+        except queue.Full:
+            self.stats['dropped'] += 1
+        return self.fast_path.predict(vector)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.app.config['THREAT_QUEUE_SIZE'])
+            self._thread = threading.Thread(target=self._run, name='threat-scoring', daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.app.config['THREAT_BATCH_WAIT']
+        while len(batch) < self.app.config['THREAT_BATCH_SIZE']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self.app.app_context():
+                try:
+                    self.score_batch(batch)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Error scoring threat batch: {str(e)}")
+
+    def score_batch(self, batch):
+        """Score (vector, context) pairs with one predict_proba call and dispatch the results"""
+        import numpy as np
+
+        rows = [vector for vector, _ in batch]
+        scores = np.asarray(self._model_loader().predict_proba(np.asarray(rows, dtype=float)))
+        self.stats['batches'] += 1
+        self.stats['scored'] += len(batch)
+        self.fast_path.observe(rows, scores)
+
+        for (_, context), row_scores in zip(batch, scores):
+            for handler in self._handlers:
+                try:
+                    handler(context, row_scores)
+                except Exception as e:
+                    logger.error(f"Error handling threat scores: {str(e)}")
+
+    def status(self):
+        return {
+            'latency_ms': self.latency.snapshot(),
+            'mean_batch_size': round(self.stats['scored'] / self.stats['batches'], 2) if self.stats['batches'] else None,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'fast_path_ready': self.fast_path.coef is not None,
+            **self.stats
+        }
@@ -0,0 +1,145 @@
+"""Flask-Caching backend with a bounded in-process LRU in front of Redis.
+
+Select it with CACHE_TYPE = 'app.two_tier_cache.TwoTierCache' and
+CACHE_REDIS_URL. Reads hit the worker-local LRU first and fall back to
+Redis; writes go to both. Tagged memoize keys ('tagged:...') embed tag
+generations and never change once written, so they are kept locally for
+their full timeout. Generation counters and locks always go to Redis so
+invalidations and single-flight locks are visible to every worker. Any
+other key is kept locally for at most CACHE_LOCAL_TIMEOUT seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+class TwoTierCache(BaseCache):
+    def __init__(self, client, default_timeout=300, key_prefix='', local_size=1024,
+                 local_timeout=5, immutable_prefixes=('tagged:',),
+                 bypass_prefixes=('tag-gen:', 'lock:'), **kwargs):
+        super().__init__(default_timeout=default_timeout)
+        # RedisCache accepts any redis-py compatible client (e.g. fakeredis) as host
+        self.remote = RedisCache(host=client, default_timeout=default_timeout,
+                                 key_prefix=key_prefix, **kwargs)
+        self.local_size = local_size
+        self.local_timeout = local_timeout
+        self.immutable_prefixes = tuple(immutable_prefixes)
+        self.bypass_prefixes = tuple(bypass_prefixes)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        import redis
+
+        client = redis.Redis.from_url(config.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0')
+        kwargs.update(dict(
+            default_timeout=config.get('CACHE_DEFAULT_TIMEOUT', 300),
+            key_prefix=config.get('CACHE_KEY_PREFIX') or '',
+            local_size=config.get('CACHE_LOCAL_SIZE', 1024),
+            local_timeout=config.get('CACHE_LOCAL_TIMEOUT', 5),
+        ))
+        return cls(client, *args, **kwargs)
+
+    # Local tier
+    def _local_ttl(self, key, timeout):
+        if key.startswith(self.bypass_prefixes):
+            return None
+        timeout = self._normalize_timeout(timeout)
+        if key.startswith(self.immutable_prefixes):
+            return timeout
+        return min(timeout, self.local_timeout) if timeout else self.local_timeout
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _local_set(self, key, value, timeout):
+        ttl = self._local_ttl(key, timeout)
+        if ttl is None:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl if ttl else 0, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def local_stats(self):
+        with self._lock:
+            return {'size': len(self._local), 'max_size': self.local_size}
+
+    # cachelib BaseCache API
+    def get(self, key):
+        value = self._local_get(key)
+        if value is not None:
+            return value
+        value = self.remote.get(key)
+        if value is not None:
+            self._local_set(key, value, None)
+        return value
+
+    def get_many(self, *keys):
+        values = [self._local_get(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing:
+            fetched = dict(zip(missing, self.remote.get_many(*missing)))
+            for index, key in enumerate(keys):
+                if values[index] is None and fetched.get(key) is not None:
+                    values[index] = fetched[key]
+                    self._local_set(key, values[index], None)
+        return values
+
+    def set(self, key, value, timeout=None):
+        result = self.remote.set(key, value, timeout=timeout)
+        self._local_set(key, value, timeout)
+        return result
+
+    def set_many(self, mapping, timeout=None):
+        result = self.remote.set_many(mapping, timeout=timeout)
+        for key, value in mapping.items():
+            self._local_set(key, value, timeout)
+        return result
+
+    def add(self, key, value, timeout=None):
+        added = self.remote.add(key, value, timeout=timeout)
+        if added:
+            self._local_set(key, value, timeout)
+        return added
+
+    def delete(self, key):
+        self._local_delete(key)
+        return self.remote.delete(key)
+
+    def delete_many(self, *keys):
+        self._local_delete(*keys)
+        return self.remote.delete_many(*keys)
+
+    def has(self, key):
+        return self._local_get(key) is not None or self.remote.has(key)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        return self.remote.clear()
+
+    def inc(self, key, delta=1):
+        self._local_delete(key)
+        return self.remote.inc(key, delta)
+
+    def dec(self, key, delta=1):
+        self._local_delete(key)
+        return self.remote.dec(key, delta)
@@ -0,0 +1,140 @@
+"""Cached user snapshots for Flask-Login's user_loader.
+
+Authenticated requests load a compact, read-only snapshot of the user (id,
+role, flags, lock state) from the shared cache instead of querying the user
+table. Attributes outside the snapshot fall through to the real User row,
+loaded at most once per request. Snapshots expire after USER_CACHE_TIMEOUT
+seconds and are dropped explicitly when a user is changed or deleted.
+"""
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app import cache
+
+RoleSnapshot = namedtuple('RoleSnapshot', ['id', 'name'])
+
+def _cache_key(user_id):
+    return f'user-snapshot:{user_id}'
+
+def build_snapshot(user):
+    role = getattr(user, 'role', None)
+    locked_until = getattr(user, 'locked_until', None)
+    is_administrator = getattr(user, 'is_administrator', None)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'email': user.email,
+        'is_admin': bool(user.is_admin),
+        'active': bool(getattr(user, 'active', True)),
+        'role': (role.id, role.name) if role is not None else None,
+        'locked_until': locked_until.isoformat() if locked_until else None,
+        'is_administrator': bool(is_administrator()) if callable(is_administrator) else bool(user.is_admin)
+    }
+
+class CachedUser(UserMixin):
+    """Read-only stand-in for User built from a cached snapshot"""
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_model', None)
+
+    @property
+    def model(self):
+        """The full User row, loaded on first access"""
+        if self._model is None:
+            from app.models import User
+            object.__setattr__(self, '_model', User.query.get(self._snapshot['id']))
+        return self._model
+
+    @property
+    def id(self):
+        return self._snapshot['id']
+
+    @property
+    def username(self):
+        return self._snapshot['username']
+
+    @property
+    def email(self):
+        return self._snapshot['email']
+
+    @property
+    def is_admin(self):
+        return self._snapshot['is_admin']
+
+    @property
+    def is_active(self):
+        return self._snapshot['active']
+
+    @property
+    def role(self):
+        role = self._snapshot['role']
+        return RoleSnapshot(*role) if role else None
+
+    @property
+    def locked_until(self):
+        locked_until = self._snapshot['locked_until']
+        return datetime.fromisoformat(locked_until) if locked_until else None
+
+    def is_locked(self):
+        locked_until = self.locked_until
+        return locked_until is not None and locked_until > datetime.utcnow()
+
+    def is_administrator(self):
+        return self._snapshot['is_administrator']
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __setattr__(self, name, value):
+        # Writes go to the real row so existing code that updates current_user keeps working
+        setattr(self.model, name, value)
+
+    def __repr__(self):
+        return f'<CachedUser {self.id}>'
+
+def load_cached_user(user_id):
+    """user_loader body: snapshot from cache, falling back to one DB read"""
+    snapshot = cache.get(_cache_key(user_id))
+    if snapshot is not None:
+        return CachedUser(snapshot)
+
+    from app.models import User
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+    snapshot = build_snapshot(user)
+    cache.set(_cache_key(user_id), snapshot,
+              timeout=current_app.config.get('USER_CACHE_TIMEOUT', 60))
+    cached = CachedUser(snapshot)
+    object.__setattr__(cached, '_model', user)
+    return cached
+
+def invalidate_user_cache(*user_ids):
+    """Drop cached snapshots so the next request reloads the users"""
+    keys = [_cache_key(user_id) for user_id in user_ids if user_id is not None]
+    if keys:
+        cache.delete_many(*keys)
+
+def invalidate_user_on_commit(target):
+    """Mapper-listener helper: drop the user's snapshot once the change commits"""
+    session = object_session(target)
+    if session is None:
+        invalidate_user_cache(target.id)
+        return
+    session.info.setdefault('user_snapshots', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _drop_committed_user_snapshots(session):
+    user_ids = session.info.pop('user_snapshots', None)
+    if user_ids:
+        invalidate_user_cache(*user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_snapshots(session):
+    session.info.pop('user_snapshots', None)
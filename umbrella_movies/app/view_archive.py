@@ -0,0 +1,202 @@
+"""Cold storage for raw MovieView history.
+
+Views older than VIEW_ARCHIVE_HORIZON_DAYS are moved out of the movie_view
+table into one compressed NumPy partition per UTC day:
+
+    <VIEW_ARCHIVE_DIR>/year=2024/month=03/day=2024-03-17.npz
+
+Each partition holds parallel columns (id, movie_id, user_id, ip_address,
+viewed_at) sorted by (movie_id, viewed_at), so per-movie lookups are a
+binary search. Queries only open the partitions for the requested days.
+"""
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from app import db
+from app.models import MovieView
+
+ANONYMOUS_USER = -1
+COLUMNS = ('id', 'movie_id', 'user_id', 'ip_address', 'viewed_at')
+ARCHIVE_DELETE_BATCH = 1000
+
+def archive_dir():
+    return current_app.config.get('VIEW_ARCHIVE_DIR') or \
+        os.path.join(current_app.instance_path, 'view_archive')
+
+def partition_path(day, root=None):
+    root = root or archive_dir()
+    return os.path.join(root, f'year={day:%Y}', f'month={day:%m}', f'day={day.isoformat()}.npz')
+
+def partitions(start_day, end_day, root=None):
+    """Yield (day, path) for every existing partition in [start_day, end_day]"""
+    day = start_day
+    while day <= end_day:
+        path = partition_path(day, root)
+        if os.path.exists(path):
+            yield day, path
+        day += timedelta(days=1)
+
+def read_partition(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in COLUMNS}
+
+def _write_partition(path, columns):
+    """Sort, dedupe by view id and atomically replace the partition file"""
+    _, unique_index = np.unique(columns['id'], return_index=True)
+    columns = {name: values[unique_index] for name, values in columns.items()}
+    order = np.lexsort((columns['viewed_at'], columns['movie_id']))
+    columns = {name: values[order] for name, values in columns.items()}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _rows_to_columns(rows):
+    return {
+        'id': np.array([r.id for r in rows], dtype=np.int64),
+        'movie_id': np.array([r.movie_id for r in rows], dtype=np.int64),
+        'user_id': np.array([r.user_id if r.user_id is not None else ANONYMOUS_USER for r in rows],
+                            dtype=np.int64),
+        'ip_address': np.array([r.ip_address or '' for r in rows], dtype='U45'),
+        'viewed_at': np.array([r.viewed_at for r in rows], dtype='datetime64[us]'),
+    }
+
+def archive_day(day):
+    """Move one day's raw views into its partition. Returns rows archived."""
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    rows = db.session.query(
+        MovieView.id, MovieView.movie_id, MovieView.user_id,
+        MovieView.ip_address, MovieView.viewed_at
+    ).filter(
+        MovieView.viewed_at >= day_start,
+        MovieView.viewed_at < day_end
+    ).all()
+    if not rows:
+        return 0
+
+    columns = _rows_to_columns(rows)
+    path = partition_path(day)
+    if os.path.exists(path):
+        existing = read_partition(path)
+        columns = {name: np.concatenate([existing[name], columns[name]]) for name in COLUMNS}
+    _write_partition(path, columns)
+
+    # Only delete once the partition is safely on disk; a crash before the
+    # commit leaves the rows in place and the next run dedupes them by id.
+    # Delete exactly the archived ids: a view committed after the SELECT
+    # above may have a lower id and must stay for the next run.
+    ids = [r.id for r in rows]
+    for start in range(0, len(ids), ARCHIVE_DELETE_BATCH):
+        MovieView.query.filter(MovieView.id.in_(ids[start:start + ARCHIVE_DELETE_BATCH]))\
+            .delete(synchronize_session=False)
+    db.session.commit()
+    return len(rows)
+
+def archive_views(horizon_days=None):
+    """Archive every day older than the horizon. Returns {day: rows archived}."""
+    horizon_days = horizon_days or current_app.config.get('VIEW_ARCHIVE_HORIZON_DAYS', 90)
+    cutoff_day = datetime.utcnow().date() - timedelta(days=horizon_days)
+
+    oldest = db.session.query(db.func.min(MovieView.viewed_at)).filter(
+        MovieView.viewed_at < datetime.combine(cutoff_day, datetime.min.time())
+    ).scalar()
+    if oldest is None:
+        return {}
+    if not isinstance(oldest, datetime):
+        oldest = datetime.fromisoformat(str(oldest))
+
+    archived = {}
+    day = oldest.date()
+    while day < cutoff_day:
+        count = archive_day(day)
+        if count:
+            archived[day] = count
+        day += timedelta(days=1)
+    return archived
+
+def compact_hot_table():
+    """Reclaim space and refresh planner statistics after a large archive run"""
+    engine = db.engine
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.exec_driver_sql(f'VACUUM ANALYZE {MovieView.__tablename__}')
+        elif engine.dialect.name == 'sqlite':
+            connection.exec_driver_sql('VACUUM')
+
+# Query API over archived partitions
+def _movie_slice(columns, movie_id):
+    movie_ids = columns['movie_id']
+    lo = np.searchsorted(movie_ids, movie_id, side='left')
+    hi = np.searchsorted(movie_ids, movie_id, side='right')
+    return slice(lo, hi)
+
+def daily_counts(start_day, end_day, movie_id=None):
+    """Return {day: views} for archived days, optionally for one movie"""
+    counts = {}
+    for day, path in partitions(start_day, end_day):
+        columns = read_partition(path)
+        if movie_id is None:
+            counts[day] = int(len(columns['id']))
+        else:
+            selected = _movie_slice(columns, movie_id)
+            counts[day] = int(selected.stop - selected.start)
+    return counts
+
+def movie_counts(start_day, end_day):
+    """Return {movie_id: views} summed over archived days"""
+    totals = Counter()
+    for _, path in partitions(start_day, end_day):
+        movie_ids, views = np.unique(read_partition(path)['movie_id'], return_counts=True)
+        totals.update(dict(zip(movie_ids.tolist(), views.tolist())))
+    return dict(totals)
+
+def movie_day_counts(start_day, end_day):
+    """Return {(movie_id, day): views} for archived days"""
+    counts = {}
+    for day, path in partitions(start_day, end_day):
+        movie_ids, views = np.unique(read_partition(path)['movie_id'], return_counts=True)
+        for movie_id, count in zip(movie_ids.tolist(), views.tolist()):
+            counts[(movie_id, day)] = count
+    return counts
+
+def movie_hour_counts(day):
+    """Return Counter{(movie_id, hour): views} for one archived day"""
+    path = partition_path(day)
+    counts = Counter()
+    if not os.path.exists(path):
+        return counts
+    columns = read_partition(path)
+    hours = columns['viewed_at'].astype('datetime64[h]')
+    keys, views = np.unique(np.stack([columns['movie_id'], hours.astype(np.int64)]), axis=1,
+                            return_counts=True)
+    for (movie_id, hour), count in zip(keys.T.tolist(), views.tolist()):
+        counts[(movie_id, np.datetime64(hour, 'h').astype(datetime))] += count
+    return counts
+
+def load_frame(start_day, end_day, movie_id=None):
+    """Load archived views as a pandas DataFrame for ad-hoc analytics"""
+    import pandas as pd
+
+    frames = []
+    for _, path in partitions(start_day, end_day):
+        columns = read_partition(path)
+        if movie_id is not None:
+            selected = _movie_slice(columns, movie_id)
+            columns = {name: values[selected] for name, values in columns.items()}
+        frames.append(pd.DataFrame(columns))
+    if not frames:
+        return pd.DataFrame({name: [] for name in COLUMNS})
+    frame = pd.concat(frames, ignore_index=True)
+    frame['user_id'] = frame['user_id'].where(frame['user_id'] != ANONYMOUS_USER)
+    return frame
@@ -0,0 +1,317 @@
+"""Write-behind ingestion for MovieView rows.
+
+Plays are appended to a buffer and written with one bulk INSERT per flush
+instead of one INSERT (and one cache invalidation) per view. The buffer is
+per-worker memory by default; setting VIEW_BUFFER_BACKEND = 'redis' shares it
+through a Redis list so any worker can drain it.
+
+A failed batch goes back to the head of the buffer and is retried on the
+next flush. After VIEW_FLUSH_MAX_ATTEMPTS consecutive failures, if the
+database still answers, the batch is bisected: the halves that insert are
+kept, and rows that fail on their own are moved to a dead-letter list. One
+bad row therefore cannot stall ingestion. The buffer holds at most
+VIEW_BUFFER_MAX_PENDING rows; views recorded beyond that are dropped and
+counted.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class MemoryViewBuffer:
+    """Per-process list of pending views"""
+
+    def __init__(self, max_pending=100000, max_dead=1000):
+        self.max_pending = max_pending
+        self.max_dead = max_dead
+        self._rows = []
+        self.dead = []
+        self._lock = threading.Lock()
+
+    def push(self, row):
+        """Append row; returns the pending count, or None when the buffer is full"""
+        with self._lock:
+            if len(self._rows) >= self.max_pending:
+                return None
+            self._rows.append(row)
+            return len(self._rows)
+
+    def take(self, limit):
+        with self._lock:
+            batch, self._rows = self._rows[:limit], self._rows[limit:]
+            return batch
+
+    def requeue(self, rows):
+        with self._lock:
+            self._rows[:0] = rows
+            del self._rows[self.max_pending:]
+
+    def dead_letter(self, rows):
+        with self._lock:
+            self.dead.extend(rows)
+            del self.dead[:-self.max_dead]
+
+    def __len__(self):
+        return len(self._rows)
+
+class RedisViewBuffer:
+    """Pending views kept in a Redis list shared by all workers.
+
+    Any client exposing the redis-py list/pipeline API works, so tests can
+    pass a fakeredis instance instead of a live server.
+    """
+
+    def __init__(self, client, key='umbrella:view_buffer', max_pending=100000, max_dead=1000):
+        self.client = client
+        self.key = key
+        self.dead_key = key + ':dead'
+        self.max_pending = max_pending
+        self.max_dead = max_dead
+
+    def push(self, row):
+        """Append row; returns the pending count, or None when the buffer is full"""
+        payload = dict(row, viewed_at=row['viewed_at'].isoformat())
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(self.key, json.dumps(payload))
+        pipe.ltrim(self.key, 0, self.max_pending - 1)
+        pending, _ = pipe.execute()
+        return pending if pending <= self.max_pending else None
+
+    def take(self, limit):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, limit - 1)
+        pipe.ltrim(self.key, limit, -1)
+        raw_rows, _ = pipe.execute()
+        rows = []
+        for raw in raw_rows:
+            row = json.loads(raw)
+            row['viewed_at'] = datetime.fromisoformat(row['viewed_at'])
+            rows.append(row)
+        return rows
+
+    def requeue(self, rows):
+        if rows:
+            payloads = [json.dumps(dict(row, viewed_at=row['viewed_at'].isoformat())) for row in rows]
+            pipe = self.client.pipeline(transaction=True)
+            pipe.lpush(self.key, *reversed(payloads))
+            pipe.ltrim(self.key, 0, self.max_pending - 1)
+            pipe.execute()
+
+    def dead_letter(self, rows):
+        if rows:
+            payloads = [json.dumps(dict(row, viewed_at=row['viewed_at'].isoformat())) for row in rows]
+            pipe = self.client.pipeline(transaction=True)
+            pipe.rpush(self.dead_key, *payloads)
+            pipe.ltrim(self.dead_key, -self.max_dead, -1)
+            pipe.execute()
+
+    def __len__(self):
+        return self.client.llen(self.key)
+
+class ViewIngestor:
+    """Flask extension that buffers MovieView inserts and flushes them in bulk"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.buffer = None
+        self.max_size = 500
+        self.flush_interval = 5.0
+        self.flush_listeners = []
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flusher = None
+        self._flusher_pid = None
+        self._stopping = threading.Event()
+        self._failures = 0
+        self.stats = {'dropped': 0, 'dead_lettered': 0, 'discarded': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_BUFFER_BACKEND', 'memory')
+        app.config.setdefault('VIEW_BUFFER_REDIS_URL', os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+        app.config.setdefault('VIEW_BUFFER_MAX_SIZE', 500)
+        app.config.setdefault('VIEW_BUFFER_FLUSH_INTERVAL', 5.0)
+        app.config.setdefault('VIEW_BUFFER_MAX_PENDING', 100000)
+        app.config.setdefault('VIEW_FLUSH_MAX_ATTEMPTS', 3)
+
+        self.app = app
+        self.max_size = app.config['VIEW_BUFFER_MAX_SIZE']
+        self.flush_interval = app.config['VIEW_BUFFER_FLUSH_INTERVAL']
+        max_pending = app.config['VIEW_BUFFER_MAX_PENDING']
+        if app.config['VIEW_BUFFER_BACKEND'] == 'redis':
+            import redis
+            self.buffer = RedisViewBuffer(redis.Redis.from_url(app.config['VIEW_BUFFER_REDIS_URL']),
+                                          max_pending=max_pending)
+        else:
+            self.buffer = MemoryViewBuffer(max_pending=max_pending)
+
+        app.extensions['view_ingest'] = self
+        atexit.register(self.shutdown)
+
+    def on_flush(self, f):
+        """Register f(rows) to run once after each successful flush"""
+        self.flush_listeners.append(f)
+        return f
+
+    def record(self, movie_id, user_id=None, ip_address=None, viewed_at=None):
+        """Queue one view; flushes inline when the size threshold is reached"""
+        pending = self.buffer.push({
+            'movie_id': movie_id,
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'viewed_at': viewed_at or datetime.utcnow(),
+        })
+        self._ensure_flusher()
+        if pending is None:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 1000 == 1:
+                logger.error(f"View buffer full; {self.stats['dropped']} views dropped so far")
+            return
+        if pending >= self.max_size:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Write every pending view with bulk INSERTs. Returns rows written.
+
+        A flush already running in another thread drains the buffer, so by
+        default a concurrent call returns immediately instead of queueing.
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return 0
+        try:
+            written = 0
+            movie_ids = set()
+            while True:
+                rows = self.buffer.take(self.max_size)
+                if not rows:
+                    break
+                stored = self._write(rows)
+                if stored is None:
+                    break
+                written += len(stored)
+                movie_ids.update(row['movie_id'] for row in stored)
+            self._last_flush = time.monotonic()
+            if written:
+                self._invalidate_caches(movie_ids)
+                logger.debug(f"Flushed {written} buffered views")
+            return written
+        finally:
+            self._flush_lock.release()
+
+    def _write(self, rows):
+        """Insert a batch; returns the rows stored, or None if the batch was requeued"""
+        from sqlalchemy import text
+        from app import db
+
+        with self.app.app_context():
+            try:
+                stored = self._insert(rows)
+                self._failures = 0
+                return stored
+            except Exception as e:
+                db.session.rollback()
+                self._failures += 1
+                logger.error(f"Error flushing {len(rows)} buffered views: {str(e)}")
+
+            if self._failures < self.app.config['VIEW_FLUSH_MAX_ATTEMPTS']:
+                self.buffer.requeue(rows)
+                return None
+            try:
+                db.session.execute(text('SELECT 1'))
+            except Exception:
+                # The database itself is unreachable; the rows are not to blame
+                db.session.rollback()
+                self.buffer.requeue(rows)
+                return None
+
+            middle = len(rows) // 2
+            stored, rejected = self._isolate(rows[:middle])
+            more_stored, more_rejected = self._isolate(rows[middle:])
+            stored, rejected = stored + more_stored, rejected + more_rejected
+            self._failures = 0
+            if rejected:
+                self.buffer.dead_letter(rejected)
+                self.stats['dead_lettered'] += len(rejected)
+                logger.error(f"Dead-lettered {len(rejected)} views that cannot be inserted")
+            return stored
+
+    def _insert(self, rows):
+        from app import db
+        from app.models import MovieView
+
+        rows = self._for_visible_movies(rows)
+        if rows:
+            db.session.execute(MovieView.__table__.insert(), rows)
+            for listener in self.flush_listeners:
+                listener(rows)
+        db.session.commit()
+        return rows
+
+    def _for_visible_movies(self, rows):
+        """Drop views of movies that are hidden for purging or already gone.
+
+        The Core insert bypasses the ORM hidden-movie criteria, and a purge
+        deletes views batch by batch before it deletes the movie itself.
+        """
+        from app import db
+        from app.models import Movie
+
+        movie_ids = {row['movie_id'] for row in rows}
+        # ORM query, so exclude_hidden_movies filters out hidden movies
+        visible = {movie_id for movie_id, in db.session.query(Movie.id).filter(Movie.id.in_(movie_ids))}
+        if len(visible) < len(movie_ids):
+            self.stats['discarded'] += sum(1 for row in rows if row['movie_id'] not in visible)
+            rows = [row for row in rows if row['movie_id'] in visible]
+        return rows
+
+    def _isolate(self, rows):
+        """Insert rows by halves until each failing row is alone; returns (stored, rejected)"""
+        from app import db
+
+        if not rows:
+            return [], []
+        try:
+            return self._insert(rows), []
+        except Exception:
+            db.session.rollback()
+            if len(rows) == 1:
+                return [], rows
+        middle = len(rows) // 2
+        stored, rejected = self._isolate(rows[:middle])
+        more_stored, more_rejected = self._isolate(rows[middle:])
+        return stored + more_stored, rejected + more_rejected
+
+    def _invalidate_caches(self, movie_ids):
+        from app.cache_tags import invalidate_tags
+
+        with self.app.app_context():
+            invalidate_tags('views:day', *(f'movie:{movie_id}' for movie_id in sorted(movie_ids)))
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork, so start one per worker process lazily
+        if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+        self._flusher_pid = os.getpid()
+        self._stopping.clear()
+        self._flusher = threading.Thread(target=self._run_flusher, name='view-ingest-flusher', daemon=True)
+        self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._stopping.wait(self.flush_interval):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def shutdown(self):
+        """Stop the background flusher and write out anything still buffered"""
+        self._stopping.set()
+        if self.buffer is not None and self.app is not None:
+            try:
+                self.flush(wait=True)
+            except Exception as e:
+                logger.error(f"Error flushing views on shutdown: {str(e)}")
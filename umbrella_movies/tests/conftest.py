@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+from flask import Flask
+
+# The application package is imported as 'app', as it is when run from umbrella_movies/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def redis_client():
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeStrictRedis()
+
+@pytest.fixture
+def two_tier(redis_client):
+    from app.two_tier_cache import TwoTierCache
+    return TwoTierCache(redis_client, local_size=3, local_timeout=5)
+
+@pytest.fixture
+def flask_app(redis_client):
+    """Minimal app whose shared cache is a TwoTierCache over fakeredis"""
+    from app import cache
+    from app.two_tier_cache import TwoTierCache
+
+    test_app = Flask('umbrella_movies_tests')
+    test_app.config.update(CACHE_TYPE='SimpleCache', CACHE_LOCK_TIMEOUT=30, CACHE_LOCK_WAIT=5)
+    cache.init_app(test_app)
+    test_app.extensions['cache'][cache] = TwoTierCache(redis_client)
+    with test_app.app_context():
+        yield test_app
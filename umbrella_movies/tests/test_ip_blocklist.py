@@ -0,0 +1,105 @@
+import ipaddress
+from datetime import datetime, timedelta
+import pytest
+from app.ip_blocklist import CompiledBlocklist, IPBlocklist, parse_network
+
+def compiled(*values, expires_at=None):
+    return CompiledBlocklist([ipaddress.ip_network(value, strict=False) for value in values], expires_at)
+
+def contains(blocklist, address):
+    return ipaddress.ip_address(address) in blocklist
+
+def test_overlapping_and_adjacent_ranges_merge():
+    blocklist = compiled('10.0.0.0/25', '10.0.0.128/25', '10.0.0.64/26', '10.0.1.0/24', '192.0.2.7')
+
+    assert list(blocklist._first[4]) == [int(ipaddress.ip_address('10.0.0.0')),
+                                         int(ipaddress.ip_address('192.0.2.7'))]
+    assert list(blocklist._last[4]) == [int(ipaddress.ip_address('10.0.1.255')),
+                                        int(ipaddress.ip_address('192.0.2.7'))]
+    assert blocklist.size == 5
+
+def test_ipv4_bounds():
+    blocklist = compiled('10.0.0.0/24', '192.0.2.7')
+
+    assert contains(blocklist, '10.0.0.0')
+    assert contains(blocklist, '10.0.0.255')
+    assert not contains(blocklist, '10.0.1.0')
+    assert not contains(blocklist, '9.255.255.255')
+    assert contains(blocklist, '192.0.2.7')
+    assert not contains(blocklist, '192.0.2.8')
+    assert not contains(blocklist, '0.0.0.0')
+    assert not contains(blocklist, '255.255.255.255')
+
+def test_ipv6_ranges_and_families_stay_apart():
+    blocklist = compiled('2001:db8::/32', '2001:db8:ffff::/48', '2001:db9::1', '10.0.0.0/8')
+
+    assert contains(blocklist, '2001:db8::')
+    assert contains(blocklist, '2001:db8:ffff:ffff:ffff:ffff:ffff:ffff')
+    assert not contains(blocklist, '2001:db9::')
+    assert contains(blocklist, '2001:db9::1')
+    assert not contains(blocklist, '2001:db9::2')
+    assert len(blocklist._first[6]) == 2
+    # 10.0.0.1 as an integer is a valid IPv6 address too, but must not match
+    assert not contains(blocklist, '::a00:1')
+
+def test_empty_blocklist():
+    blocklist = compiled()
+
+    assert not contains(blocklist, '203.0.113.7')
+    assert not contains(blocklist, '2001:db8::1')
+
+def test_parse_network_normalizes():
+    assert parse_network(' 203.0.113.7 ') == '203.0.113.7'
+    assert parse_network('203.0.113.7/24') == '203.0.113.0/24'
+    assert parse_network('2001:DB8::1/128') == '2001:db8::1'
+    with pytest.raises(ValueError):
+        parse_network('not an address')
+
+@pytest.fixture
+def blocklist(flask_app, monkeypatch):
+    """IPBlocklist whose table version and compiled copies are scripted by the test"""
+    flask_app.config.update(IP_BLOCKLIST_POLL=0, IP_BLOCKLIST_MAX_AGE=3600)
+    extension = IPBlocklist(flask_app)
+    extension.versions = [1]
+    extension.compiled = []
+    monkeypatch.setattr(extension, 'version', lambda: extension.versions[-1])
+    monkeypatch.setattr(extension, 'compile', lambda: extension.compiled.pop(0))
+    return extension
+
+def test_recompiles_only_when_the_version_moves(blocklist):
+    blocklist.compiled = [compiled('203.0.113.0/24'), compiled('198.51.100.1')]
+
+    assert blocklist.is_blocked('203.0.113.9')
+    assert blocklist.is_blocked('::ffff:203.0.113.9')
+    assert not blocklist.is_blocked('not an address')
+    assert len(blocklist.compiled) == 1
+
+    blocklist.versions.append(2)
+    assert not blocklist.is_blocked('203.0.113.9')
+    assert blocklist.is_blocked('198.51.100.1')
+
+def test_recompiles_once_the_earliest_entry_expires(blocklist):
+    past = datetime.utcnow() - timedelta(seconds=1)
+    blocklist.compiled = [compiled('203.0.113.7', expires_at=past), compiled()]
+
+    assert blocklist.is_blocked('203.0.113.7')
+    assert not blocklist.is_blocked('203.0.113.7')  # same version, but the entry expired
+
+def test_recompiles_after_max_age(flask_app, blocklist):
+    blocklist.compiled = [compiled('203.0.113.7'), compiled()]
+    assert blocklist.is_blocked('203.0.113.7')
+
+    flask_app.config['IP_BLOCKLIST_MAX_AGE'] = 0
+    assert not blocklist.is_blocked('203.0.113.7')
+
+def test_fails_open_with_the_last_copy(blocklist, monkeypatch):
+    blocklist.compiled = [compiled('203.0.113.7')]
+    assert blocklist.is_blocked('203.0.113.7')
+
+    def unavailable():
+        raise ConnectionError('cache down')
+    monkeypatch.setattr(blocklist, 'version', unavailable)
+    assert blocklist.is_blocked('203.0.113.7')
+
+    blocklist._compiled = None
+    assert not blocklist.is_blocked('203.0.113.7')
@@ -0,0 +1,88 @@
+import threading
+import time
+from app import cache_tags
+from app.cache_tags import tagged_memoize, tag_stats
+from app.two_tier_cache import TwoTierCache
+
+def test_local_tier_is_bounded_lru(two_tier):
+    for name in ('a', 'b', 'c'):
+        two_tier.set(name, name.upper())
+    two_tier.get('a')  # now most recently used
+    two_tier.set('d', 'D')
+
+    assert two_tier.local_stats() == {'size': 3, 'max_size': 3}
+    assert two_tier._local_get('b') is None  # least recently used was evicted
+    assert two_tier._local_get('a') == 'A'
+    assert two_tier.get('b') == 'B'  # still served from Redis
+
+def test_reads_fall_through_to_redis_and_fill_local(redis_client, two_tier):
+    other_worker = TwoTierCache(redis_client)
+    other_worker.set('movie:1', {'title': 'Resident Evil'})
+
+    assert two_tier._local_get('movie:1') is None
+    assert two_tier.get('movie:1') == {'title': 'Resident Evil'}
+    assert two_tier._local_get('movie:1') == {'title': 'Resident Evil'}
+
+def test_local_copy_expires_after_local_timeout(redis_client, two_tier, monkeypatch):
+    two_tier.set('stats', 1)
+    TwoTierCache(redis_client).set('stats', 2)
+    assert two_tier.get('stats') == 1  # stale local copy within CACHE_LOCAL_TIMEOUT
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+    assert two_tier.get('stats') == 2
+
+def test_locks_and_generations_bypass_local_tier(redis_client, two_tier):
+    two_tier.set('tag-gen:movies', 1)
+    assert two_tier.add('lock:tagged:x', 1)
+    assert two_tier._local_get('tag-gen:movies') is None
+    assert two_tier._local_get('lock:tagged:x') is None
+
+    other_worker = TwoTierCache(redis_client)
+    assert not other_worker.add('lock:tagged:x', 1)
+    other_worker.inc('tag-gen:movies')
+    assert two_tier.get('tag-gen:movies') == 2
+
+def test_concurrent_misses_compute_once(flask_app):
+    calls = []
+
+    @tagged_memoize('movies')
+    def slow_listing():
+        calls.append(1)
+        time.sleep(0.3)
+        return ['Apocalypse', 'Extinction']
+
+    results = []
+
+    def worker():
+        with flask_app.app_context():
+            results.append(slow_listing())
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [['Apocalypse', 'Extinction']] * 5
+
+def test_early_refresh_near_expiry(flask_app, monkeypatch):
+    calls = []
+
+    @tagged_memoize('early-refresh', timeout=1)
+    def listing():
+        calls.append(1)
+        time.sleep(0.05)
+        return len(calls)
+
+    assert listing() == 1
+    # random() -> 0 gives -log(1) == 0: a plain hit before expiry
+    monkeypatch.setattr(cache_tags.random, 'random', lambda: 0.0)
+    assert listing() == 1
+    # random() -> ~1 gives -log(~0) ~ 27, and 27 * 0.05s of compute time
+    # reaches past the remaining second, so the reader refreshes early
+    monkeypatch.setattr(cache_tags.random, 'random', lambda: 1 - 1e-12)
+    assert listing() == 2
+    assert len(calls) == 2
+    assert tag_stats()['early-refresh']['early_refreshes'] == 1